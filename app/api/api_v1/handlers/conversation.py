@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
 from fastapi.security import HTTPBearer
 from app.models.conversation_model import Conversation
+from app.schemas.conversation_schema import MessagePage
 
-from app.services.conversation_service import ConversationService
+from app.services.conversation_service import ConversationService, MAX_MESSAGES
+from app.utils.pagination import parse_cursor
 
 conversation_router = APIRouter(dependencies=[Depends(HTTPBearer())])
 
@@ -17,6 +22,15 @@ async def get_conversations(request: Request) -> Conversation:
     return conversations
 
 
+@conversation_router.get("/{user_id}/messages", summary="Get a page of recent messages")
+async def get_messages(request: Request, user_id: str, limit: int = Query(20, ge=1, le=MAX_MESSAGES),
+                       before: Optional[datetime] = None, before_id: Optional[str] = None) -> MessagePage:
+    user = request.state.user
+    if user_id != user.user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    return await ConversationService.get_message_page(user.user_id, limit, before, parse_cursor(before_id))
+
+
 @conversation_router.delete("/{user_id}", summary="Delete conversation by id")
 async def delete_conversation(request: Request, user_id: str) -> dict[str, str]:
     user = request.state.user
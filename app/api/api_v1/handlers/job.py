@@ -1,12 +1,12 @@
 import uuid
-from typing import List
+from typing import List, Optional
 
 import aiohttp
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
 from fastapi.security import HTTPBearer
 from app.core.config import settings, manager
 
-from app.models.conversation_model import Conversation, Message
+from app.models.conversation_model import Message
 from app.models.job_model import Job
 from app.schemas.job_schema import JobIn, JobOut, JobRequest, JobUpdate
 from app.schemas.product_schema import ProductOut, ProductCard
@@ -14,14 +14,21 @@ from app.services.conversation_service import ConversationService
 from app.services.job_service import JobService
 from app.services.product_service import ProductService
 from app.core.logger import logger
+from app.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response, set_next_cursor
 from app.utils.utils import extract_asin_from_url
 
 job_router = APIRouter(dependencies=[Depends(HTTPBearer())])
 
 
 @job_router.get("/", summary="Get all jobs", response_model=List[JobOut] or HTTPException)
-async def get_jobs(request: Request) -> List[JobOut]:
-    return await JobService.get_jobs()
+async def get_jobs(request: Request, response: Response,
+                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                   after: Optional[str] = None, stream: bool = False) -> List[JobOut]:
+    if stream:
+        return ndjson_response(JobService.stream_jobs(after))
+    jobs, next_cursor = await JobService.get_jobs_page(limit, after)
+    set_next_cursor(response, next_cursor)
+    return jobs
 
 
 @job_router.get("/{job_id}", summary="Get job by id", response_model=JobOut or HTTPException)
@@ -51,25 +58,18 @@ async def create_job(request: Request, job: JobRequest):
         clean_url = f"https://www.amazon.com/dp/{asin}"
         user = request.state.user
         user_id = user.user_id
-        user_conversation = await ConversationService.get_conversation_by_user_id(user_id)
-        if not user_conversation:
-            conversation = Conversation(user_id=user_id, messages=[])
-            user_conversation = await ConversationService.create_conversation(conversation)
         user_message = Message(
             role="user",
             content=clean_url,
         )
-        user_conversation.messages.append(user_message)
-        product = await ProductService.get_product_by_id(asin)
-        if product is not None:
-            productOut = ProductCard(**product.dict())
+        productOut = await ProductService.get_product_view(asin, ProductCard)
+        if productOut is not None:
             assistant_message = Message(
                 role="assistant",
                 content="Here is the product you requested",
                 products=[productOut],
             )
-            user_conversation.messages.append(assistant_message)
-            await ConversationService.update_conversation(user_id, user_conversation)
+            await ConversationService.append_messages(user_id, [user_message, assistant_message])
             return {"message": "Here is the product you requested", "products": [productOut]}
 
         new_job = Job(
@@ -95,7 +95,7 @@ async def create_job(request: Request, job: JobRequest):
             async with session.post(scraper_url, data=data) as response:
                 if response.status != 200:
                     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to post job to scraper")
-        await ConversationService.update_conversation(user_id, user_conversation)
+        await ConversationService.append_messages(user_id, [user_message])
         return created_job
 
     except HTTPException as e:
@@ -112,5 +112,11 @@ async def get_jobs_by_user(request: Request, user_id: str):
 
 
 @job_router.get("/by-status/{status}", summary="Get jobs by status", response_model=List[JobOut] or HTTPException)
-async def get_jobs_by_status(request: Request, status: str):
-    return await JobService.get_jobs_by_status(status)
+async def get_jobs_by_status(request: Request, status: str, response: Response,
+                             limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             after: Optional[str] = None, stream: bool = False):
+    if stream:
+        return ndjson_response(JobService.stream_jobs(after, status))
+    jobs, next_cursor = await JobService.get_jobs_page(limit, after, status)
+    set_next_cursor(response, next_cursor)
+    return jobs
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.security import HTTPBearer
+
+from app.core.config import manager
+from app.core.prompts import prompt_registry
+from app.services.embedding_cache import embedding_store
+from app.services.lexical_search import lexical_search
+from app.services.llm_cache import llm_response_cache
+from app.services.llm_service import manager_context, openai_embedding_batcher
+from app.services.reranker import reranker
+from app.services.semantic_cache import semantic_cache
+from app.services.vector_search import vector_search
+
+metrics_router = APIRouter(dependencies=[Depends(HTTPBearer())])
+
+
+@metrics_router.get("/", summary="Get cache and prompt metrics")
+async def get_metrics(request: Request) -> dict:
+    return {
+        "prompts": prompt_registry.versions(),
+        "llm_response_cache": llm_response_cache.stats() if llm_response_cache else None,
+        "semantic_cache": semantic_cache.stats(),
+        "embedding_cache": embedding_store.stats(),
+        "embedding_batcher": openai_embedding_batcher.stats(),
+        "conversation_sessions": manager.sessions.stats(),
+        "manager_context": manager_context.stats(),
+        "vector_search": vector_search.stats(),
+        "lexical_search": lexical_search.stats(),
+        "reranker": reranker.stats(),
+    }
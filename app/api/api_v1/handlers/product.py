@@ -1,7 +1,7 @@
 import asyncio
 from datetime import datetime
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
 from fastapi.security import HTTPBearer
 
 from app.models.conversation_model import Conversation, Message
@@ -9,29 +9,41 @@ from app.models.product_error_model import ProductError
 from app.models.product_model import Product
 from app.services.conversation_service import ConversationService
 from app.services.product_service import ProductService, ProductErrorService
-from app.schemas.product_schema import ProductOut, ProductForUser
+from app.schemas.product_schema import ProductFilters, ProductOut, ProductForUser
 from app.services.llm_service import LLMService
 from app.core.logger import logger
+from app.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response, set_next_cursor
 from app.utils.utils import make_affiliate_link_from_asin
 
 product_router = APIRouter(dependencies=[Depends(HTTPBearer())])
 
 
 @product_router.get("/", summary="Get all products", response_model=List[ProductOut] or HTTPException)
-async def get_products(request: Request) -> List[Product]:
-    return await ProductService.get_products()
+async def get_products(request: Request, response: Response,
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       after: Optional[str] = None, stream: bool = False) -> List[ProductOut]:
+    if stream:
+        return ndjson_response(ProductService.stream_products(after))
+    products, next_cursor = await ProductService.get_products_page(limit, after)
+    set_next_cursor(response, next_cursor)
+    return products
 
 
 @product_router.get("/errors", summary="Get all product errors", response_model=List[ProductError] or HTTPException)
-async def get_product_errors(request: Request):
-    print("get_product_errors")
-    return await ProductErrorService.get_product_errors()
+async def get_product_errors(request: Request, response: Response,
+                             limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             after: Optional[str] = None, stream: bool = False):
+    if stream:
+        return ndjson_response(ProductErrorService.stream_product_errors(after))
+    product_errors, next_cursor = await ProductErrorService.get_product_errors_page(limit, after)
+    set_next_cursor(response, next_cursor)
+    return product_errors
 
 
 @product_router.get("/{product_id}", summary="Get product by id", response_model=ProductForUser or HTTPException)
 async def get_product(request: Request, product_id: str):
     try:
-        product = await ProductService.get_product_by_id(product_id)
+        product = await ProductService.get_product_view(product_id, ProductForUser)
         if not product:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
         return product
@@ -44,7 +56,7 @@ async def get_product(request: Request, product_id: str):
 @product_router.get("/{product_id}/card", summary="Get product by id", response_model=ProductForUser or HTTPException)
 async def get_product(request: Request, product_id: str):
     try:
-        product = await ProductService.get_product_by_id(product_id)
+        product = await ProductService.get_product_view(product_id, ProductForUser)
         if not product:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
         return product
@@ -76,7 +88,9 @@ async def search_similar_products(request: Request, body: dict):
             "reviews",
             "qa"
         ]
-        documents, message = await LLMService.find_similar_embeddings(Product.get_motor_collection(), embedding, excludes, query, 5)
+        filters = ProductFilters(**body["filters"]) if body.get("filters") else None
+        documents, message = await LLMService.find_similar_embeddings(embedding, excludes, query, 5,
+                                                                      lexical_query=query, filters=filters)
         return documents
     except Exception as e:
         logger.error(e)
@@ -96,9 +110,16 @@ async def chat_with_product(request: Request, product_id: str, body: dict):
 
 
 @product_router.put("/{product_id}", summary="Update product", response_model=Product or HTTPException)
-async def update_product(request: Request, product_id: str, product: Product):
+async def update_product(request: Request, product_id: str, product: Product,
+                         if_updated_at: Optional[datetime] = None):
+    # Pass the updated_at that was read as if_updated_at to fail with 409 instead of overwriting a newer write
     try:
-        return await ProductService.update_product(product_id, product)
+        updated_product = await ProductService.update_product(product_id, product, if_updated_at)
+        if not updated_product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        return updated_product
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Product not found")
@@ -118,8 +139,8 @@ async def regenerate_product(request: Request, product_id: str):
         product.generated_review = generated_review
         product.embedding = embedding
         product.embedding_text = embedding_text
-        product.updated_at = datetime.now()
-        return await ProductService.update_product(product_id, product)
+        return await ProductService.update_product(product_id, product,
+                                                   fields=["generated_review", "embedding", "embedding_text"])
 
     except Exception as e:
         logger.error(e)
@@ -144,16 +165,15 @@ async def chat_with_llm(request: Request, body: dict):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query not provided")
         user = request.state.user
         user_id = user.user_id
-        user_conversation = await ConversationService.get_conversation_by_user_id(user_id)
+        user_conversation = await ConversationService.get_recent_conversation(user_id)
         if not user_conversation:
-            conversation = Conversation(user_id=user_id, messages=[])
-            user_conversation = await ConversationService.create_conversation(conversation)
+            # The first append_messages call creates the conversation
+            user_conversation = Conversation(user_id=user_id, messages=[])
         user_message = Message(
             role="user",
             content=query,
         )
         response = await LLMService.get_action_from_llm(query, user_conversation)
-        user_conversation.messages.append(user_message)
         if isinstance(response, dict):
             if 'products' in response:
                 assistant_message = Message(
@@ -161,8 +181,7 @@ async def chat_with_llm(request: Request, body: dict):
                     content=response['message'],
                     products=response['products'],
                 )
-                user_conversation.messages.append(assistant_message)
-                await ConversationService.update_conversation(user_id, user_conversation)
+                await ConversationService.append_messages(user_id, [user_message, assistant_message])
                 return assistant_message
             else:
                 assistant_message = Message(
@@ -170,16 +189,14 @@ async def chat_with_llm(request: Request, body: dict):
                     content=response['message'],
                     related_products=response['related_products'],
                 )
-                user_conversation.messages.append(assistant_message)
-                await ConversationService.update_conversation(user_id, user_conversation)
+                await ConversationService.append_messages(user_id, [user_message, assistant_message])
                 return assistant_message
         else:
             assistant_message = Message(
                 role="assistant",
                 content=response,
             )
-            user_conversation.messages.append(assistant_message)
-            await ConversationService.update_conversation(user_id, user_conversation)
+            await ConversationService.append_messages(user_id, [user_message, assistant_message])
             return assistant_message
 
     except Exception as e:
@@ -193,7 +210,8 @@ async def fix_products(request: Request):
         for product in products:
             if '[' in product.affiliate_url:
                 product.affiliate_url = make_affiliate_link_from_asin(product.product_id)
-                update_product = await ProductService.update_product(product.product_id, product)
+                update_product = await ProductService.update_product(product.product_id, product,
+                                                                     fields=["affiliate_url"])
                 logger.info(f"Fixed product {update_product.affiliate_url}")
         return {"message": "Products fixed successfully"}
     except Exception as e:
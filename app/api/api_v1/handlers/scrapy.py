@@ -1,8 +1,7 @@
 import asyncio
 import json
-from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Request, BackgroundTasks
-from app.core.config import manager
+from app.core.config import manager, settings
 from app.schemas.llm_schema import ActionResponse
 from app.utils.utils import make_affiliate_link, make_affiliate_link_from_asin, parse_json
 from app.models.conversation_model import Message
@@ -15,9 +14,15 @@ from app.services.job_service import JobService
 from app.services.product_service import ProductService, ProductErrorService
 from app.services.llm_service import LLMService, GPT3, GEMINI_EMBEDDING, OPEN_AI_EMBEDDING, GEMINI
 from app.core.logger import logger
+from app.utils.pipeline import Pipeline, Stage
 
 scrapy_router = APIRouter()
 
+# Products per bulk write while ingesting a job
+INGEST_BATCH_SIZE = 50
+# Embeddings finish one at a time, the persist stage waits this long for them to fill a bulk write, in seconds
+INGEST_BATCH_WAIT = 1.0
+
 
 # the webscraper will send a POST request to this endpoint once it has finished its job
 @scrapy_router.post("/update", summary="Update job")
@@ -63,7 +68,6 @@ async def update_job(request: Request, job: dict, background_tasks: BackgroundTa
 async def handle_compare_products(updated_job):
     try:
         products_data = updated_job.result
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         job_id = updated_job.job_id
         products_ids = []
         for product_data in products_data:
@@ -73,7 +77,7 @@ async def handle_compare_products(updated_job):
             products_ids.append({"product_id": product_id})
             affiliate_url = make_affiliate_link(updated_job.url)
             product_data["affiliate_url"] = affiliate_url
-            existing_product = await ProductService.get_product_by_id(product_id)
+            existing_product = await ProductService.product_exists(product_id)
             if existing_product:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Product already exists")
             new_product = Product(**product_data)
@@ -92,33 +96,29 @@ async def handle_compare_products(updated_job):
             embedding = await LLMService.create_embedding(embedding_text)
             new_product.embedding = embedding
             new_product.embedding_text = embedding_text
-            new_product.updated_at = datetime.now()
-            await ProductService.update_product(product_id, new_product)
+            await ProductService.update_product(product_id, new_product, fields=["embedding", "embedding_text"])
         action = ActionResponse(
             action="compare_products",
             user_query=updated_job.user_query,
             products=products_ids
         )
-        response = await LLMService.compare_products(action, GPT3, user_conversation.user_id)
+        response = await LLMService.compare_products(action, GPT3, updated_job.user_id)
         assistant_message = Message(
             role="assistant",
             content=response['message'],
             related_products=response['related_products'],
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(user_conversation.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
         await JobService.delete_job(job_id)
     except Exception as e:
         logger.error("Error in handle_compare_products: ", e)
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         assistant_message = Message(
             role="assistant",
             content="Error comparing products, please try again.",
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(user_conversation.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
 
 
 async def handle_search_products(updated_job):
@@ -136,7 +136,8 @@ async def handle_search_products(updated_job):
         product_ids_json = await LLMService.validate_embedding_search(validate_products, updated_job.user_query)
         validated_products = parse_json(product_ids_json)
         if not validated_products:
-            product_ids_json = await LLMService.validate_embedding_search(validate_products, updated_job.user_query)
+            product_ids_json = await LLMService.validate_embedding_search(validate_products, updated_job.user_query,
+                                                                          use_cache=False)
             validated_products = parse_json(product_ids_json)
             if not validated_products:
                 logger.error("Bad response from LLM")
@@ -145,11 +146,9 @@ async def handle_search_products(updated_job):
         new_product_cards = [card for card in product_cards if card.product_id in validated_products["products"]][:5]
         message_content = validated_products.get("message", "Here are the matching products based on your search.")
 
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         assistant_message = Message(role="assistant", content=message_content, products=new_product_cards)
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(updated_job.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
 
         if new_product_cards:
             urls = ["https://www.amazon.com/dp/" + card.product_id for card in new_product_cards]
@@ -158,41 +157,21 @@ async def handle_search_products(updated_job):
 
         assistant_message = Message(role="assistant",
                                     content="We will fetch products details in the background for you. This may take a few seconds.")
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
         await JobService.delete_job(updated_job.job_id)
 
     except Exception as e:
         logger.error(f"Error in handle_multiple_products: {e}")
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         assistant_message = Message(role="assistant", content="Error processing search results, please try again.")
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(updated_job.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
 
 
 async def handle_get_basic_product_details(updated_job):
     try:
         if not updated_job.result:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No product data found in job")
-
-        product_data_tasks = []
-        use_gemini = True
-
-        for product_data in updated_job.result:
-            if product_data:
-                # Split up the tasks between the two models
-                # OpenAI seems to timeout on multiple requests
-                embedding_model = GEMINI_EMBEDDING if use_gemini else OPEN_AI_EMBEDDING
-                model = GEMINI if use_gemini else GPT3
-                task = process_product_data(product_data, updated_job, embedding_model=embedding_model, llm_model=model)
-                product_data_tasks.append(task)
-                use_gemini = not use_gemini
-        # Process the tasks in batches of 2
-        # This is to prevent timeouts
-        # TODO right now is this is the longest operation in the codebase
-        # Look into ways to speed this up
-        await process_in_batches(product_data_tasks, 2)
-
+        await ingest_products([product_data for product_data in updated_job.result if product_data], updated_job)
         await JobService.delete_job(updated_job.job_id)
 
     except Exception as e:
@@ -200,69 +179,114 @@ async def handle_get_basic_product_details(updated_job):
         await handle_error_in_conversation(updated_job, message="Error fetching product details, please try again.")
 
 
-async def process_in_batches(tasks, batch_size):
-    for i in range(0, len(tasks), batch_size):
-        batch = tasks[i:i + batch_size]
-        await asyncio.gather(*batch)
+async def ingest_products(products_data, updated_job):
+    """
+    Stores the scraped products of a job and generates their embeddings in a staged pipeline.
 
+    Products stream through store -> embedding text -> embed -> persist, each stage with its own workers. The
+    LLM and embedding calls are capped per provider, and the two database stages work on batches so a job
+    still costs a handful of bulk writes.
+    """
+    products_data = {product_data["product_id"]: product_data for product_data in products_data
+                     if product_data.get("product_id")}
+    # Split up the LLM calls between the two models, OpenAI seems to time out on multiple requests
+    items = [{"data": product_data, "llm_model": GEMINI if i % 2 == 0 else GPT3}
+             for i, product_data in enumerate(products_data.values())]
 
-async def process_product_data(product_data, updated_job, embedding_model=OPEN_AI_EMBEDDING, llm_model=GPT3):
-    try:
-        product_id = product_data.get("product_id")
-        affiliate_url = make_affiliate_link_from_asin(product_id)
-        product_data["affiliate_url"] = affiliate_url
-
-        existing_product = await ProductService.get_product_by_id(product_id)
-        if existing_product:
-            return
+    async def store(batch):
+        return await store_products(batch, updated_job)
 
-        new_product = Product(**product_data, user_id=updated_job.user_id)
-        new_product = await ProductService.create_product(new_product)
-        errors = await ProductService.validate_product(new_product)
+    async def generate_embedding_text(item):
+        item["embedding_text"] = await LLMService.generate_embedding_text(item["data"], item["llm_model"])
+        return item
 
-        if errors:
-            await handle_product_errors(product_id, updated_job.job_id, updated_job.user_id, errors)
-
-        embedding_text = await LLMService.generate_embedding_text(product_data, llm_model)
+    async def embed(item):
         # Needs to be OpenAI for now because the dimensions are already indexed with 1536 dimensions
-        embedding = await LLMService.create_embedding(embedding_text, OPEN_AI_EMBEDDING)
-
-        new_product.embedding = embedding
-        new_product.embedding_text = embedding_text
-        new_product.updated_at = datetime.now()
-
-        await ProductService.update_product(product_id, new_product)
-    except Exception as e:
-        title = product_data.get("title")
-        logger.error(f"Error in process_product_data: {e}")
-        await handle_error_in_conversation(updated_job,
-                                           message=f"Error processing product details for {title}, please try again.")
-
-
-async def handle_product_errors(product_id, job_id, user_id, errors):
-    new_product_error = ProductError(product_id=product_id, job_id=job_id, user_id=user_id, error=errors)
-    await ProductErrorService.create_product_error(new_product_error)
+        item["embedding"] = await LLMService.create_embedding(item["embedding_text"], OPEN_AI_EMBEDDING)
+        return item
+
+    async def persist(batch):
+        await ProductService.update_products_fields({
+            item["product"].product_id: {"embedding": item["embedding"], "embedding_text": item["embedding_text"]}
+            for item in batch
+        })
+        return batch
+
+    async def on_error(payload, error):
+        for item in payload if isinstance(payload, list) else [payload]:
+            title = item["data"].get("title")
+            await handle_error_in_conversation(
+                updated_job, message=f"Error processing product details for {title}, please try again.")
+
+    llm_limit = settings.INGEST_LLM_CONCURRENCY
+    embedding_limit = settings.INGEST_EMBEDDING_CONCURRENCY
+    pipeline = Pipeline(
+        [
+            Stage("store", store, batch_size=INGEST_BATCH_SIZE),
+            Stage("embedding_text", generate_embedding_text, workers=2 * llm_limit,
+                  provider=lambda item: item["llm_model"]),
+            Stage("embed", embed, workers=embedding_limit, provider=lambda item: OPEN_AI_EMBEDDING),
+            Stage("persist", persist, batch_size=INGEST_BATCH_SIZE, max_wait=INGEST_BATCH_WAIT),
+        ],
+        limits={GEMINI: llm_limit, GPT3: llm_limit, OPEN_AI_EMBEDDING: embedding_limit},
+        on_error=on_error,
+    )
+    await pipeline.run(items)
+
+
+async def store_products(items, updated_job):
+    """
+    Inserts the new products of a batch and records their validation errors, returns the items that were new.
+
+    Existing products are found with one $in query, new products are inserted with one bulk_write and their
+    validation errors with one insert_many.
+    """
+    existing_ids = await ProductService.existing_product_ids(item["data"]["product_id"] for item in items)
+    new_items = []
+    for item in items:
+        product_data = item["data"]
+        if product_data["product_id"] in existing_ids:
+            continue
+        product_data["affiliate_url"] = make_affiliate_link_from_asin(product_data["product_id"])
+        try:
+            item["product"] = Product(**product_data, user_id=updated_job.user_id)
+        except Exception as e:
+            title = product_data.get("title")
+            logger.error(f"Invalid product data for {product_data['product_id']}: {e}")
+            message = f"Error processing product details for {title}, please try again."
+            await handle_error_in_conversation(updated_job, message=message)
+            continue
+        new_items.append(item)
+    inserted = {product.product_id for product in
+                await ProductService.insert_products([item["product"] for item in new_items])}
+    new_items = [item for item in new_items if item["product"].product_id in inserted]
+
+    product_errors = []
+    for item in new_items:
+        errors = await ProductService.validate_product(item["product"])
+        if errors:
+            product_errors.append(ProductError(product_id=item["product"].product_id, job_id=updated_job.job_id,
+                                               user_id=updated_job.user_id, error=errors))
+    await ProductErrorService.create_product_errors(product_errors)
+    return new_items
 
 
 async def handle_error_in_conversation(updated_job, message="Error processing product details, please try again."):
-    user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
     assistant_message = Message(role="assistant", content=message)
-    user_conversation.messages.append(assistant_message)
-    await ConversationService.update_conversation(updated_job.user_id, user_conversation)
-    await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+    await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+    await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
 
 
 async def handle_get_product_details(updated_job):
     try:
         product_data = updated_job.result[0]
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         job_id = updated_job.job_id
         if not product_data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No product data found in job")
         product_id = product_data["product_id"]
         affiliate_url = make_affiliate_link(updated_job.url)
         product_data["affiliate_url"] = affiliate_url
-        existing_product = await ProductService.get_product_by_id(product_id)
+        existing_product = await ProductService.product_exists(product_id)
         if existing_product:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Product already exists")
         new_product = Product(**product_data)
@@ -282,30 +306,26 @@ async def handle_get_product_details(updated_job):
             user_query=updated_job.user_query,
             product_id=new_product.product_id
         )
-        response = await LLMService.get_product_details(action, GPT3, user_conversation.user_id)
+        response = await LLMService.get_product_details(action, GPT3, updated_job.user_id)
         assistant_message = Message(
             role="assistant",
             content=response['message'],
             related_products=response['related_products'],
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(user_conversation.user_id, user_conversation)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
         embedding_text = await LLMService.generate_embedding_text(product_data)
         embedding = await LLMService.create_embedding(embedding_text)
         new_product.embedding = embedding
         new_product.embedding_text = embedding_text
-        new_product.updated_at = datetime.now()
-        await ProductService.update_product(product_id, new_product)
+        await ProductService.update_product(product_id, new_product, fields=["embedding", "embedding_text"])
         await JobService.delete_job(job_id)
     except Exception as e:
         logger.error("Error in handle_get_product_details: ", e)
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         assistant_message = Message(
             role="assistant",
             content="Error processing product details, please try again.",
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(user_conversation.user_id, user_conversation)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
 
 
 async def handle_links(updated_job):
@@ -317,21 +337,19 @@ async def handle_links(updated_job):
         product_id = product_data["product_id"]
         affiliate_url = make_affiliate_link(updated_job.url)
         product_data["affiliate_url"] = affiliate_url
-        existing_product = await ProductService.get_product_by_id(product_id)
+        existing_product = await ProductService.product_exists(product_id)
         if existing_product:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Product already exists")
         new_product = Product(**product_data)
         new_product.user_id = updated_job.user_id
-        user_conversation = await ConversationService.get_conversation_by_user_id(new_product.user_id)
         productOut = ProductCard(**new_product.dict())
         assistant_message = Message(
             role="assistant",
             content="Here is the product you requested",
             products=[productOut],
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(new_product.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
         new_product = await ProductService.create_product(new_product)
         errors = await ProductService.validate_product(new_product)
         if len(errors) > 0:
@@ -352,16 +370,13 @@ async def handle_links(updated_job):
         # new_product.generated_review = generated_review
         new_product.embedding = embedding
         new_product.embedding_text = embedding_text
-        new_product.updated_at = datetime.now()
-        await ProductService.update_product(product_id, new_product)
+        await ProductService.update_product(product_id, new_product, fields=["embedding", "embedding_text"])
         await JobService.delete_job(job_id)
     except Exception as e:
         logger.error("Error in handle_links: ", e)
-        user_conversation = await ConversationService.get_conversation_by_user_id(updated_job.user_id)
         assistant_message = Message(
             role="assistant",
             content="Error processing product details, please try again.",
         )
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(updated_job.user_id, user_conversation)
-        await manager.send_personal_json(assistant_message.json(), user_conversation.user_id)
+        await ConversationService.append_messages(updated_job.user_id, [assistant_message])
+        await manager.send_personal_json(assistant_message.json(), updated_job.user_id)
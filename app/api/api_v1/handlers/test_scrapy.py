@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.api_v1.handlers import scrapy
+from app.models.product_error_model import ProductError
+from app.models.product_model import Product
+from app.services import product_service
+from app.utils.utils import make_affiliate_link_from_asin
+
+
+def product_data(product_id, **fields):
+    values = dict(product_id=product_id, job_id="job", domain="www.amazon.com", title=f"Laptop {product_id}",
+                  description="Laptop", price=379.0, image_url="https://example.com/image.jpg",
+                  specs={"RAM": "8 GB"}, features=["15.6 inch display"], reviews=[], rating=4.3)
+    return {**values, **fields}
+
+
+@pytest.fixture
+def collections(fake_collection, monkeypatch):
+    monkeypatch.setattr(product_service, "index_product", lambda product_id, fields: None)
+    return fake_collection(Product), fake_collection(ProductError)
+
+
+def test_store_products_inserts_new_products_and_batches_their_errors(collections, monkeypatch):
+    products, product_errors = collections
+    products.documents.append({"product_id": "B0BSHF7WHW", "title": "Stored by an earlier job"})
+    messages = []
+
+    async def handle_error_in_conversation(updated_job, message):
+        messages.append(message)
+
+    monkeypatch.setattr(scrapy, "handle_error_in_conversation", handle_error_in_conversation)
+    items = [
+        {"data": product_data("B0CV5J4ZTD")},
+        {"data": product_data("B0BSHF7WHW")},
+        # A product without a price cannot be built and is dropped
+        {"data": product_data("B0B2MLLZ8J", price=None)},
+        {"data": product_data("B07W6JN8V8", specs={}, features=[])},
+        {"data": product_data("B0C1ZJ5CZK", price=0.0)},
+    ]
+    job = SimpleNamespace(job_id="job", user_id="user-1")
+
+    stored = asyncio.run(scrapy.store_products(items, job))
+    assert [item["product"].product_id for item in stored] == ["B0CV5J4ZTD", "B07W6JN8V8", "B0C1ZJ5CZK"]
+    assert stored[0]["product"].user_id == "user-1"
+    assert stored[0]["product"].affiliate_url == make_affiliate_link_from_asin("B0CV5J4ZTD")
+    assert messages == ["Error processing product details for Laptop B0B2MLLZ8J, please try again."]
+
+    # One $in lookup, one bulk_write and one insert_many for the whole batch
+    assert (products.count("find"), products.count("bulk_write")) == (1, 1)
+    assert product_errors.count("insert_many") == 1
+    errors = {document["product_id"]: document["error"] for document in product_errors.documents}
+    assert errors == {"B07W6JN8V8": ["Features are required", "Specs are required"],
+                      "B0C1ZJ5CZK": ["Price must be greater than 0"]}
+    assert products.documents[0] == {"product_id": "B0BSHF7WHW", "title": "Stored by an earlier job"}
+
+
+def test_store_products_without_errors_skips_the_error_write(collections, monkeypatch):
+    products, product_errors = collections
+    stored = asyncio.run(scrapy.store_products([{"data": product_data("B0CV5J4ZTD")}],
+                                               SimpleNamespace(job_id="job", user_id="user-1")))
+    assert len(stored) == 1
+    assert product_errors.calls == []
@@ -1,5 +1,5 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
 from fastapi.security import HTTPBearer
 from app.models.user_model import User
 from app.schemas.user_schema import UserOut, Auth0User
@@ -7,13 +7,20 @@ from app.services.user_service import UserService
 from app.core.logger import logger
 from app.api.deps.user_deps import get_current_user
 from app.core.security import auth
+from app.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response, set_next_cursor
 
 user_router = APIRouter(dependencies=[Depends(HTTPBearer())])
 
 
 @user_router.get("/", summary="Get all users", response_model=List[UserOut] or HTTPException)
-async def get_users(request: Request) -> List[UserOut]:
-    return await UserService.get_users()
+async def get_users(request: Request, response: Response,
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    after: Optional[str] = None, stream: bool = False) -> List[UserOut]:
+    if stream:
+        return ndjson_response(UserService.stream_users(after))
+    users, next_cursor = await UserService.get_users_page(limit, after)
+    set_next_cursor(response, next_cursor)
+    return users
 
 
 @user_router.get("/by-email/{email}", summary="Get user by email", response_model=UserOut)
@@ -4,6 +4,7 @@ from app.api.api_v1.handlers import job
 from app.api.api_v1.handlers import product
 from app.api.api_v1.handlers import conversation
 from app.api.api_v1.handlers import scrapy
+from app.api.api_v1.handlers import metrics
 from app.core.config import settings
 
 router = APIRouter()
@@ -12,4 +13,4 @@ router.include_router(job.job_router, prefix=settings.API_V1_STR + "/jobs", tags
 router.include_router(product.product_router, prefix=settings.API_V1_STR + "/products", tags=["products"])
 router.include_router(scrapy.scrapy_router, prefix=settings.API_V1_STR + "/scrapy", tags=["scrapy"])
 router.include_router(conversation.conversation_router, prefix=settings.API_V1_STR + "/conversations", tags=["conversations"])
-
+router.include_router(metrics.metrics_router, prefix=settings.API_V1_STR + "/metrics", tags=["metrics"])
@@ -3,10 +3,21 @@ from app.models.user_model import User
 from app.services.user_service import UserService
 from app.schemas.user_schema import Auth0User
 from app.core.security import auth
+from app.utils.cache import SingleFlight
+
+# A burst of first requests from a new user shares one Mongo lookup and one userinfo call
+user_lookups = SingleFlight()
 
 
 async def get_current_user(auth_result: dict, token: str) -> User:
     email = auth_result["email"]
+    user = UserService.get_cached_user_by_email(email)
+    if user is not None:
+        return user
+    return await user_lookups.do(email, lambda: load_user(email, token))
+
+
+async def load_user(email: str, token: str) -> User:
     user = await UserService.get_user_by_email(email)
     if not user:
         user_profile = await auth.get_user_profile(token)
@@ -1,3 +1,5 @@
+import json
+
 from fastapi import FastAPI, Depends, HTTPException, status, Security, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
@@ -9,9 +11,13 @@ from app.api.api_v1.router import router
 from app.core.logger import logger
 from app.core.middlewares import AuthMiddleware
 from app.core.config import init_db
+from app.core.llm_clients import llm_clients
+from app.core.prompts import prompt_registry
 from app.services.conversation_service import ConversationService
 from app.services.job_service import JobService
 from app.services.llm_service import LLMService, GPT3
+from app.services.lexical_search import lexical_search
+from app.services.vector_search import vector_search
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -32,21 +38,24 @@ allowed_origins = [
 
 
 # TODO: Refactor this to not have if else statements
-async def chat_with_llm(query, user_id, model):
+async def chat_with_llm(query, user_id, model, use_cache=True, on_delta=None):
+    user_message = None
     try:
         if not query:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query not provided")
-        user_conversation = await ConversationService.get_conversation_by_user_id(user_id)
+        # Connected users are served from the session cache, Mongo is only read for users without a session
+        user_conversation = manager.sessions.get(user_id)
+        if user_conversation is None:
+            user_conversation = await ConversationService.get_recent_conversation(user_id)
         if not user_conversation:
-            conversation = Conversation(user_id=user_id, messages=[])
-            user_conversation = await ConversationService.create_conversation(conversation)
+            # The first append_messages call creates the conversation
+            user_conversation = Conversation(user_id=user_id, messages=[])
         user_message = Message(
             role="user",
             content=query,
         )
         user_conversation.messages.append(user_message)
-        await ConversationService.update_conversation(user_id, user_conversation)
-        response = await LLMService.get_action_from_llm(query, user_conversation, model)
+        response = await LLMService.get_action_from_llm(query, user_conversation, model, use_cache, on_delta)
         if isinstance(response, dict):
             if 'products' in response:
                 assistant_message = Message(
@@ -54,35 +63,31 @@ async def chat_with_llm(query, user_id, model):
                     content=response['message'],
                     products=response['products'],
                 )
-                user_conversation.messages.append(assistant_message)
-                await ConversationService.update_conversation(user_id, user_conversation)
-                return assistant_message
             else:
                 assistant_message = Message(
                     role="assistant",
                     content=response['message'],
                     related_products=response['related_products'],
                 )
-                user_conversation.messages.append(assistant_message)
-                await ConversationService.update_conversation(user_id, user_conversation)
-                return assistant_message
         else:
             assistant_message = Message(
                 role="assistant",
                 content=response,
             )
-            user_conversation.messages.append(assistant_message)
-            await ConversationService.update_conversation(user_id, user_conversation)
-            return assistant_message
+        # The whole turn is persisted once, after the answer is complete
+        await ConversationService.append_messages(user_id, [user_message, assistant_message])
+        return assistant_message
 
     except Exception as e:
         assistant_message = Message(
             role="assistant",
             content="I'm sorry, I encountered an error while processing your request"
         )
-        user_conversation = await ConversationService.get_conversation_by_user_id(user_id)
-        user_conversation.messages.append(assistant_message)
-        await ConversationService.update_conversation(user_id, user_conversation)
+        try:
+            messages = [user_message, assistant_message] if user_message else [assistant_message]
+            await ConversationService.append_messages(user_id, messages)
+        except Exception as save_error:
+            logger.error(f"Unable to save the error message: {save_error}")
         logger.error(e)
         return assistant_message
 
@@ -108,7 +113,15 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             elif data.get("type") == "message":
                 message = data.get("message")
                 model = data.get("model")
-                response = await chat_with_llm(message, user_id, model)
+                # Clients can send "cache": false to skip the semantic search cache
+                use_cache = data.get("cache", True)
+                on_delta = None
+                # Clients that send "stream": true get the answer as {"type": "delta"} frames first,
+                # the complete message with its product cards always follows as the last frame
+                if data.get("stream", False):
+                    async def on_delta(delta):
+                        await manager.send_personal_json(json.dumps({"type": "delta", "content": delta}), user_id)
+                response = await chat_with_llm(message, user_id, model, use_cache, on_delta)
                 await manager.send_personal_json(response.json(), user_id)
             elif data.get("type") == "link":
                 url = data.get("url")
@@ -124,18 +137,29 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         manager.disconnect(user_id)  # Clean up on disconnect
         print(f"User {user_id} disconnected")
     except Exception as e:
+        manager.disconnect(user_id)
         print(f"Error with WebSocket for user {user_id}: {e}")
         # await websocket.close(code=1011)  # Internal server error code
 
 
 @app.on_event("startup")
 async def app_startup():
+    prompt_registry.load()
+    llm_clients.start()
     try:
         await init_db()
+        await vector_search.load()
+        await lexical_search.load()
     except Exception as e:
         logger.error(f"An error occurred while connecting to database: {e}")
 
 
+@app.on_event("shutdown")
+async def app_shutdown():
+    await auth.close()
+    await llm_clients.close()
+
+
 # Not sure if this is working
 @app.exception_handler(Exception)
 async def exception_handler(request: Request, exc: Exception):
@@ -0,0 +1,176 @@
+from types import SimpleNamespace
+
+import pytest
+from beanie.odm.settings.document import DocumentSettings
+from bson import ObjectId
+
+
+def matches(document: dict, query: dict) -> bool:
+    for name, condition in query.items():
+        if name == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif name == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            value = document.get(name)
+            for operator, operand in condition.items():
+                if operator == "$exists" and (name in document) != operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+                if operator in ("$lt", "$lte", "$gt", "$gte") and value is None:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+        elif document.get(name) != condition:
+            return False
+    return True
+
+
+def project(document: dict, projection: dict) -> dict:
+    included = {name for name, value in projection.items() if value}
+    if included:
+        # _id is returned unless it is excluded explicitly
+        fields = included | ({"_id"} if projection.get("_id", 1) else set())
+        return {name: value for name, value in document.items() if name in fields}
+    return {name: value for name, value in document.items() if projection.get(name, 1)}
+
+
+class FakeCursor:
+    def __init__(self, documents: list, projection: dict):
+        self.documents = documents
+        self.projection = projection
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction or 1)]
+        for name, order in reversed(keys):
+            self.documents.sort(key=lambda document: document[name], reverse=order < 0)
+        return self
+
+    def limit(self, limit: int):
+        self.documents = self.documents[:limit]
+        return self
+
+    async def to_list(self, length=None):
+        return [project(document, self.projection) for document in self.documents[:length]]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield project(document, self.projection)
+
+
+class FakeCollection:
+    """
+    The subset of a motor collection the services use, held in memory. Every call is recorded in calls as
+    (method, arguments).
+    """
+
+    def __init__(self, documents=()):
+        self.documents = [dict(document) for document in documents]
+        self.calls = []
+
+    def _find(self, query: dict) -> list:
+        return [document for document in self.documents if matches(document, query)]
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool = False) -> SimpleNamespace:
+        found = self._find(query)
+        if not many:
+            found = found[:1]
+        upserted_id = None
+        if not found and upsert:
+            fields = {name: value for name, value in query.items() if not name.startswith("$")}
+            document = {"_id": ObjectId(), **fields, **update.get("$setOnInsert", {})}
+            self.documents.append(document)
+            upserted_id = document["_id"]
+            found = [document]
+            matched = 0
+        else:
+            matched = len(found)
+        for document in found:
+            document.update(update.get("$set", {}))
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    def find(self, query=None, projection=None, batch_size=None):
+        self.calls.append(("find", query))
+        return FakeCursor(self._find(query or {}), projection or {})
+
+    async def find_one(self, query, projection=None):
+        self.calls.append(("find_one", query))
+        found = self._find(query)
+        return project(found[0], projection or {}) if found else None
+
+    async def insert_one(self, document):
+        self.calls.append(("insert_one", document))
+        document.setdefault("_id", ObjectId())
+        self.documents.append(dict(document))
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, ordered=True, session=None):
+        self.calls.append(("insert_many", documents))
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            self.documents.append(dict(document))
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append(("update_one", query))
+        return self._update(query, update, upsert)
+
+    async def update_many(self, query, update, upsert=False):
+        self.calls.append(("update_many", query))
+        return self._update(query, update, upsert, many=True)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append(("bulk_write", operations))
+        upserted_ids = {}
+        for index, operation in enumerate(operations):
+            result = self._update(operation._filter, operation._doc, operation._upsert)
+            if result.upserted_id is not None:
+                upserted_ids[index] = result.upserted_id
+        return SimpleNamespace(upserted_ids=upserted_ids)
+
+    async def delete_many(self, query):
+        self.calls.append(("delete_many", query))
+        self.documents = [document for document in self.documents if not matches(document, query)]
+
+    async def find_one_and_delete(self, query, projection=None):
+        self.calls.append(("find_one_and_delete", query))
+        found = self._find(query)
+        if not found:
+            return None
+        self.documents.remove(found[0])
+        return project(found[0], projection or {})
+
+    def count(self, method: str) -> int:
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+@pytest.fixture
+def fake_collection(monkeypatch):
+    """
+    Backs a Beanie document with a FakeCollection instead of init_beanie, use as fake_collection(Product).
+    """
+
+    def patch(document, documents=()):
+        collection = FakeCollection(documents)
+        settings = DocumentSettings(name=getattr(document.Settings, "name", document.__name__),
+                                    bson_encoders=getattr(document.Settings, "bson_encoders", {}))
+        settings.motor_collection = collection
+        monkeypatch.setattr(document, "get_settings", classmethod(lambda cls: settings))
+        return collection
+
+    return patch
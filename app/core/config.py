@@ -5,11 +5,14 @@ from decouple import config
 from typing import List, Dict
 from pydantic import AnyHttpUrl
 from app.core.logger import logger
+from app.core.sessions import ConversationSessionCache
 from app.models.job_model import Job
 from app.models.product_model import Product
 from app.models.user_model import User
 from app.models.product_error_model import ProductError
-from app.models.conversation_model import Conversation
+from app.models.conversation_model import ChatMessage, Conversation
+from app.models.llm_cache_model import LLMResponseCacheEntry
+from app.models.embedding_cache_model import EmbeddingCacheEntry
 from fastapi import WebSocket
 
 
@@ -29,6 +32,66 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str = config('GEMINI_API_KEY', cast=str)
     SCRAPER_URL: str = config('SCRAPER_URL', cast=str)
     GROQ_API_KEY: str = config('GROQ_API_KEY', cast=str)
+    JWKS_REFRESH_INTERVAL: int = config('JWKS_REFRESH_INTERVAL', default=3600, cast=int)
+    TOKEN_CACHE_SIZE: int = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+    USER_CACHE_SIZE: int = config('USER_CACHE_SIZE', default=10000, cast=int)
+    USER_CACHE_TTL: int = config('USER_CACHE_TTL', default=300, cast=int)
+    LLM_POOL_SIZE: int = config('LLM_POOL_SIZE', default=20, cast=int)
+    LLM_KEEPALIVE_EXPIRY: float = config('LLM_KEEPALIVE_EXPIRY', default=30.0, cast=float)
+    LLM_TIMEOUT: float = config('LLM_TIMEOUT', default=60.0, cast=float)
+    LLM_CONNECT_TIMEOUT: float = config('LLM_CONNECT_TIMEOUT', default=5.0, cast=float)
+    LLM_MAX_RETRIES: int = config('LLM_MAX_RETRIES', default=2, cast=int)
+    LLM_HTTP2: bool = config('LLM_HTTP2', default=True, cast=bool)
+    # Seconds between prompt file mtime checks, 0 turns hot reloading off
+    PROMPT_RELOAD_INTERVAL: float = config('PROMPT_RELOAD_INTERVAL', default=0.0, cast=float)
+    LLM_CACHE_ENABLED: bool = config('LLM_CACHE_ENABLED', default=True, cast=bool)
+    LLM_CACHE_MAX_BYTES: int = config('LLM_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+    LLM_CACHE_MONGO: bool = config('LLM_CACHE_MONGO', default=False, cast=bool)
+    LLM_CACHE_TTL: int = config('LLM_CACHE_TTL', default=7 * 24 * 3600, cast=int)
+    SEMANTIC_CACHE_ENABLED: bool = config('SEMANTIC_CACHE_ENABLED', default=True, cast=bool)
+    SEMANTIC_CACHE_THRESHOLD: float = config('SEMANTIC_CACHE_THRESHOLD', default=0.95, cast=float)
+    SEMANTIC_CACHE_TTL: int = config('SEMANTIC_CACHE_TTL', default=3600, cast=int)
+    SEMANTIC_CACHE_SIZE: int = config('SEMANTIC_CACHE_SIZE', default=5000, cast=int)
+    EMBEDDING_CACHE_SIZE: int = config('EMBEDDING_CACHE_SIZE', default=5000, cast=int)
+    EMBEDDING_CACHE_MONGO: bool = config('EMBEDDING_CACHE_MONGO', default=True, cast=bool)
+    EMBEDDING_BATCH_SIZE: int = config('EMBEDDING_BATCH_SIZE', default=64, cast=int)
+    EMBEDDING_BATCH_TOKENS: int = config('EMBEDDING_BATCH_TOKENS', default=50000, cast=int)
+    EMBEDDING_BATCH_WAIT: float = config('EMBEDDING_BATCH_WAIT', default=0.005, cast=float)
+    # Recent messages kept in memory per connected user, the manager prompt only uses the last 10
+    SESSION_CACHE_MESSAGES: int = config('SESSION_CACHE_MESSAGES', default=10, cast=int)
+    SESSION_CACHE_IDLE_TTL: int = config('SESSION_CACHE_IDLE_TTL', default=1800, cast=int)
+    # Prompt token budget of the manager for models without their own budget
+    CONTEXT_TOKEN_BUDGET: int = config('CONTEXT_TOKEN_BUDGET', default=4000, cast=int)
+    # Messages that must have left the context window before the summary is updated
+    SUMMARY_MIN_MESSAGES: int = config('SUMMARY_MIN_MESSAGES', default=6, cast=int)
+    # Concurrent calls per LLM provider and to the embedding API while ingesting scraped products
+    INGEST_LLM_CONCURRENCY: int = config('INGEST_LLM_CONCURRENCY', default=4, cast=int)
+    INGEST_EMBEDDING_CONCURRENCY: int = config('INGEST_EMBEDDING_CONCURRENCY', default=8, cast=int)
+    # Where product embeddings are searched: atlas ($vectorSearch), local (exact, in-process NumPy matrix) or
+    # hnsw (approximate in-process graph, needs hnswlib)
+    VECTOR_SEARCH_BACKEND: str = config('VECTOR_SEARCH_BACKEND', default='atlas', cast=str)
+    VECTOR_SEARCH_INDEX: str = config('VECTOR_SEARCH_INDEX', default='vector_index', cast=str)
+    VECTOR_SEARCH_CANDIDATES: int = config('VECTOR_SEARCH_CANDIDATES', default=100, cast=int)
+    # How new product embeddings are stored: array (BSON doubles, needed by Atlas $vectorSearch), float32 (packed
+    # binData, a third of the size) or int8 (quantized, a thirteenth). Existing products are rewritten with
+    # python -m app.migrations.pack_product_embeddings
+    EMBEDDING_STORAGE: str = config('EMBEDDING_STORAGE', default='array', cast=str)
+    # Seconds between reloads of the products other instances updated, for the in-process vector and keyword indexes
+    VECTOR_INDEX_REFRESH_INTERVAL: float = config('VECTOR_INDEX_REFRESH_INTERVAL', default=60.0, cast=float)
+    # In-process BM25 index fused with the vector results of product searches
+    LEXICAL_SEARCH_ENABLED: bool = config('LEXICAL_SEARCH_ENABLED', default=True, cast=bool)
+    # Products taken from each of the vector and keyword rankings before fusing them
+    HYBRID_SEARCH_CANDIDATES: int = config('HYBRID_SEARCH_CANDIDATES', default=50, cast=int)
+    HYBRID_SEARCH_RRF_K: int = config('HYBRID_SEARCH_RRF_K', default=60, cast=int)
+    # Local relevance scoring of search results, the LLM only validates the products scored between reject and
+    # accept. Tune them with python -m benchmarks.eval_reranker
+    RERANK_ACCEPT: float = config('RERANK_ACCEPT', default=0.7, cast=float)
+    RERANK_REJECT: float = config('RERANK_REJECT', default=0.35, cast=float)
+    # Vector scores of unrelated products and of clear matches
+    RERANK_VECTOR_FLOOR: float = config('RERANK_VECTOR_FLOOR', default=0.9, cast=float)
+    RERANK_VECTOR_CEILING: float = config('RERANK_VECTOR_CEILING', default=0.95, cast=float)
+    # When set, every search is validated by the LLM and recorded to this JSON lines file for the evaluation
+    RERANK_RECORD_PATH: str = config('RERANK_RECORD_PATH', default='', cast=str)
 
     class Config:
         case_sensitive = True
@@ -49,7 +112,10 @@ async def init_db():
             Job,  # Ensure Job is imported
             Product,  # Ensure Product is imported
             ProductError,
-            Conversation
+            Conversation,
+            ChatMessage,
+            LLMResponseCacheEntry,
+            EmbeddingCacheEntry,
         ],
     )
     logger.info("Connected to MongoDB")
@@ -59,14 +125,18 @@ async def init_db():
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.sessions = ConversationSessionCache(max_messages=settings.SESSION_CACHE_MESSAGES,
+                                                 idle_ttl=settings.SESSION_CACHE_IDLE_TTL)
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
         self.active_connections[user_id] = websocket
+        await self.sessions.open(user_id)
 
     def disconnect(self, user_id: str):
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        self.sessions.evict(user_id)
 
     async def send_personal_message(self, message: str, user_id: str):
         if user_id in self.active_connections:
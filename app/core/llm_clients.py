@@ -0,0 +1,97 @@
+from typing import List, Optional
+
+import google.generativeai as genai
+import httpx
+from groq import AsyncGroq
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.core.logger import logger
+
+try:
+    import h2  # noqa: F401 httpx only needs it to be importable to negotiate HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMClients:
+    """
+    Provider clients shared by the whole app, created once at startup and closed on shutdown.
+
+    Each provider gets its own keep-alive connection pool, so requests reuse connections instead of
+    paying for a new TLS handshake per completion. Clients are also created lazily, so scripts that
+    never run the app startup can still use them.
+    """
+
+    def __init__(self):
+        self._openai: Optional[AsyncOpenAI] = None
+        self._groq: Optional[AsyncGroq] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_clients: List[httpx.AsyncClient] = []
+        self._gemini_configured = False
+
+    def _http_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.LLM_POOL_SIZE,
+            max_keepalive_connections=settings.LLM_POOL_SIZE,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+        client = httpx.AsyncClient(http2=settings.LLM_HTTP2 and HTTP2_AVAILABLE, limits=limits, timeout=timeout)
+        self._http_clients.append(client)
+        return client
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        if self._openai is None:
+            self._openai = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                max_retries=settings.LLM_MAX_RETRIES,
+                http_client=self._http_client(),
+            )
+        return self._openai
+
+    @property
+    def groq(self) -> AsyncGroq:
+        if self._groq is None:
+            self._groq = AsyncGroq(
+                api_key=settings.GROQ_API_KEY,
+                max_retries=settings.LLM_MAX_RETRIES,
+                http_client=self._http_client(),
+            )
+        return self._groq
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """A pooled client for provider endpoints called directly over HTTP"""
+        if self._http is None:
+            self._http = self._http_client()
+        return self._http
+
+    def configure_gemini(self):
+        if not self._gemini_configured:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            self._gemini_configured = True
+
+    def gemini(self, model: str) -> genai.GenerativeModel:
+        self.configure_gemini()
+        return genai.GenerativeModel(model)
+
+    def start(self):
+        if settings.LLM_HTTP2 and not HTTP2_AVAILABLE:
+            logger.warning("h2 is not installed, LLM clients will use HTTP/1.1")
+        self.configure_gemini()
+        # Touch the properties so the pools exist before the first request
+        self.openai, self.groq, self.http
+
+    async def close(self):
+        for client in self._http_clients:
+            await client.aclose()
+        self._http_clients = []
+        self._openai = None
+        self._groq = None
+        self._http = None
+
+
+llm_clients = LLMClients()
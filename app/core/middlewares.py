@@ -1,49 +1,128 @@
-from fastapi import FastAPI, Request, HTTPException, Security, Depends
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers, QueryParams
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.websockets import WebSocketClose
 
 from app.api.deps.user_deps import get_current_user
 from app.core.security import auth
 from app.core.logger import logger
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, allow_routes=None):
-        super().__init__(app)
-        self.allow_routes = allow_routes or []
-
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path not in self.allow_routes:
-            if request.method == "OPTIONS":
-                return await call_next(request)
-            authorization: str = request.headers.get("Authorization")
-            if not authorization:
-                if 'ws' in request.url.path or 'wss' in request.url.path:
-                    # Try to extract token from query parameters
-                    # Little hack, remove once web sockets are working
-                    token = request.query_params.get('token')
-                    if not token:
-                        return JSONResponse(content={"detail": "Authorization token is missing"}, status_code=401)
-                    authorization = f'Bearer {token}'
-                else:
-                    return JSONResponse(content={"detail": "Authorization header is missing"}, status_code=401)
-            try:
-                token_parts = authorization.split("Bearer ")
-                if len(token_parts) != 2:
-                    # Return a 401 response directly for malformed Authorization header
-                    return JSONResponse(
-                        content={"detail": "Authorization header must be in the 'Bearer <token>' format"},
-                        status_code=401)
-                token = token_parts[1]
-                auth_result = await auth.verify_token(token)
-                user = await get_current_user(auth_result, token)
-                request.state.user = user
-            except HTTPException as e:
-                if e.status_code == 404:
-                    return JSONResponse(content={"detail": "User not found"}, status_code=404)
-            except Exception as e:
-                logger.error(e)
-                return JSONResponse(content={"detail": "Invalid token"}, status_code=401)
-
-        response = await call_next(request)
-        return response
+class RouteMatcher:
+    """
+    Matches request paths against a fixed set of routes, built once when the middleware is created.
+
+    Parameters:
+        routes (Iterable[str]): Paths that must match exactly.
+        prefixes (Iterable[str]): Path prefixes, matched on whole segments so "/docs" does not match "/docsx".
+    """
+
+    def __init__(self, routes: Iterable[str] = (), prefixes: Iterable[str] = ()):
+        self.routes = frozenset(routes)
+        self.trie: dict = {}
+        for prefix in prefixes:
+            node = self.trie
+            for segment in self._segments(prefix):
+                node = node.setdefault(segment, {})
+            node[None] = True
+
+    @staticmethod
+    def _segments(path: str):
+        return [segment for segment in path.split("/") if segment]
+
+    def match(self, path: str) -> bool:
+        if path in self.routes:
+            return True
+        node = self.trie
+        if not node:
+            return False
+        if None in node:
+            return True
+        for segment in self._segments(path):
+            node = node.get(segment)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+class AuthMiddleware:
+    """
+    Authenticates every http request and websocket handshake before it reaches the routers.
+
+    The authenticated user is stored on the scope state, so handlers keep reading it from request.state.user.
+    Response bodies are passed straight through to the server, nothing is buffered here.
+    """
+
+    def __init__(self, app: ASGIApp, allow_routes: Optional[Iterable[str]] = None,
+                 allow_prefixes: Optional[Iterable[str]] = None):
+        self.app = app
+        self.matcher = RouteMatcher(allow_routes or [], allow_prefixes or [])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.handle_websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def handle_http(self, scope: Scope, receive: Receive, send: Send):
+        if scope["method"] == "OPTIONS" or self.matcher.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        authorization = Headers(scope=scope).get("Authorization")
+        if not authorization:
+            response = JSONResponse(content={"detail": "Authorization header is missing"}, status_code=401)
+            await response(scope, receive, send)
+            return
+        error = await self.authenticate(scope, authorization)
+        if error is not None:
+            await error(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    async def handle_websocket(self, scope: Scope, receive: Receive, send: Send):
+        # Browsers cannot set headers on a websocket handshake, so the token may come in the query string.
+        # Connections without one are let through and authenticate with an "auth" frame after connecting.
+        if self.matcher.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        authorization = Headers(scope=scope).get("Authorization")
+        if not authorization:
+            token = QueryParams(scope["query_string"]).get("token")
+            if token:
+                authorization = f"Bearer {token}"
+        if authorization:
+            error = await self.authenticate(scope, authorization)
+            if error is not None:
+                # Reject the handshake, the server answers it with a 403
+                await WebSocketClose(code=1008)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    async def authenticate(self, scope: Scope, authorization: str) -> Optional[JSONResponse]:
+        """Verifies the bearer token and stores the user on the scope, returns an error response on failure"""
+        try:
+            token_parts = authorization.split("Bearer ")
+            if len(token_parts) != 2:
+                # Return a 401 response directly for malformed Authorization header
+                return JSONResponse(
+                    content={"detail": "Authorization header must be in the 'Bearer <token>' format"},
+                    status_code=401)
+            token = token_parts[1]
+            auth_result = await auth.verify_token(token)
+            user = await get_current_user(auth_result, token)
+            scope.setdefault("state", {})["user"] = user
+        except HTTPException as e:
+            if e.status_code == 404:
+                return JSONResponse(content={"detail": "User not found"}, status_code=404)
+            return JSONResponse(content={"detail": e.detail}, status_code=e.status_code)
+        except Exception as e:
+            logger.error(e)
+            return JSONResponse(content={"detail": "Invalid token"}, status_code=401)
+        return None
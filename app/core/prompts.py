@@ -0,0 +1,106 @@
+import hashlib
+import os
+import time
+from typing import Dict
+
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.logger import logger
+
+# Prompts the app cannot run without, loading fails loudly if any of them is missing or empty
+REQUIRED_PROMPTS = [
+    "manager",
+    "validate_embedding_search_prompt",
+    "embedding_text_prompt",
+    "product_chat_prompt",
+    "compare_products_prompt",
+    "reviews_prompt",
+    "no_reviews_prompt",
+    "summarize_conversation_prompt",
+]
+
+
+class Prompt(BaseModel):
+    name: str
+    text: str
+    version: str
+    mtime: float
+
+
+class PromptRegistry:
+    """
+    Loads every prompt file once and serves it from memory.
+
+    Prompts are addressed by file name without the .txt extension. Each prompt carries a short content hash
+    as its version, so anything derived from a prompt can be keyed by the exact text that produced it.
+    When reload_interval is above zero, the files are checked for a newer mtime at most that often and
+    changed prompts are reloaded in place, which makes prompt iteration possible without a restart.
+    """
+
+    def __init__(self, directory: str = "prompts", reload_interval: float = 0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.prompts: Dict[str, Prompt] = {}
+        self._checked_at = 0.0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.txt")
+
+    def _read(self, name: str) -> Prompt:
+        path = self._path(name)
+        mtime = os.stat(path).st_mtime
+        with open(path, mode='r', encoding="utf-8") as file:
+            text = file.read()
+        if not text.strip():
+            raise ValueError(f"Prompt {name} is empty")
+        version = hashlib.sha256(text.encode()).hexdigest()[:12]
+        return Prompt(name=name, text=text, version=version, mtime=mtime)
+
+    def _names(self):
+        return [filename[:-len(".txt")] for filename in sorted(os.listdir(self.directory)) if filename.endswith(".txt")]
+
+    def load(self):
+        prompts = {name: self._read(name) for name in self._names()}
+        missing = [name for name in REQUIRED_PROMPTS if name not in prompts]
+        if missing:
+            raise FileNotFoundError(f"Missing prompts: {', '.join(missing)}")
+        self.prompts = prompts
+        self._checked_at = time.monotonic()
+        logger.info(f"Loaded {len(prompts)} prompts")
+
+    def reload_changed(self):
+        # The directory is scanned again so prompt files added since the last load are picked up too
+        try:
+            names = self._names()
+        except OSError as e:
+            logger.error(f"Unable to list prompts: {e}")
+            names = []
+        for name in names:
+            prompt = self.prompts.get(name)
+            try:
+                if prompt is None or os.stat(self._path(name)).st_mtime != prompt.mtime:
+                    self.prompts[name] = self._read(name)
+                    logger.info(f"Reloaded prompt {name}, version {self.prompts[name].version}")
+            except (OSError, ValueError) as e:
+                # Keep serving the last good version while the file is being edited
+                logger.error(f"Unable to reload prompt {name}: {e}")
+        self._checked_at = time.monotonic()
+
+    def get(self, name: str) -> Prompt:
+        if not self.prompts:
+            self.load()
+        elif self.reload_interval > 0 and time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload_changed()
+        prompt = self.prompts.get(name)
+        if prompt is None:
+            raise KeyError(f"Unknown prompt {name}")
+        return prompt
+
+    def versions(self) -> Dict[str, str]:
+        if not self.prompts:
+            self.load()
+        return {name: prompt.version for name, prompt in self.prompts.items()}
+
+
+prompt_registry = PromptRegistry(reload_interval=settings.PROMPT_RELOAD_INTERVAL)
@@ -1,9 +1,14 @@
-from typing import Union, Any, Optional
+import asyncio
+import hashlib
+import time
+from typing import Union, Any, Optional, Dict, Callable
 
 import aiohttp
 from fastapi import HTTPException, status, Depends
 from fastapi.security import SecurityScopes, HTTPAuthorizationCredentials, HTTPBearer
 from app.core.config import settings
+from app.core.logger import logger
+from app.utils.cache import TTLCache
 import jwt
 
 
@@ -20,6 +25,73 @@ class UnauthenticatedException(HTTPException):
         )
 
 
+class JWKSKeyStore:
+    """Keeps the Auth0 signing keys indexed by kid and refreshes them in the background"""
+
+    def __init__(self, jwks_url: str, session: Callable[[], aiohttp.ClientSession], refresh_interval: int = 3600,
+                 min_refetch_interval: int = 30):
+        self.jwks_url = jwks_url
+        self.session = session
+        self.refresh_interval = refresh_interval
+        # Unknown kids force a refetch, this stops a flood of bad tokens from hammering Auth0
+        self.min_refetch_interval = min_refetch_interval
+        self.keys: Dict[str, Any] = {}
+        self.fetched_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def fetch(self):
+        async with self.session().get(self.jwks_url) as response:
+            if response.status != 200:
+                raise UnauthorizedException("Failed to fetch signing keys")
+            jwks = await response.json()
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if jwk.get("use", "sig") != "sig" or "kid" not in jwk:
+                continue
+            try:
+                keys[jwk["kid"]] = jwt.PyJWK(jwk).key
+            except jwt.exceptions.PyJWKError as error:
+                logger.warning(f"Skipping unusable signing key {jwk.get('kid')}: {error}")
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            if self.fetched_at is not None:
+                age = time.monotonic() - self.fetched_at
+                # Another coroutine may have refreshed while we waited for the lock
+                if age < self.min_refetch_interval or (not force and age < self.refresh_interval):
+                    return
+            await self.fetch()
+
+    def _refresh_in_background(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh signing keys: {e}")
+
+    async def get_signing_key(self, kid: str):
+        if self.fetched_at is None:
+            await self.refresh(force=True)
+        elif time.monotonic() - self.fetched_at >= self.refresh_interval:
+            # Keep serving the current keys while the new set is fetched
+            self._refresh_in_background()
+        key = self.keys.get(kid)
+        if key is None:
+            # The key may have been rotated since the last fetch
+            await self.refresh(force=True)
+            key = self.keys.get(kid)
+        if key is None:
+            raise UnauthorizedException(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+
 class VerifyToken:
     """Does all the token verification using PyJWT"""
 
@@ -29,7 +101,20 @@ class VerifyToken:
         # This gets the JWKS from a given URL and does processing so you can
         # use any of the keys available
         jwks_url = f'https://{self.config.AUTH0_DOMAIN}/.well-known/jwks.json'
-        self.jwks_client = jwt.PyJWKClient(jwks_url)
+        self.key_store = JWKSKeyStore(jwks_url, self.session, refresh_interval=self.config.JWKS_REFRESH_INTERVAL)
+        # Verified claims keyed by token hash, each entry expires with the token itself
+        self.token_cache = TTLCache(maxsize=self.config.TOKEN_CACHE_SIZE)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """One keep-alive session to Auth0 shared by the JWKS and userinfo calls"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
     async def get_user_profile(self, token):
         url = f"https://{self.config.AUTH0_DOMAIN}/userinfo"
@@ -37,22 +122,27 @@ class VerifyToken:
             "Authorization": f"Bearer {token}"
         }
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        raise UnauthorizedException("Failed to get user profile")
+            async with self.session().get(url, headers=headers) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    raise UnauthorizedException("Failed to get user profile")
         except Exception as e:
             raise UnauthorizedException(str(e))
 
     async def verify_token(self, token: str) -> Union[dict, Any]:
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        payload = self.token_cache.get(token_hash)
+        if payload is not None:
+            return payload
+
         try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(token).key
-        except jwt.exceptions.PyJWKClientError as error:
-            raise UnauthorizedException(str(error))
+            kid = jwt.get_unverified_header(token).get("kid")
         except jwt.exceptions.DecodeError as error:
             raise UnauthorizedException(str(error))
+        if not kid:
+            raise UnauthorizedException("Token is missing a key id")
+        signing_key = await self.key_store.get_signing_key(kid)
 
         try:
             payload = jwt.decode(
@@ -65,6 +155,9 @@ class VerifyToken:
         except Exception as error:
             raise UnauthorizedException(str(error))
 
+        exp = payload.get("exp")
+        if exp is not None:
+            self.token_cache.set(token_hash, payload, ttl=exp - time.time())
         return payload
 
     async def verify(self,
@@ -74,28 +167,7 @@ class VerifyToken:
         if token is None:
             raise UnauthenticatedException
 
-        # This gets the 'kid' from the passed token
-        try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(
-                token.credentials
-            ).key
-        except jwt.exceptions.PyJWKClientError as error:
-            raise UnauthorizedException(str(error))
-        except jwt.exceptions.DecodeError as error:
-            raise UnauthorizedException(str(error))
-
-        try:
-            payload = jwt.decode(
-                token.credentials,
-                signing_key,
-                algorithms=self.config.AUTH0_ALGORITHMS,
-                audience=self.config.AUTH0_AUDIENCE,
-                issuer=self.config.AUTH0_ISSUER,
-            )
-        except Exception as error:
-            raise UnauthorizedException(str(error))
-
-        return payload
+        return await self.verify_token(token.credentials)
 
 
 auth = VerifyToken()
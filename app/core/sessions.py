@@ -0,0 +1,110 @@
+import time
+from datetime import datetime
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.core.logger import logger
+from app.models.conversation_model import ChatMessage, Conversation, Message
+
+
+class ConversationSession:
+    def __init__(self, user_id: str, messages: List[Message], max_messages: int):
+        self.user_id = user_id
+        self.messages = deque(messages, maxlen=max_messages)
+        self.summary = ""
+        self.summarized_until: Optional[datetime] = None
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class ConversationSessionCache:
+    """
+    Keeps the most recent messages of connected users in memory so a chat turn never reads the conversation
+    from Mongo.
+
+    A session is loaded once when the user's websocket connects and is evicted when it disconnects or has been
+    idle for idle_ttl seconds. Writes still go to Mongo first; extend() only mirrors them into the ring buffer.
+
+    Parameters:
+        max_messages (int): The number of recent messages kept per user.
+        idle_ttl (float): How many seconds an unused session is kept.
+    """
+
+    def __init__(self, max_messages: int = 10, idle_ttl: float = 1800):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.sessions: Dict[str, ConversationSession] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def open(self, user_id: str):
+        self.evict_idle()
+        if user_id in self.sessions:
+            self.sessions[user_id].touch()
+            return
+        try:
+            cursor = ChatMessage.get_motor_collection().find({"user_id": user_id}, {"_id": 0, "user_id": 0})
+            documents = await cursor.sort([("timestamp", -1), ("_id", -1)]).limit(self.max_messages).to_list(
+                length=self.max_messages)
+            header = await Conversation.get_motor_collection().find_one(
+                {"user_id": user_id}, {"_id": 0, "summary": 1, "summarized_until": 1}
+            )
+        except Exception as e:
+            logger.error(f"Unable to load the conversation session for {user_id}: {e}")
+            return
+        messages = [Message.parse_obj(document) for document in reversed(documents)]
+        session = ConversationSession(user_id, messages, self.max_messages)
+        session.summary = (header or {}).get("summary") or ""
+        session.summarized_until = (header or {}).get("summarized_until")
+        self.sessions[user_id] = session
+
+    def get(self, user_id: str) -> Optional[Conversation]:
+        """
+        Returns an unsaved Conversation holding the user's recent messages, or None if the user has no session.
+        """
+        session = self.sessions.get(user_id)
+        if session is None or time.monotonic() - session.last_used > self.idle_ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        session.touch()
+        # construct skips validation, the messages were validated when they entered the buffer
+        return Conversation.construct(user_id=user_id, messages=list(session.messages), summary=session.summary,
+                                      summarized_until=session.summarized_until)
+
+    def extend(self, user_id: str, messages: List[Message]):
+        session = self.sessions.get(user_id)
+        if session is not None:
+            session.messages.extend(messages)
+            session.touch()
+
+    def set_summary(self, user_id: str, summary: str, summarized_until: datetime):
+        session = self.sessions.get(user_id)
+        if session is not None:
+            session.summary = summary
+            session.summarized_until = summarized_until
+
+    def reset(self, user_id: str):
+        session = self.sessions.get(user_id)
+        if session is not None:
+            session.messages.clear()
+            session.summary = ""
+            session.summarized_until = None
+
+    def evict(self, user_id: str):
+        self.sessions.pop(user_id, None)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for user_id in [user_id for user_id, session in self.sessions.items()
+                        if now - session.last_used > self.idle_ttl]:
+            del self.sessions[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
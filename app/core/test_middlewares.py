@@ -0,0 +1,99 @@
+import pytest
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.core import middlewares
+from app.core.middlewares import AuthMiddleware, RouteMatcher
+
+
+def test_route_matcher_matches_exact_routes_and_whole_segments():
+    matcher = RouteMatcher(routes=["/users"], prefixes=["/docs", "/api/v1/public/"])
+    assert matcher.match("/users")
+    assert not matcher.match("/users/")
+    assert not matcher.match("/users/me")
+    assert matcher.match("/docs") and matcher.match("/docs/") and matcher.match("/docs/oauth2-redirect")
+    assert not matcher.match("/docsx")
+    assert matcher.match("/api/v1/public") and matcher.match("/api/v1/public/products")
+    assert not matcher.match("/api/v1/publicity")
+    assert not matcher.match("/")
+
+    assert RouteMatcher(prefixes=["/"]).match("/anything/at/all")
+    assert not RouteMatcher().match("/")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def verify_token(token):
+        if token == "expired":
+            raise HTTPException(status_code=403, detail="Token expired")
+        if token == "unknown":
+            raise HTTPException(status_code=404, detail="No such user")
+        if token != "good":
+            raise ValueError("bad signature")
+        return {"sub": "auth0|123"}
+
+    async def get_current_user(auth_result, token):
+        return auth_result["sub"]
+
+    monkeypatch.setattr(middlewares.auth, "verify_token", verify_token)
+    monkeypatch.setattr(middlewares, "get_current_user", get_current_user)
+
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware, allow_routes=["/users"], allow_prefixes=["/docs"])
+
+    @app.get("/users")
+    @app.get("/docs/page")
+    @app.options("/products")
+    @app.get("/products")
+    async def endpoint(request: Request):
+        return {"user": getattr(request.state, "user", None)}
+
+    @app.websocket("/ws")
+    async def socket(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_json({"user": getattr(websocket.state, "user", None)})
+        await websocket.close()
+
+    return TestClient(app)
+
+
+def test_allowed_routes_and_options_skip_authentication(client):
+    assert client.get("/users").json() == {"user": None}
+    assert client.get("/docs/page").status_code == 200
+    assert client.options("/products").status_code == 200
+
+
+def test_missing_or_malformed_header_is_401(client):
+    assert client.get("/products").status_code == 401
+    assert client.get("/products", headers={"Authorization": "Token good"}).status_code == 401
+    assert client.get("/products", headers={"Authorization": "Bearer forged"}).status_code == 401
+
+
+def test_authenticated_user_reaches_the_handler(client):
+    response = client.get("/products", headers={"Authorization": "Bearer good"})
+    assert response.json() == {"user": "auth0|123"}
+
+
+def test_http_exception_status_is_propagated(client):
+    response = client.get("/products", headers={"Authorization": "Bearer expired"})
+    assert (response.status_code, response.json()) == (403, {"detail": "Token expired"})
+    assert client.get("/products", headers={"Authorization": "Bearer unknown"}).status_code == 404
+
+
+def test_websocket_with_bad_query_token_is_closed(client):
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect("/ws?token=forged"):
+            pass
+    assert error.value.code == 1008
+
+
+def test_websocket_token_in_query_is_authenticated(client):
+    with client.websocket_connect("/ws?token=good") as websocket:
+        assert websocket.receive_json() == {"user": "auth0|123"}
+
+
+def test_websocket_without_token_is_let_through(client):
+    # It authenticates with an "auth" frame after connecting
+    with client.websocket_connect("/ws") as websocket:
+        assert websocket.receive_json() == {"user": None}
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from app.core.prompts import REQUIRED_PROMPTS, PromptRegistry
+
+
+def write_prompt(directory, name, text, mtime=None):
+    path = directory / f"{name}.txt"
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name in REQUIRED_PROMPTS:
+        write_prompt(tmp_path, name, f"You are the {name} prompt – answer in JSON.", mtime=1000)
+    return tmp_path
+
+
+def test_load_reads_every_prompt(directory):
+    registry = PromptRegistry(str(directory))
+    registry.load()
+    assert set(registry.versions()) == set(REQUIRED_PROMPTS)
+    assert registry.get("manager").text == "You are the manager prompt – answer in JSON."
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_missing_or_empty_required_prompt_fails_loading(directory):
+    os.remove(directory / "manager.txt")
+    with pytest.raises(FileNotFoundError):
+        PromptRegistry(str(directory)).load()
+
+    write_prompt(directory, "manager", "  \n")
+    with pytest.raises(ValueError):
+        PromptRegistry(str(directory)).load()
+
+
+def test_version_follows_the_text(directory):
+    registry = PromptRegistry(str(directory))
+    registry.load()
+    version = registry.get("manager").version
+
+    registry.load()
+    assert registry.get("manager").version == version
+    write_prompt(directory, "manager", "You are the manager prompt, answer in YAML.")
+    registry.load()
+    assert registry.get("manager").version != version
+
+
+def test_reload_picks_up_changed_and_new_prompts_and_keeps_the_last_good_version(directory):
+    registry = PromptRegistry(str(directory))
+    registry.load()
+    version = registry.get("manager").version
+
+    write_prompt(directory, "manager", "You are the manager prompt, answer in YAML.", mtime=2000)
+    write_prompt(directory, "greeting_prompt", "Say hello.")
+    registry.reload_changed()
+    changed = registry.get("manager")
+    assert changed.version != version and changed.mtime == 2000
+    assert registry.get("greeting_prompt").text == "Say hello."
+
+    # A file emptied mid-edit does not replace the prompt being served
+    write_prompt(directory, "manager", "", mtime=3000)
+    registry.reload_changed()
+    assert registry.get("manager") == changed
+    os.remove(directory / "manager.txt")
+    registry.reload_changed()
+    assert registry.get("manager") == changed
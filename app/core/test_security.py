@@ -0,0 +1,69 @@
+import asyncio
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.core.config import settings
+from app.core.security import VerifyToken, UnauthorizedException
+
+
+def make_verifier():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "test-kid", "use": "sig"})
+    verifier = VerifyToken()
+    fetches = []
+
+    async def fetch():
+        fetches.append(time.monotonic())
+        verifier.key_store.keys = {"test-kid": jwt.PyJWK(jwk).key}
+        verifier.key_store.fetched_at = time.monotonic()
+
+    verifier.key_store.fetch = fetch
+    return verifier, private_key, fetches
+
+
+def make_token(private_key, kid="test-kid", expires_in=3600):
+    claims = {
+        "sub": "auth0|123",
+        "email": "user@example.com",
+        "aud": settings.AUTH0_AUDIENCE,
+        "iss": settings.AUTH0_ISSUER,
+        "exp": int(time.time()) + expires_in,
+    }
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def test_verify_token_caches_claims():
+    verifier, private_key, fetches = make_verifier()
+    token = make_token(private_key)
+
+    async def run():
+        first = await verifier.verify_token(token)
+        second = await verifier.verify_token(token)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["email"] == "user@example.com"
+    assert second is first
+    assert len(fetches) == 1
+    assert verifier.token_cache.hits == 1
+
+
+def test_verify_token_rejects_unknown_kid():
+    verifier, private_key, fetches = make_verifier()
+    token = make_token(private_key, kid="rotated-kid")
+    with pytest.raises(UnauthorizedException):
+        asyncio.run(verifier.verify_token(token))
+    assert len(verifier.token_cache) == 0
+
+
+def test_verify_token_does_not_cache_expired_token():
+    verifier, private_key, fetches = make_verifier()
+    token = make_token(private_key, expires_in=-10)
+    with pytest.raises(UnauthorizedException):
+        asyncio.run(verifier.verify_token(token))
+    assert len(verifier.token_cache) == 0
@@ -0,0 +1,18 @@
+from app.core.sessions import ConversationSession, ConversationSessionCache
+from app.models.conversation_model import Message
+
+
+def test_session_keeps_recent_messages_and_evicts_idle_users():
+    cache = ConversationSessionCache(max_messages=3, idle_ttl=60)
+    cache.sessions["user-1"] = ConversationSession("user-1", [], cache.max_messages)
+    cache.extend("user-1", [Message(role="user", content=str(i)) for i in range(5)])
+    cache.extend("user-2", [Message(role="user", content="not connected")])
+
+    conversation = cache.get("user-1")
+    assert [message.content for message in conversation.messages] == ["2", "3", "4"]
+    assert cache.get("user-2") is None
+
+    cache.sessions["user-1"].last_used -= 120
+    cache.evict_idle()
+    assert "user-1" not in cache.sessions
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
@@ -0,0 +1,53 @@
+"""
+Sets in_stock on existing products from their scraped stock text, so in-stock search filters can match them.
+
+Products are streamed from a cursor, only fetching the stock, and written back with bulk batches of $set. Products
+that already have in_stock are skipped, so the migration can be stopped and run again. updated_at is bumped with
+in_stock, so the search indexes of running instances pick the products up on their next refresh.
+
+    python -m app.migrations.backfill_in_stock [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from app.core.config import init_db
+from app.core.logger import logger
+from app.models.product_model import Product, stock_available
+
+
+async def flush(operations: list, dry_run: bool):
+    if dry_run or not operations:
+        return
+    await Product.get_motor_collection().bulk_write(operations, ordered=False)
+
+
+async def migrate(batch_size: int = 500, dry_run: bool = False):
+    await init_db()
+    cursor = Product.get_motor_collection().find({"in_stock": {"$exists": False}}, {"stock": 1},
+                                                 batch_size=batch_size)
+    operations = []
+    counts = Counter()
+    async for product in cursor:
+        in_stock = stock_available(product.get("stock"))
+        operations.append(UpdateOne({"_id": product["_id"]},
+                                    {"$set": {"in_stock": in_stock, "updated_at": datetime.now()}}))
+        counts[in_stock] += 1
+        if len(operations) >= batch_size:
+            await flush(operations, dry_run)
+            logger.info(f"Backfilled {sum(counts.values())} products")
+            operations = []
+    await flush(operations, dry_run)
+    logger.info(f"Done, {'would set' if dry_run else 'set'} in_stock on {sum(counts.values())} products: "
+                f"{counts[True]} in stock, {counts[False]} out of stock, {counts[None]} unknown")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500, help="Products written per bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="Count the products without writing anything")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
@@ -0,0 +1,63 @@
+"""
+Rewrites the embeddings of existing products in the given storage format.
+
+Products are streamed from a cursor, only fetching the embedding, and written back with bulk batches of $set.
+Products already in the target format are skipped, so the migration can be stopped and run again. Running it with
+--storage array unpacks the embeddings again, for example before switching back to Atlas $vectorSearch.
+
+    python -m app.migrations.pack_product_embeddings [--storage float32] [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+
+import bson
+from pymongo import UpdateOne
+
+from app.core.config import init_db
+from app.core.logger import logger
+from app.models.product_model import Product
+from app.utils.embedding import ARRAY, FLOAT32, STORAGE_FORMATS, encode_embedding
+
+
+async def flush(operations: list, dry_run: bool):
+    if dry_run or not operations:
+        return
+    await Product.get_motor_collection().bulk_write(operations, ordered=False)
+
+
+async def migrate(storage: str = FLOAT32, batch_size: int = 500, dry_run: bool = False):
+    await init_db()
+    if storage == ARRAY:
+        pending = {"embedding": {"$type": "binData"}}
+    else:
+        # Arrays are matched on their first element, packed embeddings may be in the other packed format
+        pending = {"$or": [{"embedding.0": {"$exists": True}}, {"embedding": {"$type": "binData"}}]}
+    cursor = Product.get_motor_collection().find(pending, {"product_id": 1, "embedding": 1}, batch_size=batch_size)
+    operations = []
+    products = skipped = before = after = 0
+    async for product in cursor:
+        embedding = product["embedding"]
+        packed = encode_embedding(embedding, storage)
+        if packed == embedding:
+            skipped += 1
+            continue
+        operations.append(UpdateOne({"_id": product["_id"]}, {"$set": {"embedding": packed}}))
+        products += 1
+        before += len(bson.encode({"embedding": embedding}))
+        after += len(bson.encode({"embedding": packed}))
+        if len(operations) >= batch_size:
+            await flush(operations, dry_run)
+            logger.info(f"Rewrote {products} embeddings")
+            operations = []
+    await flush(operations, dry_run)
+    logger.info(f"Done, {'would rewrite' if dry_run else 'rewrote'} {products} embeddings as {storage} "
+                f"({before / 2 ** 20:.1f} MiB to {after / 2 ** 20:.1f} MiB of BSON), {skipped} already were")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, default=FLOAT32, help="The format to store")
+    parser.add_argument("--batch-size", type=int, default=500, help="Products written per bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="Count the products without writing anything")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.storage, args.batch_size, args.dry_run))
@@ -0,0 +1,62 @@
+"""
+Moves the messages embedded in conversation documents into the messages collection.
+
+Conversations are streamed from a cursor and their messages are upserted in bulk batches, keyed by
+(user_id, timestamp, role, seq) where seq is the message's position in the embedded array, so the migration can be
+stopped and run again without duplicating messages, and two messages sharing a role and a timestamp stay apart. Once
+a batch is written the embedded arrays of its conversations are removed, leaving only the header.
+
+    python -m app.migrations.split_conversation_messages [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from app.core.config import init_db
+from app.core.logger import logger
+from app.models.conversation_model import ChatMessage, Conversation
+
+
+async def flush(operations: list, user_ids: list, dry_run: bool):
+    if dry_run or not operations:
+        return
+    await ChatMessage.get_motor_collection().bulk_write(operations, ordered=False)
+    await Conversation.get_motor_collection().update_many(
+        {"user_id": {"$in": user_ids}}, {"$set": {"messages": []}}
+    )
+
+
+async def migrate(batch_size: int = 1000, dry_run: bool = False):
+    await init_db()
+    cursor = Conversation.get_motor_collection().find(
+        {"messages.0": {"$exists": True}}, {"user_id": 1, "messages": 1}, batch_size=100
+    )
+    operations, user_ids = [], []
+    conversations = messages = 0
+    async for conversation in cursor:
+        user_id = conversation["user_id"]
+        for seq, message in enumerate(conversation["messages"]):
+            key = {"user_id": user_id, "timestamp": message["timestamp"], "role": message["role"], "seq": seq}
+            # The key fields are copied from the filter on insert
+            fields = {name: value for name, value in message.items() if name not in key}
+            operations.append(UpdateOne(key, {"$setOnInsert": fields}, upsert=True))
+        user_ids.append(user_id)
+        conversations += 1
+        messages += len(conversation["messages"])
+        # A conversation is never split across batches, its array is only cleared once all of it is written
+        if len(operations) >= batch_size:
+            await flush(operations, user_ids, dry_run)
+            logger.info(f"Migrated {messages} messages from {conversations} conversations")
+            operations, user_ids = [], []
+    await flush(operations, user_ids, dry_run)
+    logger.info(f"Done, {'would migrate' if dry_run else 'migrated'} {messages} messages "
+                f"from {conversations} conversations")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="Messages written per bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="Count the messages without writing anything")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
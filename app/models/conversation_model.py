@@ -1,8 +1,9 @@
 from datetime import datetime
-from beanie import Document, Indexed
+from beanie import Document, Indexed, PydanticObjectId
 from typing import Optional
 
 from pydantic import Field, BaseModel
+from pymongo import IndexModel
 
 
 class Message(BaseModel):
@@ -13,10 +14,37 @@ class Message(BaseModel):
     related_products: Optional[list] = []
 
 
+# One stored message, read newest first by (user_id, timestamp), _id breaks ties between messages of the same turn
+class ChatMessage(Document):
+    user_id: str
+    timestamp: datetime = Field(default_factory=datetime.now)
+    role: str
+    content: str
+    products: Optional[list] = []
+    related_products: Optional[list] = []
+    # Position in the embedded array a migrated message came from, part of the migration's upsert key
+    seq: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f'<ChatMessage {self.user_id} {self.timestamp}>'
+
+    class Settings:
+        name = "messages"
+        indexes = [
+            IndexModel([("user_id", 1), ("timestamp", -1), ("_id", -1)]),
+        ]
+
+
+# Conversation header, the messages live in the messages collection and are only filled in on read
 class Conversation(Document):
     user_id: Indexed(str, unique=True)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
+    # Running summary of the messages up to summarized_until, kept up to date in the background
+    summary: Optional[str] = ""
+    summarized_until: Optional[datetime] = None
+    # The _id of the last summarized message, messages sharing its timestamp are told apart by _id
+    summarized_until_id: Optional[PydanticObjectId] = None
     messages: list[Message] = []
 
     def __repr__(self) -> str:
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from beanie import Document, Indexed
+from pydantic import Field
+
+
+# Embeddings already computed for a given text, shared by every app instance so a text is only embedded once.
+# The vector is packed with encode_embedding in the float32 format, like Product embeddings.
+class EmbeddingCacheEntry(Document):
+    key: Indexed(str, unique=True)
+    model: str
+    embedding: bytes
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    def __repr__(self) -> str:
+        return f'<EmbeddingCacheEntry {self.key}>'
+
+    def __str__(self) -> str:
+        return self.key
+
+    class Settings:
+        name = "embedding_cache"
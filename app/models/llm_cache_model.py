@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from beanie import Document, Indexed
+from pydantic import Field
+from pymongo import IndexModel
+
+
+# Completed LLM responses shared between app instances, Mongo drops each entry once expires_at has passed
+class LLMResponseCacheEntry(Document):
+    key: Indexed(str, unique=True)
+    model: str
+    prompt_version: str
+    response: str
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: datetime
+
+    def __repr__(self) -> str:
+        return f'<LLMResponseCacheEntry {self.key}>'
+
+    def __str__(self) -> str:
+        return self.key
+
+    class Settings:
+        name = "llm_response_cache"
+        indexes = [
+            IndexModel([("expires_at", 1)], expireAfterSeconds=0),
+        ]
@@ -1,24 +1,39 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 from typing import Optional
 from datetime import datetime
 from beanie import Document, Indexed
 from typing import Optional
 
+from app.utils.embedding import Embedding
+
+
+def stock_available(stock: Optional[str]) -> Optional[bool]:
+    """
+    Reads availability from a stock text such as "In Stock", "Only 3 left in stock" or "Currently unavailable",
+    None when the text says neither.
+    """
+    text = (stock or "").lower()
+    if "unavailable" in text or "out of stock" in text or "not available" in text:
+        return False
+    if "in stock" in text or "available" in text:
+        return True
+    return None
+
 
 class Product(Document):
     product_id: Indexed(str, unique=True)
     job_id: str
     user_id: Optional[str] = ""
-    domain: str
+    domain: Indexed(str)
     title: str
     description: str
-    price: float
+    price: Indexed(float)
     image_url: str
     specs: dict
     features: list
     reviews: list
-    rating: float
-    embedding: Optional[list] = []
+    rating: Indexed(float)
+    embedding: Optional[Embedding] = []
     embedding_text: Optional[str] = ""
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -27,10 +42,18 @@ class Product(Document):
     number_of_reviews: Optional[str] = ""
     qa: Optional[list] = []
     stock: Optional[str] = ""
+    # Derived from stock, which is free text scraped from the product page, so searches can filter on it
+    in_stock: Optional[bool] = None
     generated_review: Optional[str] = ""
     discount_percentage: Optional[float] = 0.0
     affiliate_url: Optional[str] = ""
 
+    @validator("in_stock", always=True)
+    def derive_in_stock(cls, in_stock, values):
+        if in_stock is not None:
+            return in_stock
+        return stock_available(values.get("stock"))
+
     def __repr__(self) -> str:
         return f'<Product {self.product_id}>'
 
@@ -59,3 +82,8 @@ class Product(Document):
 
     class Settings:
         name = "products"
+        # Embeddings are written back in the form they were read, ProductService packs new ones
+        bson_encoders = {Embedding: lambda embedding: embedding.raw}
+
+    class Config:
+        json_encoders = {Embedding: Embedding.tolist}
@@ -0,0 +1,12 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class MessagePage(BaseModel):
+    messages: List[dict]
+    # Pass as `before` to get the previous page, None once the start of the conversation is reached
+    next_before: Optional[datetime] = None
+    # Pass as `before_id` with `before`, messages of one turn share a timestamp and are ordered by it
+    next_before_id: Optional[str] = None
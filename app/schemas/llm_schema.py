@@ -1,6 +1,9 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, ValidationError, validator
 from typing import Optional
 
+from app.core.logger import logger
+from app.schemas.product_schema import ProductFilters
+
 
 class ActionResponse(BaseModel):
     action: str
@@ -8,3 +11,17 @@ class ActionResponse(BaseModel):
     user_query: Optional[str] = None
     embedding_query: Optional[str] = None
     products: Optional[list] = None
+    filters: Optional[ProductFilters] = None
+
+    @validator("filters", pre=True)
+    def parse_filters(cls, filters):
+        # Written by the LLM, filters that do not parse are dropped so the search still runs without them
+        if filters is None or isinstance(filters, ProductFilters):
+            return filters
+        try:
+            filters = ProductFilters.parse_obj(filters)
+        except (ValidationError, TypeError) as e:
+            logger.warning(f"Ignoring malformed search filters {filters!r}: {e}")
+            return None
+        # The manager may answer with every filter set to null
+        return filters if filters.to_query() else None
@@ -17,6 +17,37 @@ def product_identifier_serializer(product):
     }
 
 
+class ProductFilters(BaseModel):
+    """
+    Structured constraints of a product search, applied before the nearest neighbours are picked.
+    """
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_rating: Optional[float] = None
+    domain: Optional[str] = None
+    in_stock: Optional[bool] = None
+
+    def to_query(self) -> dict:
+        """
+        Returns the filter as a MongoDB query, which is also valid as the filter of Atlas $vectorSearch.
+        """
+        query = {}
+        price = {}
+        if self.min_price is not None:
+            price["$gte"] = self.min_price
+        if self.max_price is not None:
+            price["$lte"] = self.max_price
+        if price:
+            query["price"] = price
+        if self.min_rating is not None:
+            query["rating"] = {"$gte": self.min_rating}
+        if self.domain:
+            query["domain"] = self.domain
+        if self.in_stock is not None:
+            query["in_stock"] = self.in_stock
+        return query
+
+
 class ProductCard(BaseModel):
     product_id: str
     title: str
@@ -0,0 +1,17 @@
+from app.schemas.llm_schema import ActionResponse
+
+
+def make_action(filters):
+    return ActionResponse(action="search", embedding_query="laptop", filters=filters)
+
+
+def test_filters_from_the_llm_are_parsed_leniently():
+    assert make_action({"min_price": None, "max_price": None, "min_rating": None}).filters is None
+
+    partial = make_action({"max_price": 600, "min_rating": "4", "domain": None}).filters
+    assert partial.to_query() == {"price": {"$lte": 600}, "rating": {"$gte": 4}}
+
+    # A malformed object only loses the filters, the search still runs
+    malformed = make_action({"max_price": "$600"})
+    assert malformed.filters is None and malformed.embedding_query == "laptop"
+    assert make_action("under 600").filters is None
@@ -0,0 +1,131 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.logger import logger
+from app.models.conversation_model import Conversation, Message
+from app.services.embedding_batcher import estimate_tokens
+
+# Messages are framed with a few extra tokens each by the chat APIs
+MESSAGE_OVERHEAD_TOKENS = 4
+# Product titles are cut to this many characters in the context
+PRODUCT_TITLE_LENGTH = 80
+
+
+def count_tokens(messages: List[dict]) -> int:
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def compact_products(products: list) -> List[dict]:
+    """
+    Reduces product cards to the fields the manager needs to refer back to them.
+    """
+    compacted = []
+    for product in products:
+        if not isinstance(product, dict):
+            product = product.dict() if hasattr(product, "dict") else {}
+        compacted.append({
+            "product_id": product.get("product_id", ""),
+            "title": (product.get("title") or product.get("product_name") or "")[:PRODUCT_TITLE_LENGTH],
+        })
+    return compacted
+
+
+def message_to_context(message: Message) -> dict:
+    products = message.products or message.related_products
+    if products:
+        content = json.dumps({"message": message.content, "products": compact_products(products)})
+    else:
+        content = json.dumps(message.content)
+    return {"role": message.role, "content": content}
+
+
+def raw_message_to_context(message: Message) -> dict:
+    # How the manager used to forward a message, kept to report how many tokens compaction saves
+    if message.products:
+        return {"role": message.role, "content": f'{message.products}'}
+    return {"role": message.role, "content": json.dumps(message.content)}
+
+
+class ContextBuilder:
+    """
+    Builds the message list for a prompt out of the conversation summary and as many recent messages as fit the
+    model's token budget.
+
+    Product lists are compacted to ids and titles. Messages that fall out of the window are folded into the
+    conversation summary in the background by the summarize callback.
+
+    Parameters:
+        budgets (Dict[str, int]): The prompt token budget per model.
+        default_budget (int): The budget for models without their own entry.
+        max_messages (int): The most recent messages considered for the context.
+        summarize (Callable): Folds a user's messages older than the given timestamp into the summary.
+    """
+
+    def __init__(self, budgets: Dict[str, int], default_budget: int = 4000, max_messages: int = 10,
+                 summarize: Optional[Callable[[str, datetime], Awaitable[None]]] = None):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.max_messages = max_messages
+        self.summarize = summarize
+        self._summarizing: Dict[str, asyncio.Task] = {}
+        self.requests = 0
+        self.truncated = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def build(self, system_prompt: str, conversation: Conversation, query: str, model: str) -> List[dict]:
+        budget = self.budgets.get(model, self.default_budget)
+        head = [{"role": "system", "content": system_prompt}]
+        summary = getattr(conversation, "summary", "")
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        tail = [{"role": "user", "content": query}]
+        remaining = budget - count_tokens(head) - count_tokens(tail)
+
+        recent = conversation.messages[-self.max_messages:]
+        context = []
+        for message in reversed(recent):
+            item = message_to_context(message)
+            tokens = count_tokens([item])
+            if tokens > remaining:
+                break
+            context.append(item)
+            remaining -= tokens
+        context.reverse()
+
+        messages = [*head, *context, *tail]
+        self.requests += 1
+        self.truncated += len(context) < len(recent)
+        self.tokens_before += count_tokens([head[0], *map(raw_message_to_context, recent), *tail])
+        self.tokens_after += count_tokens(messages)
+
+        if len(conversation.messages) >= self.max_messages or len(context) < len(recent):
+            # Everything older than the first message still in the context can be summarized
+            kept = recent[len(recent) - len(context)] if context else None
+            self.schedule_summary(conversation.user_id, kept.timestamp if kept else datetime.now())
+        return messages
+
+    def schedule_summary(self, user_id: str, until: datetime):
+        if self.summarize is None or user_id in self._summarizing:
+            return
+        task = asyncio.ensure_future(self.summarize(user_id, until))
+        self._summarizing[user_id] = task
+        task.add_done_callback(lambda done: self._summary_done(user_id, done))
+
+    def _summary_done(self, user_id: str, task: asyncio.Task):
+        self._summarizing.pop(user_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Unable to summarize the conversation of {user_id}: {task.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "truncated": self.truncated,
+            "prompt_tokens_before": self.tokens_before,
+            "prompt_tokens_after": self.tokens_after,
+            "average_tokens_before": self.tokens_before / self.requests if self.requests else 0.0,
+            "average_tokens_after": self.tokens_after / self.requests if self.requests else 0.0,
+            "summaries_running": len(self._summarizing),
+        }
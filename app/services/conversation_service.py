@@ -1,45 +1,168 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 
+from beanie.odm.utils.encoder import Encoder
+from bson import ObjectId
+
+from app.core.config import manager
 from app.core.logger import logger
-from app.models.conversation_model import Conversation
+from app.models.conversation_model import ChatMessage, Conversation, Message
+from app.schemas.conversation_schema import MessagePage
+
+# The largest page of messages returned by a single read
+MAX_MESSAGES = 50
+
+
+# Messages of one turn share a timestamp, so a timestamp alone is not a cursor: the _id orders the messages within
+# it, matching the (user_id, timestamp, _id) index. Without an _id the whole timestamp is excluded.
+def older_than(timestamp: datetime, message_id: Optional[ObjectId] = None) -> dict:
+    if message_id is None:
+        return {"timestamp": {"$lt": timestamp}}
+    return {"$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": message_id}}]}
+
+
+def newer_than(timestamp: datetime, message_id: Optional[ObjectId] = None) -> dict:
+    if message_id is None:
+        return {"timestamp": {"$gt": timestamp}}
+    return {"$or": [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "_id": {"$gt": message_id}}]}
 
 
 class ConversationService:
     @staticmethod
     async def create_conversation(conversation: Conversation) -> Optional[Conversation]:
+        messages = conversation.messages
+        conversation.messages = []
         await conversation.save()
+        await ConversationService.append_messages(conversation.user_id, messages)
+        conversation.messages = messages
         return conversation
 
     @staticmethod
-    async def get_conversation_by_user_id(user_id: str) -> Optional[Conversation]:
+    async def get_conversation_by_user_id(user_id: str, limit: int = MAX_MESSAGES) -> Optional[Conversation]:
+        """
+        Returns the conversation header with its last messages filled in.
+        """
         conversation = await Conversation.find_one(Conversation.user_id == user_id)
         if not conversation:
             return None
+        messages = await ConversationService.get_recent_messages(user_id, limit)
+        conversation.messages = [Message.parse_obj(message) for message in messages]
         return conversation
 
+    @staticmethod
+    async def get_recent_messages(user_id: str, limit: int = 20, before: Optional[datetime] = None,
+                                  before_id: Optional[ObjectId] = None, with_ids: bool = False) -> List[dict]:
+        """
+        Reads the last messages of a conversation as raw documents, oldest first, skipping model validation.
+
+        The query walks the (user_id, timestamp, _id) index newest first and stops after limit documents.
+
+        Parameters:
+            user_id (str): The owner of the conversation.
+            limit (int): The maximum number of messages to return.
+            before (datetime): Only return messages sent before this time.
+            before_id (ObjectId): With before, also return the messages sent at that time with a smaller _id.
+            with_ids (bool): Keep the _id of each message.
+        """
+        query = {"user_id": user_id}
+        if before is not None:
+            query.update(older_than(before, before_id))
+        projection = {"user_id": 0, "seq": 0} if with_ids else {"_id": 0, "user_id": 0, "seq": 0}
+        cursor = ChatMessage.get_motor_collection().find(query, projection)
+        messages = await cursor.sort([("timestamp", -1), ("_id", -1)]).limit(limit).to_list(length=limit)
+        messages.reverse()
+        return messages
+
+    @staticmethod
+    async def get_message_page(user_id: str, limit: int = 20, before: Optional[datetime] = None,
+                               before_id: Optional[ObjectId] = None) -> MessagePage:
+        messages = await ConversationService.get_recent_messages(user_id, limit, before, before_id, with_ids=True)
+        page = MessagePage(messages=messages)
+        if len(messages) == limit:
+            page.next_before = messages[0]["timestamp"]
+            page.next_before_id = str(messages[0]["_id"])
+        for message in messages:
+            message.pop("_id")
+        return page
+
+    @staticmethod
+    async def get_recent_conversation(user_id: str, limit: int = 10) -> Optional[Conversation]:
+        """
+        Returns an unsaved Conversation holding only the last messages, for building LLM context.
+        """
+        messages = await ConversationService.get_recent_messages(user_id, limit)
+        if not messages:
+            return None
+        summary, summarized_until, _ = await ConversationService.get_summary(user_id)
+        return Conversation.construct(user_id=user_id, messages=[Message.construct(**message) for message in messages],
+                                      summary=summary, summarized_until=summarized_until)
+
+    @staticmethod
+    async def get_messages_between(user_id: str, after: Optional[datetime], before: datetime, limit: int = 50,
+                                   after_id: Optional[ObjectId] = None) -> List[dict]:
+        """
+        Reads raw messages sent after `after` (from the start if None) and before `before`, oldest first, each with
+        its _id. With after_id, the messages sent at `after` with a larger _id are included too.
+        """
+        conditions = [older_than(before)]
+        if after is not None:
+            conditions.append(newer_than(after, after_id))
+        cursor = ChatMessage.get_motor_collection().find({"user_id": user_id, "$and": conditions}, {"user_id": 0})
+        return await cursor.sort([("timestamp", 1), ("_id", 1)]).limit(limit).to_list(length=limit)
+
+    @staticmethod
+    async def get_summary(user_id: str) -> Tuple[str, Optional[datetime], Optional[ObjectId]]:
+        """
+        Returns the running summary, the timestamp and the _id of the last message it covers.
+        """
+        header = await Conversation.get_motor_collection().find_one(
+            {"user_id": user_id}, {"_id": 0, "summary": 1, "summarized_until": 1, "summarized_until_id": 1}
+        )
+        header = header or {}
+        return header.get("summary") or "", header.get("summarized_until"), header.get("summarized_until_id")
+
+    @staticmethod
+    async def update_summary(user_id: str, summary: str, summarized_until: datetime,
+                             summarized_until_id: Optional[ObjectId] = None):
+        await Conversation.get_motor_collection().update_one(
+            {"user_id": user_id},
+            {"$set": {"summary": summary, "summarized_until": summarized_until,
+                      "summarized_until_id": summarized_until_id}},
+        )
+        manager.sessions.set_summary(user_id, summary, summarized_until)
+
     @staticmethod
     async def get_conversations():
         conversations = await Conversation.all().to_list()
         return conversations
 
     @staticmethod
-    async def update_conversation(user_id: str, conversation: Conversation) -> Optional[Conversation]:
-        existing_conversation = await Conversation.find_one(Conversation.user_id == user_id)
-        if not existing_conversation:
-            logger.warning(f"No conversation found for user_id: {user_id}")
-            return None
-        if len(conversation.messages) > 50:
-            conversation.messages.pop(0)
-        existing_conversation.messages = conversation.messages
-        existing_conversation.updated_at = datetime.now()
-        await existing_conversation.save()
-        return existing_conversation
+    async def append_messages(user_id: str, messages: List[Message]):
+        """
+        Stores new messages in the messages collection and touches the conversation header, creating it if needed.
+
+        Existing messages are never read or rewritten, so a write costs the size of the new messages however long
+        the history grows.
+        """
+        if not messages:
+            return
+        now = datetime.now()
+        documents = [{"user_id": user_id, **Encoder().encode(message)} for message in messages]
+        await ChatMessage.get_motor_collection().insert_many(documents)
+        await Conversation.get_motor_collection().update_one(
+            {"user_id": user_id},
+            {"$set": {"updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+        # Keep the in-memory session of a connected user in step with Mongo
+        manager.sessions.extend(user_id, messages)
 
     @staticmethod
     async def delete_conversation(user_id: str) -> Optional[Conversation]:
-        conversation = await Conversation.find_one(Conversation.user_id == user_id)
-        if not conversation:
+        header = await Conversation.get_motor_collection().find_one_and_delete({"user_id": user_id})
+        if not header:
             return None
-        await conversation.delete()
-        return conversation
+        await ChatMessage.get_motor_collection().delete_many({"user_id": user_id})
+        manager.sessions.reset(user_id)
+        logger.info(f"Deleted conversation for user_id: {user_id}")
+        return Conversation.parse_obj(header)
@@ -0,0 +1,123 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from app.core.logger import logger
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text, good enough to keep a batch under the request limit
+    return len(text) // 4 + 1
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # openai.RateLimitError and the other API errors carry the HTTP status, Google raises ResourceExhausted
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted")
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests from concurrent callers and sends them to the provider as one batched call.
+
+    A batch is sent once max_wait seconds have passed since its first request, or as soon as it reaches
+    max_batch_size inputs or max_batch_tokens estimated tokens. Every caller gets its own vector back. If a
+    batched call fails, its inputs are retried one by one, at most retry_concurrency at a time, so a single bad input
+    only fails its own caller. A batch refused for rate limiting fails as a whole, retrying it input by input would
+    only add load while the provider is pushing back.
+
+    Parameters:
+        embed_batch (Callable): Embeds a list of texts and returns the vectors in the same order.
+        max_batch_size (int): The maximum number of inputs per provider call.
+        max_batch_tokens (int): The maximum estimated tokens per provider call.
+        max_wait (float): How long the first request of a batch waits for company, in seconds.
+        retry_concurrency (int): The maximum number of single-input retries in flight after a failed batch.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]], max_batch_size: int = 64,
+                 max_batch_tokens: int = 50000, max_wait: float = 0.005, retry_concurrency: int = 2):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self._retry_slots = asyncio.Semaphore(retry_concurrency)
+        self._pending: deque = deque()
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batches = 0
+        self.inputs = 0
+        self.failed_inputs = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = estimate_tokens(text)
+        self._pending.append((text, tokens, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_batch_size or self._pending_tokens >= self.max_batch_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _take_batch(self) -> List[Tuple[str, int, asyncio.Future]]:
+        batch = []
+        tokens = 0
+        while self._pending and len(batch) < self.max_batch_size:
+            item_tokens = self._pending[0][1]
+            if batch and tokens + item_tokens > self.max_batch_tokens:
+                break
+            batch.append(self._pending.popleft())
+            tokens += item_tokens
+        self._pending_tokens -= tokens
+        return batch
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._take_batch()
+            task = asyncio.ensure_future(self._send(batch))
+            # Keep a reference so the task is not garbage collected while it runs
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, int, asyncio.Future]]):
+        batch = [item for item in batch if not item[2].done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.inputs += len(batch)
+        try:
+            vectors = await self.embed_batch([text for text, _, _ in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            if len(batch) == 1 or is_rate_limited(e):
+                if len(batch) > 1:
+                    logger.warning(f"Embedding batch of {len(batch)} was rate limited, failing it: {e}")
+                self.failed_inputs += len(batch)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logger.warning(f"Embedding batch of {len(batch)} failed, retrying inputs one by one: {e}")
+            await asyncio.gather(*(self._retry(item) for item in batch))
+            return
+        for (_, _, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    async def _retry(self, item: Tuple[str, int, asyncio.Future]):
+        async with self._retry_slots:
+            await self._send([item])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "average_batch_size": self.inputs / self.batches if self.batches else 0.0,
+            "failed_inputs": self.failed_inputs,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,94 @@
+import hashlib
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.models.embedding_cache_model import EmbeddingCacheEntry
+from app.utils.cache import TTLCache, SingleFlight
+from app.utils.embedding import FLOAT32, decode_embedding, encode_embedding
+
+# Bumped when the stored vector format changes, entries written in an older format are never read
+CACHE_FORMAT = "f1"
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    return f"{CACHE_FORMAT}:{model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+
+class EmbeddingStore:
+    """
+    Embeds each distinct (model, text) pair once.
+
+    Lookups go through an in-memory LRU, then the embedding_cache collection, and only then to the provider.
+    Concurrent requests for the same text share one lookup and one provider call. Vectors are kept as float32
+    in memory and packed like Product embeddings in Mongo, callers get a plain list of floats back.
+
+    Parameters:
+        maxsize (int): The number of vectors kept in memory.
+        use_mongo (bool): Whether to read and write the shared embedding_cache collection.
+    """
+
+    def __init__(self, maxsize: int = 5000, use_mongo: bool = True):
+        self.memory = TTLCache(maxsize=maxsize)
+        self.use_mongo = use_mongo
+        self.in_flight = SingleFlight()
+        self.mongo_hits = 0
+        self.provider_calls = 0
+        self.coalesced = 0
+
+    async def get(self, text: str, model: str, embed: Callable[[str], Awaitable[List[float]]]) -> List[float]:
+        key = embedding_cache_key(model, text)
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector.tolist()
+        if key in self.in_flight:
+            self.coalesced += 1
+        vector = await self.in_flight.do(key, lambda: self._load(key, text, model, embed))
+        return vector.tolist()
+
+    async def _load(self, key: str, text: str, model: str, embed) -> np.ndarray:
+        vector = await self._read(key)
+        if vector is not None:
+            self.mongo_hits += 1
+        else:
+            self.provider_calls += 1
+            vector = np.asarray(await embed(text), dtype=np.float32)
+            await self._write(key, model, vector)
+        self.memory.set(key, vector)
+        return vector
+
+    async def _read(self, key: str) -> Optional[np.ndarray]:
+        if not self.use_mongo:
+            return None
+        try:
+            entry = await EmbeddingCacheEntry.get_motor_collection().find_one({"key": key}, {"embedding": 1})
+        except Exception as e:
+            logger.error(f"Unable to read the embedding cache: {e}")
+            return None
+        if not entry:
+            return None
+        return decode_embedding(entry["embedding"])
+
+    async def _write(self, key: str, model: str, vector: np.ndarray):
+        if not self.use_mongo:
+            return
+        try:
+            entry = EmbeddingCacheEntry(key=key, model=model, embedding=encode_embedding(vector, FLOAT32))
+            await EmbeddingCacheEntry.get_motor_collection().update_one(
+                {"key": key}, {"$setOnInsert": entry.dict(exclude={"id", "revision_id"})}, upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Unable to write the embedding cache: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "mongo_hits": self.mongo_hits,
+            "provider_calls": self.provider_calls,
+            "coalesced": self.coalesced,
+        }
+
+
+embedding_store = EmbeddingStore(maxsize=settings.EMBEDDING_CACHE_SIZE, use_mongo=settings.EMBEDDING_CACHE_MONGO)
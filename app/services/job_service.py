@@ -1,19 +1,20 @@
 import json
 import uuid
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 import aiohttp
 from fastapi import HTTPException, status
 
 from app.core.config import settings
 from app.core.logger import logger
-from app.models.conversation_model import Message, Conversation
+from app.models.conversation_model import Message
 from app.models.job_model import Job
-from app.schemas.job_schema import JobUpdate
+from app.schemas.job_schema import JobOut, JobUpdate
 from app.schemas.llm_schema import ActionResponse
 from app.schemas.product_schema import ProductCard
 from app.services.conversation_service import ConversationService
 from app.services.product_service import ProductService
+from app.utils.pagination import DEFAULT_PAGE_SIZE, find_page, stream_documents
 from app.utils.utils import extract_asin_from_url
 
 
@@ -35,6 +36,17 @@ class JobService:
         jobs = await Job.all().to_list()
         return jobs
 
+    @staticmethod
+    async def get_jobs_page(limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                            status: Optional[str] = None) -> Tuple[List[JobOut], Optional[str]]:
+        query = {"status": status} if status else {}
+        return await find_page(Job.get_motor_collection(), query, JobOut, limit, after)
+
+    @staticmethod
+    def stream_jobs(after: Optional[str] = None, status: Optional[str] = None) -> AsyncIterator[JobOut]:
+        query = {"status": status} if status else {}
+        return stream_documents(Job.get_motor_collection(), query, JobOut, after)
+
     @staticmethod
     async def get_jobs_by_user(user_id: str):
         jobs = await Job.find(Job.user_id == user_id).to_list()
@@ -172,25 +184,18 @@ class JobService:
                 )
                 return assistant_message
             clean_url = f"https://www.amazon.com/dp/{asin}"
-            user_conversation = await ConversationService.get_conversation_by_user_id(user_id)
-            if not user_conversation:
-                conversation = Conversation(user_id=user_id, messages=[])
-                user_conversation = await ConversationService.create_conversation(conversation)
             user_message = Message(
                 role="user",
                 content=clean_url,
             )
-            user_conversation.messages.append(user_message)
-            product = await ProductService.get_product_by_id(asin)
-            if product is not None:
-                productOut = ProductCard(**product.dict())
+            productOut = await ProductService.get_product_view(asin, ProductCard)
+            if productOut is not None:
                 assistant_message = Message(
                     role="assistant",
                     content="Here is the product you requested",
                     products=[productOut],
                 )
-                user_conversation.messages.append(assistant_message)
-                await ConversationService.update_conversation(user_id, user_conversation)
+                await ConversationService.append_messages(user_id, [user_message, assistant_message])
                 return assistant_message
             new_job = Job(
                 job_id=str(uuid.uuid4()),
@@ -223,8 +228,7 @@ class JobService:
                 role="assistant",
                 content="We are fetching the product details for you, please wait",
             )
-            user_conversation.messages.append(assistant_message)
-            await ConversationService.update_conversation(user_id, user_conversation)
+            await ConversationService.append_messages(user_id, [user_message, assistant_message])
             return assistant_message
 
         except Exception as e:
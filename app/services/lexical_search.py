@@ -0,0 +1,248 @@
+import asyncio
+import heapq
+import math
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.models.product_model import Product
+from app.schemas.product_schema import ProductFilters
+from app.services.vector_search import fetch_scored_documents, stored_product_ids, vector_search
+
+# Product fields indexed for keyword search, the title counts twice
+LEXICAL_FIELDS = ("title", "features", "specs", "embedding_text")
+FIELD_WEIGHTS = {"title": 2}
+
+# Runs of letters and digits, joined by the punctuation of model numbers such as E1504FA-AS52 or 1.5TB
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it its me my of on or that the this to was with you your"
+    .split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases the text and splits it into words. A model number is kept whole and also split into its parts, so
+    "E1504FA-AS52" matches both the exact query and a query for "e1504fa".
+    """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in _PART.findall(token) if part not in STOPWORDS)
+    return tokens
+
+
+def field_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        return " ".join(f"{key} {field_text(item)}" for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return " ".join(field_text(item) for item in value)
+    return str(value)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Merges ranked lists of product ids, each id scoring 1 / (k + rank) in every list it appears in.
+
+    Only the ranks are used, so a vector score in [0, 1] and an unbounded BM25 score can be combined as they are.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, product_id in enumerate(ranking, start=1):
+            scores[product_id] = scores.get(product_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    In-process inverted index scoring products with Okapi BM25 over their title, features, specs and
+    embedding_text.
+
+    Products are indexed as they are written, a write that only sets some of the fields replaces those fields and
+    keeps the others. Products written by other instances are picked up by refreshing from products updated since
+    the last load, products they deleted are dropped on the same refresh.
+
+    Parameters:
+        enabled (bool): When False nothing is indexed and searches return nothing.
+        k1 (float): How quickly repeated terms stop adding to the score.
+        b (float): How much long documents are penalized.
+        refresh_interval (float): Seconds between refreshes from MongoDB, 0 disables them.
+    """
+
+    def __init__(self, enabled: bool = True, k1: float = 1.2, b: float = 0.75, refresh_interval: float = 60):
+        self.enabled = enabled
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+        # term -> {product_id: term frequency}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # product_id -> field -> tokens, kept to update one field or remove the product
+        self.documents: Dict[str, Dict[str, List[str]]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.loaded_at: Optional[datetime] = None
+        self._refreshed = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.searches = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def upsert(self, product_id: str, fields: dict):
+        """
+        Indexes the lexical fields found in fields, other keys are ignored.
+        """
+        if not self.enabled:
+            return
+        changed = {name: tokenize(field_text(fields[name])) for name in LEXICAL_FIELDS if name in fields}
+        if not changed:
+            return
+        document = {**self.documents.get(product_id, {}), **changed}
+        self.remove(product_id)
+        counts = Counter()
+        for name, tokens in document.items():
+            for token in tokens:
+                counts[token] += FIELD_WEIGHTS.get(name, 1)
+        for token, count in counts.items():
+            self.postings.setdefault(token, {})[product_id] = count
+        self.documents[product_id] = document
+        self.lengths[product_id] = sum(counts.values())
+        self.total_length += self.lengths[product_id]
+
+    def remove(self, product_id: str):
+        document = self.documents.pop(product_id, None)
+        if document is None:
+            return
+        for token in {token for tokens in document.values() for token in tokens}:
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self.postings[token]
+        self.total_length -= self.lengths.pop(product_id)
+
+    def top_k(self, query: str, limit: int, exclude_ids: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        if not self.documents or limit <= 0:
+            return []
+        excluded = set(exclude_ids)
+        count = len(self.documents)
+        average_length = self.total_length / count
+        scores: Dict[str, float] = {}
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for product_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[product_id] / average_length)
+                scores[product_id] = scores.get(product_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        for product_id in excluded:
+            scores.pop(product_id, None)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    async def search(self, query: str, limit: int, exclude_ids: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        self.searches += 1
+        self._schedule_refresh()
+        return self.top_k(query, limit, exclude_ids)
+
+    async def load(self, since: Optional[datetime] = None):
+        """
+        Indexes every product, or only those updated since the given time.
+        """
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        loaded_at = datetime.now()
+        if since:
+            # Products deleted by other instances are dropped, like in LocalVectorIndex.load
+            indexed = set(self.documents)
+            for product_id in indexed - await stored_product_ids():
+                self.remove(product_id)
+        query = {"updated_at": {"$gte": since}} if since else {}
+        projection = {"_id": 0, "product_id": 1, **{name: 1 for name in LEXICAL_FIELDS}}
+        count = 0
+        async for product in Product.get_motor_collection().find(query, projection, batch_size=1000):
+            self.upsert(product["product_id"], product)
+            count += 1
+        self.loaded_at = loaded_at
+        self._refreshed = time.monotonic()
+        logger.info(f"Indexed {count} products for keyword search in {time.perf_counter() - started:.2f}s")
+
+    def _schedule_refresh(self):
+        if not self.refresh_interval or self.loaded_at is None:
+            return
+        if time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refreshed = time.monotonic()
+            self._refresh_task = asyncio.ensure_future(self.load(since=self.loaded_at))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "products": len(self.documents),
+            "terms": len(self.postings),
+            "searches": self.searches,
+            "loaded_at": self.loaded_at,
+        }
+
+
+async def hybrid_search_documents(embedding: Sequence[float], query: str, limit: int, excludes: Iterable[str] = (),
+                                  exclude_ids: Iterable[str] = (),
+                                  filters: Optional[ProductFilters] = None) -> List[dict]:
+    """
+    Runs the vector and keyword searches side by side and fuses their rankings with reciprocal rank fusion.
+
+    Exact terms such as model numbers and ASINs are found by the keyword search even when their embedding is not
+    close to the query's. Falls back to the vector search alone while keyword search is disabled or empty.
+
+    The vector search applies the filters itself, keyword hits are filtered when their products are fetched.
+
+    Parameters:
+        embedding (Sequence[float]): The query embedding.
+        query (str): The query text for the keyword search.
+        limit (int): The number of products returned.
+        excludes (Iterable[str]): Fields left out of the returned documents.
+        exclude_ids (Iterable[str]): Products that must not be returned.
+        filters (Optional[ProductFilters]): Price, rating, domain and stock the products must match.
+    """
+    exclude_ids = list(exclude_ids)
+    if not lexical_search.enabled or not len(lexical_search) or not query:
+        return await vector_search.search_documents(embedding, limit, excludes, exclude_ids, filters)
+    candidates = max(limit, settings.HYBRID_SEARCH_CANDIDATES)
+    vector_hits, lexical_hits = await asyncio.gather(
+        vector_search.search(embedding, candidates, exclude_ids, filters),
+        lexical_search.search(query, candidates, exclude_ids),
+    )
+    fused = reciprocal_rank_fusion(
+        [[product_id for product_id, _ in vector_hits], [product_id for product_id, _ in lexical_hits]],
+        k=settings.HYBRID_SEARCH_RRF_K,
+    )
+    if filters and filters.to_query():
+        # Keyword hits that fail the filters are dropped by the fetch, fetch more so the limit can still be filled
+        documents = (await fetch_scored_documents(fused[:limit * 4], excludes, filters))[:limit]
+    else:
+        documents = await fetch_scored_documents(fused[:limit], excludes)
+    # The fused score only reflects ranks, the reranker also needs the scores of each search
+    vector_scores, lexical_scores = dict(vector_hits), dict(lexical_hits)
+    for document in documents:
+        document["vector_score"] = vector_scores.get(document["product_id"])
+        document["lexical_score"] = lexical_scores.get(document["product_id"])
+    return documents
+
+
+lexical_search = BM25Index(
+    enabled=settings.LEXICAL_SEARCH_ENABLED,
+    refresh_interval=settings.VECTOR_INDEX_REFRESH_INTERVAL,
+)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.models.llm_cache_model import LLMResponseCacheEntry
+
+
+def response_cache_key(model: str, prompt_version: str, messages: List[dict]) -> str:
+    """A canonical hash of everything that decides what the LLM answers"""
+    payload = json.dumps(
+        {"model": model, "prompt_version": prompt_version, "messages": messages},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache(ABC):
+    """The interface every response cache tier implements"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, response: str, model: str, prompt_version: str):
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryResponseCache(ResponseCache):
+    """An LRU of responses bounded by the total size of the stored text rather than by entry count"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._data.get(key)
+        if response is not None:
+            self._data.move_to_end(key)
+        return response
+
+    async def set(self, key: str, response: str, model: str = "", prompt_version: str = ""):
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.encode())
+        self._data[key] = response
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted.encode())
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class MongoResponseCache(ResponseCache):
+    """Responses stored in the llm_response_cache collection, expired by a TTL index"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = await LLMResponseCacheEntry.get_motor_collection().find_one(
+            {"key": key, "expires_at": {"$gt": datetime.now()}}, {"response": 1}
+        )
+        return entry["response"] if entry else None
+
+    async def set(self, key: str, response: str, model: str, prompt_version: str):
+        entry = LLMResponseCacheEntry(
+            key=key,
+            model=model,
+            prompt_version=prompt_version,
+            response=response,
+            expires_at=datetime.now() + timedelta(seconds=self.ttl),
+        )
+        document = entry.dict(exclude={"id", "revision_id"})
+        await LLMResponseCacheEntry.get_motor_collection().update_one({"key": key}, {"$set": document}, upsert=True)
+
+
+class TieredResponseCache(ResponseCache):
+    """
+    Checks each tier in order and backfills the faster tiers on a hit.
+
+    A failing tier is logged and skipped, the cache must never be the reason an LLM call fails.
+    """
+
+    def __init__(self, tiers: List[ResponseCache]):
+        self.tiers = tiers
+        self.hits = [0] * len(tiers)
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        for index, tier in enumerate(self.tiers):
+            try:
+                response = await tier.get(key)
+            except Exception as e:
+                logger.error(f"Response cache tier {type(tier).__name__} failed: {e}")
+                continue
+            if response is not None:
+                self.hits[index] += 1
+                for faster in self.tiers[:index]:
+                    await faster.set(key, response, "", "")
+                return response
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: str, model: str, prompt_version: str):
+        for tier in self.tiers:
+            try:
+                await tier.set(key, response, model, prompt_version)
+            except Exception as e:
+                logger.error(f"Response cache tier {type(tier).__name__} failed: {e}")
+
+    def stats(self) -> dict:
+        hits = sum(self.hits)
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "tiers": [
+                {"name": type(tier).__name__, "hits": self.hits[index], **tier.stats()}
+                for index, tier in enumerate(self.tiers)
+            ],
+        }
+
+
+def build_response_cache() -> Optional[ResponseCache]:
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    tiers: List[ResponseCache] = [MemoryResponseCache(settings.LLM_CACHE_MAX_BYTES)]
+    if settings.LLM_CACHE_MONGO:
+        tiers.append(MongoResponseCache(settings.LLM_CACHE_TTL))
+    return TieredResponseCache(tiers)
+
+
+llm_response_cache = build_response_cache()
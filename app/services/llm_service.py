@@ -1,23 +1,31 @@
 import json
-from typing import List, Optional
+import time
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
 
-import aiofiles
-import httpx
 from fastapi import HTTPException
-from groq import Groq
-from openai import OpenAI
 
 from app.core.config import manager
 from app.core.config import settings
+from app.core.llm_clients import llm_clients
+from app.core.prompts import prompt_registry
 from app.core.logger import logger
+import google.generativeai as genai
 from app.models.conversation_model import Conversation, Message
-from app.models.product_model import Product
 from app.schemas.llm_schema import ActionResponse
-from app.schemas.product_schema import ProductValidateSearch, ProductCard, product_identifier_serializer
+from app.schemas.product_schema import (ProductFilters, ProductValidateSearch, ProductCard, ProductOut,
+                                        product_identifier_serializer)
+from app.services.context_builder import ContextBuilder, message_to_context
 from app.services.conversation_service import ConversationService
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_cache import embedding_store
 from app.services.job_service import JobService
+from app.services.lexical_search import hybrid_search_documents
+from app.services.llm_cache import llm_response_cache, response_cache_key
+from app.services.reranker import RELEVANT, UNCERTAIN, record_validation, reranker
+from app.services.semantic_cache import semantic_cache
+from app.services.vector_search import vector_search
 from app.services.product_service import ProductService
-import google.generativeai as genai
 
 from app.utils.utils import parse_json
 
@@ -28,99 +36,108 @@ GEMINI = "gemini-pro"
 Llama = "Llama3-8b-8192"
 GEMINI_EMBEDDING = "text-embedding-004"
 
+# Receives each token delta of a streamed response
+OnDelta = Callable[[str], Awaitable[None]]
+
 
 class LLMService:
     @staticmethod
-    async def find_similar_embeddings(collection, embedding: List[float], excludes: List[str], query: str,
-                                      limit: int = 1, model: Optional[str] = None
-                                      ):
-        # Build the pipeline for vector search
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "queryVector": embedding,
-                    "path": "embedding",
-                    "numCandidates": 100,
-                    "limit": limit,
-                    "index": "vector_index",
-                }
-            },
-            {
-                "$project": {
-                    "score": {"$meta": "vectorSearchScore"},
-                    **{field: 0 for field in excludes}
-                }
-            }
-        ]
-
-        # Run the aggregation
-        documents_cursor = collection.aggregate(pipeline)
-        products = []
-        old_documents = []
-
-        async for doc in documents_cursor:
-            product = ProductValidateSearch(**doc)
-            products.append(product)
-            old_documents.append(doc)
+    async def find_similar_embeddings(embedding: List[float], excludes: List[str], query: str, limit: int = 1,
+                                      model: Optional[str] = None, exclude_ids: Optional[List[str]] = None,
+                                      lexical_query: Optional[str] = None, filters: Optional[ProductFilters] = None):
+        # With a lexical_query the keyword index is searched too, so exact model numbers and ASINs are found.
+        # Filters are applied by the searches, so they return the nearest products that match them
+        if lexical_query:
+            documents = await hybrid_search_documents(embedding, lexical_query, limit, excludes, exclude_ids or [],
+                                                      filters)
+        else:
+            documents = await vector_search.search_documents(embedding, limit, excludes, exclude_ids or [], filters)
+        if not documents:
+            return [], ""
+
+        # Products the local scorer is sure about skip the LLM, only the uncertain ones are sent to it
+        judgements = reranker.judge(lexical_query or query, documents)
+        relevant_ids = {judgement.product_id for judgement in judgements if judgement.verdict == RELEVANT}
+        uncertain = [document for document, judgement in zip(documents, judgements) if judgement.verdict == UNCERTAIN]
+        recording = bool(settings.RERANK_RECORD_PATH)
+        if recording:
+            # The LLM decides every product, its answers label the offline evaluation of the scorer
+            relevant_ids, uncertain = set(), documents
+        if uncertain:
+            reranker.llm_validations += 1
+            validated = await LLMService.validate_with_llm(uncertain, query, model)
+            if validated is None and not relevant_ids:
+                return [], "Bad response from LLM"
+            if validated is not None:
+                validated_ids, message = validated
+                # The LLM's message only describes the uncertain products, it does not fit those accepted locally
+                accepted_locally = bool(relevant_ids)
+                relevant_ids.update(validated_ids)
+                if recording:
+                    record_validation(settings.RERANK_RECORD_PATH, lexical_query or query, documents, validated_ids)
+                relevant = [document for document in documents if document["product_id"] in relevant_ids]
+                return relevant, reranker.message(relevant) if accepted_locally else message
+        relevant = [document for document in documents if document["product_id"] in relevant_ids]
+        return relevant, reranker.message(relevant)
 
-        # If products were found, validate them using LLM
-        if products:
-            try:
-                response = await LLMService.validate_embedding_search(products, query, model)
+    @staticmethod
+    async def validate_with_llm(documents: List[dict], query: str,
+                                model: Optional[str] = None) -> Optional[Tuple[List[str], str]]:
+        """
+        Asks the LLM which of the products match the query, returns their ids and its message, or None when the
+        LLM does not answer with valid JSON twice.
+        """
+        products = [ProductValidateSearch(**document) for document in documents]
+        try:
+            response = await LLMService.validate_embedding_search(products, query, model)
+            response_data = parse_json(response)
+            if not response_data:
+                logger.error("Bad response from LLM")
+                response = await LLMService.validate_embedding_search(products, query, model, use_cache=False)
                 response_data = parse_json(response)
                 if not response_data:
-                    logger.error("Bad response from LLM")
-                    response = await LLMService.validate_embedding_search(products, query, model)
-                    response_data = parse_json(response)
-                    if not response_data:
-                        return [], "Bad response from LLM"
-                validated_products_ids = response_data.get("products", [])
-                message = response_data.get("message", "")
-            except Exception as e:
-                logger.error("Error validating embeddings with LLM " + str(e))
-                raise HTTPException(status_code=500, detail="Error validating embeddings with LLM")
-
-            # Filter the products based on the validated IDs
-            filtered_products = [
-                doc for doc in old_documents
-                if doc['product_id'] in validated_products_ids
-            ]
-            return filtered_products, message
-
-        return [], ""
+                    return None
+            return response_data.get("products", []), response_data.get("message", "")
+        except Exception as e:
+            logger.error("Error validating embeddings with LLM " + str(e))
+            raise HTTPException(status_code=500, detail="Error validating embeddings with LLM")
 
     @staticmethod
-    async def validate_embedding_search(products: list[ProductValidateSearch], query, model=None):
-        async with aiofiles.open('prompts/validate_embedding_search_prompt.txt', mode='r') as file:
-            prompt = await file.read()
+    async def validate_embedding_search(products: list[ProductValidateSearch], query, model=None, use_cache=True):
+        prompt = prompt_registry.get("validate_embedding_search_prompt")
         messages = [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": prompt.text},
             {"role": "user",
              "content": f"{products}"},
             {"role": "user", "content": query}
         ]
-        return await LLMService.llm_request(messages, model)
+        return await LLMService.llm_request(messages, model, prompt_version=prompt.version, use_cache=use_cache)
 
     @staticmethod
-    async def create_open_ai_embedding(query, model=None):
-        # try:
+    async def create_open_ai_embeddings(queries: List[str]) -> List[List[float]]:
         url = 'https://api.openai.com/v1/embeddings'
         openai_key = settings.OPENAI_API_KEY
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers={
-                'Authorization': f'Bearer {openai_key}',
-                'Content-Type': 'application/json'
-            }, json={
-                'input': query,
-                'model': 'text-embedding-ada-002'
-            })
-
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Error from OpenAI API")
-
-            response_data = response.json()
-            embedding = response_data['data'][0]['embedding']
-            return embedding
+        response = await llm_clients.http.post(url, headers={
+            'Authorization': f'Bearer {openai_key}',
+            'Content-Type': 'application/json'
+        }, json={
+            'input': queries,
+            'model': OPEN_AI_EMBEDDING
+        })
+
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Error from OpenAI API")
+
+        response_data = response.json()
+        # The API may return the vectors in any order, each one carries the index of its input
+        data = sorted(response_data['data'], key=lambda item: item['index'])
+        return [item['embedding'] for item in data]
+
+    @staticmethod
+    async def create_open_ai_embedding(query, model=None):
+        # try:
+        embeddings = await LLMService.create_open_ai_embeddings([query])
+        return embeddings[0]
 
     @staticmethod
     async def create_embedding(query, model=None):
@@ -128,20 +145,18 @@ class LLMService:
         # if model is None:
         #     model = OPEN_AI_EMBEDDING
         # if model == OPEN_AI_EMBEDDING:
-        return await LLMService.create_open_ai_embedding(query, model)
+        return await embedding_store.get(query, OPEN_AI_EMBEDDING, openai_embedding_batcher.embed)
         # elif model == GEMINI_EMBEDDING:
         #     return await LLMService.create_gemini_embedding(query, model)
 
     @staticmethod
     async def generate_product_review(product):
         # try:
-        # Read the prompt asynchronously
         # check the length of the product review array
-        promptFile = "prompts/reviews_prompt.txt"
+        prompt_name = "reviews_prompt"
         if len(product["reviews"]) == 0:
-            promptFile = "prompts/no_reviews_prompt.txt"
-        async with aiofiles.open(promptFile, mode='r') as file:
-            prompt = await file.read()
+            prompt_name = "no_reviews_prompt"
+        prompt = prompt_registry.get(prompt_name).text
 
         product.pop("embedding", None)
         product.pop("similar_products", None)
@@ -150,10 +165,7 @@ class LLMService:
         product.pop("user_id", None)
         product.pop("updated_at", None)
         product.pop("created_at", None)
-        # Configure your OpenAI client properly here
-        client = OpenAI()
-
-        completion = client.chat.completions.create(
+        completion = await llm_clients.openai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": prompt},
@@ -166,42 +178,38 @@ class LLMService:
 
     @staticmethod
     async def generate_embedding_text(product, model):
-        # Read the prompt asynchronously
-        async with aiofiles.open('prompts/embedding_text_prompt.txt', mode='r') as file:
-            prompt = await file.read()
+        prompt = prompt_registry.get("embedding_text_prompt")
 
         # Configure your OpenAI client properly here
         product.pop("embedding", None)
         product.pop("reviews", None)
         product.pop("similar_products", None)
         messages = [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": prompt.text},
             {"role": "user",
              "content": f"{product}"}
         ]
-        return await LLMService.llm_request(messages, model)
+        return await LLMService.llm_request(messages, model, prompt_version=prompt.version)
 
     @staticmethod
-    async def product_chat(product, query, model):
+    async def product_chat(product, query, model, on_delta: Optional[OnDelta] = None):
         # try:
-        async with aiofiles.open('prompts/product_chat_prompt.txt', mode='r') as file:
-            prompt = await file.read()
+        prompt = prompt_registry.get("product_chat_prompt")
         product.pop("embedding", None)
 
         messages = [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": prompt.text},
             {"role": "user",
              "content": f"{product}"},
             {"role": "user", "content": query}
         ]
-        response = await LLMService.llm_request(messages, model)
+        response = await LLMService.llm_request(messages, model, prompt_version=prompt.version, on_delta=on_delta)
         return response
 
     @staticmethod
     async def make_llm_request(conversation):
         # try:
-        client = OpenAI()
-        completion = client.chat.completions.create(
+        completion = await llm_clients.openai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=conversation
         )
@@ -211,8 +219,7 @@ class LLMService:
     @staticmethod
     async def make_openai_request(conversation, model=GPT3):
         # try:
-        client = OpenAI()
-        completion = client.chat.completions.create(
+        completion = await llm_clients.openai.chat.completions.create(
             model=model,
             messages=conversation
         )
@@ -222,28 +229,72 @@ class LLMService:
     @staticmethod
     async def make_gemini_request(conversation, model=GEMINI):
         # try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        model = genai.GenerativeModel(model)
+        model = llm_clients.gemini(model)
         response = await model.generate_content_async(json.dumps(conversation))
         return response.text
 
     @staticmethod
     async def make_groq_request(conversation, model=Llama):
         # try:
-        client = Groq(
-            api_key=settings.GROQ_API_KEY,
-        )
-        chat_completion = client.chat.completions.create(
+        chat_completion = await llm_clients.groq.chat.completions.create(
             messages=conversation,
             model=model
         )
         return chat_completion.choices[0].message.content
 
+    @staticmethod
+    async def stream_openai_request(conversation, model=GPT3) -> AsyncIterator[str]:
+        stream = await llm_clients.openai.chat.completions.create(
+            model=model,
+            messages=conversation,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @staticmethod
+    async def stream_gemini_request(conversation, model=GEMINI) -> AsyncIterator[str]:
+        model = llm_clients.gemini(model)
+        response = await model.generate_content_async(json.dumps(conversation), stream=True)
+        async for chunk in response:
+            # chunk.text raises on a blocked chunk or one without parts
+            if chunk.parts and chunk.text:
+                yield chunk.text
+
+    @staticmethod
+    async def stream_groq_request(conversation, model=Llama) -> AsyncIterator[str]:
+        stream = await llm_clients.groq.chat.completions.create(
+            messages=conversation,
+            model=model,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @staticmethod
+    async def llm_request_stream(conversation, model=GPT3) -> AsyncIterator[str]:
+        """Yields the response as token deltas as soon as the provider produces them"""
+        if model == GEMINI:
+            stream = LLMService.stream_gemini_request(conversation, GEMINI)
+        elif model == Llama:
+            stream = LLMService.stream_groq_request(conversation, Llama)
+        else:
+            stream = LLMService.stream_openai_request(conversation, GPT3)
+        started = time.perf_counter()
+        first = True
+        async for delta in stream:
+            if first:
+                logger.info(f"Time to first token from {model}: {time.perf_counter() - started:.3f}s")
+                first = False
+            yield delta
+
     @staticmethod
     async def create_gemini_embedding(query, model=GEMINI_EMBEDDING):
         # try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        result = genai.embed_content(
+        llm_clients.configure_gemini()
+        result = await genai.embed_content_async(
             model="models/" + model,
             content=query,
             task_type="retrieval_document",
@@ -251,48 +302,65 @@ class LLMService:
         return result.get("embedding", [])
 
     @staticmethod
-    async def llm_request(conversation, model=GPT3):
+    async def llm_request(conversation, model=GPT3, prompt_version: Optional[str] = None, use_cache: bool = True,
+                          on_delta: Optional[OnDelta] = None):
+        """
+        Sends the conversation to the given model, falling back to GPT3 for unknown models.
+
+        Requests built from a versioned prompt are served from the response cache when the same model, prompt
+        version and messages were answered before. use_cache=False skips the lookup but still stores the answer,
+        which is how callers replace a cached response they could not use.
+        When on_delta is given the response is streamed and on_delta is awaited with every token delta, a cached
+        response is passed to it in one piece. The full response is returned either way.
+        """
+        if model not in (GPT3, GEMINI, Llama):
+            model = GPT3
+        cache_key = None
+        if prompt_version and llm_response_cache is not None:
+            cache_key = response_cache_key(model, prompt_version, conversation)
+            if use_cache:
+                cached = await llm_response_cache.get(cache_key)
+                if cached is not None:
+                    if on_delta:
+                        await on_delta(cached)
+                    return cached
         # try:
-        if model == GPT3:
-            return await LLMService.make_openai_request(conversation, GPT3)
+        if on_delta:
+            deltas = []
+            async for delta in LLMService.llm_request_stream(conversation, model):
+                deltas.append(delta)
+                await on_delta(delta)
+            response = "".join(deltas)
         elif model == GEMINI:
-            return await LLMService.make_gemini_request(conversation, GEMINI)
+            response = await LLMService.make_gemini_request(conversation, GEMINI)
         elif model == Llama:
-            return await LLMService.make_groq_request(conversation, Llama)
-        return await LLMService.make_openai_request(conversation, GPT3)
+            response = await LLMService.make_groq_request(conversation, Llama)
+        else:
+            response = await LLMService.make_openai_request(conversation, GPT3)
+        if cache_key and response:
+            await llm_response_cache.set(cache_key, response, model, prompt_version)
+        return response
 
     @staticmethod
-    async def compare(product1, product2, user_query, model):
+    async def compare(product1, product2, user_query, model, on_delta: Optional[OnDelta] = None):
         # try:
-        async with aiofiles.open('prompts/compare_products_prompt.txt', mode='r') as file:
-            prompt = await file.read()
+        prompt = prompt_registry.get("compare_products_prompt")
         product1.pop("embedding", None)
         product2.pop("embedding", None)
         messages = [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": prompt.text},
             {"role": "user",
              "content": f"{product1}"},
             {"role": "user",
              "content": f"{product2}"},
             {"role": "user", "content": user_query}
         ]
-        return await LLMService.llm_request(messages, model)
+        return await LLMService.llm_request(messages, model, prompt_version=prompt.version, on_delta=on_delta)
 
     @staticmethod
     async def manager(query, conversation: Conversation, model):
-        async with aiofiles.open('prompts/manager.txt', mode='r') as file:
-            prompt = await file.read()
-        context = []
-        for message in conversation.messages[-10:]:
-            if message.products:
-                context.append({"role": message.role, "content": f'{message.products}'})
-            else:
-                context.append({"role": message.role, "content": json.dumps(message.content)})
-        messages = [
-            {"role": "system", "content": prompt},
-            *context,
-            {"role": "user", "content": query}
-        ]
+        prompt = prompt_registry.get("manager").text
+        messages = manager_context.build(prompt, conversation, query, model)
         response = await LLMService.llm_request(messages, model)
         if "action" not in response:
             logger.info("LLM did not return an action, trying again")
@@ -315,22 +383,50 @@ class LLMService:
             return
         return response
 
+    @staticmethod
+    async def summarize_conversation(user_id: str, until: datetime, model=GPT3):
+        """
+        Folds the messages that left the manager's context window into the conversation's running summary.
+
+        Parameters:
+            user_id (str): The owner of the conversation.
+            until (datetime): Messages sent before this time may be summarized.
+            model (str): The model writing the summary.
+        """
+        summary, summarized_until, summarized_until_id = await ConversationService.get_summary(user_id)
+        messages = await ConversationService.get_messages_between(user_id, summarized_until, until,
+                                                                  after_id=summarized_until_id)
+        if len(messages) < settings.SUMMARY_MIN_MESSAGES:
+            return
+        prompt = prompt_registry.get("summarize_conversation_prompt")
+        history = [message_to_context(Message.construct(**message)) for message in messages]
+        request = [
+            {"role": "system", "content": prompt.text},
+            {"role": "user", "content": json.dumps({"summary": summary, "messages": history})},
+        ]
+        new_summary = await LLMService.llm_request(request, model, prompt_version=prompt.version)
+        await ConversationService.update_summary(user_id, new_summary.strip(), messages[-1]["timestamp"],
+                                                 messages[-1]["_id"])
+        logger.info(f"Summarized {len(messages)} messages for {user_id}")
+
     @staticmethod
     async def find_similar(action_response: ActionResponse, model: str, user_id: str):
         # try:
         if action_response.products and len(action_response.products) > 0 and action_response.products[0]["product_id"] != "":
             product_id = action_response.products[0]["product_id"]
-            product = await ProductService.get_product_by_id(product_id)
-            embedding = product.embedding
+            embedding = await ProductService.get_product_embedding(product_id)
             excludes = [
                 "_id",
                 "reviews",
                 "embedding",
                 "qa"
             ]
-            documents, message = await LLMService.find_similar_embeddings(Product.get_motor_collection(), embedding,
+            # The product is always its own nearest neighbour
+            documents, message = await LLMService.find_similar_embeddings(embedding,
                                                                           excludes,
-                                                                          action_response.embedding_query, 7, model)
+                                                                          action_response.embedding_query, 7, model,
+                                                                          exclude_ids=[product_id],
+                                                                          filters=action_response.filters)
             if len(documents) == 0:
                 job = await JobService.search_amazon_products(action_response.embedding_query,
                                                               user_id,
@@ -352,9 +448,10 @@ class LLMService:
                 "embedding",
                 "qa"
             ]
-            documents, message = await LLMService.find_similar_embeddings(Product.get_motor_collection(), embedding,
+            documents, message = await LLMService.find_similar_embeddings(embedding,
                                                                           excludes,
-                                                                          action_response.embedding_query, 7, model)
+                                                                          action_response.embedding_query, 7, model,
+                                                                          filters=action_response.filters)
             if len(documents) == 0:
                 job = await JobService.search_amazon_products(action_response.embedding_query,
                                                               user_id,
@@ -372,11 +469,12 @@ class LLMService:
             return {"products": productCards, "message": message}
 
     @staticmethod
-    async def get_product_details(action_response: ActionResponse, model: str, user_id: str):
+    async def get_product_details(action_response: ActionResponse, model: str, user_id: str,
+                                  on_delta: Optional[OnDelta] = None):
         if action_response.products and len(action_response.products) > 0 and action_response.products[0][
             "product_id"] != "":
             product_id = action_response.products[0]["product_id"]
-            product = await ProductService.get_product_by_id(product_id)
+            product = await ProductService.get_product_view(product_id, ProductOut)
             if product is None:
                 return ("Product details not found, if a search on amazon was previously initiated, we may still "
                         "be gathering the details, please wait..., if issue persists, please try again later.")
@@ -385,7 +483,7 @@ class LLMService:
             #     url = f"https://www.amazon.com/dp/{action_response.product_id}"
             #     await JobService.get_product_details(user_id=user_id, action=action_response, urls=[url])
             #     return "Gathering product details, please wait..."
-            response = await LLMService.product_chat(product.dict(), action_response.user_query, model)
+            response = await LLMService.product_chat(product.dict(), action_response.user_query, model, on_delta)
             product_identifier = product_identifier_serializer(product.dict())
             return {"related_products": [product_identifier], "message": response}
         elif action_response.embedding_query and action_response.embedding_query != "":
@@ -396,7 +494,7 @@ class LLMService:
                 "embedding",
                 "qa"
             ]
-            documents, message = await LLMService.find_similar_embeddings(Product.get_motor_collection(), embedding,
+            documents, message = await LLMService.find_similar_embeddings(embedding,
                                                                           excludes,
                                                                           action_response.embedding_query, 1)
             if len(documents) == 0:
@@ -404,11 +502,12 @@ class LLMService:
                         "try using the link feature to add it")
             product = documents[0]
             productCard = ProductCard(**product)
-            response = await LLMService.product_chat(product, action_response.user_query, model)
+            response = await LLMService.product_chat(product, action_response.user_query, model, on_delta)
             return {"products": [productCard], "message": response}
 
     @staticmethod
-    async def compare_products(action_response: ActionResponse, model: str, user_id: str):
+    async def compare_products(action_response: ActionResponse, model: str, user_id: str,
+                               on_delta: Optional[OnDelta] = None):
         # try:
         if action_response.products and len(action_response.products) > 0:
             if len(action_response.products) > 2:
@@ -423,7 +522,7 @@ class LLMService:
             product1 = None
             product2 = None
             if product1Id != "":
-                product1 = await ProductService.get_product_by_id(product1Id)
+                product1 = await ProductService.get_product_view(product1Id, ProductOut)
                 # A bit too complicated for now can be added in future features
                 # if not product1:
                 #     url1 = f"https://www.amazon.com/dp/{product1Id}"
@@ -436,7 +535,6 @@ class LLMService:
                 if product1Name != "":
                     product1_embedding = await LLMService.create_embedding(product1Name)
                     product1_documents, message = await LLMService.find_similar_embeddings(
-                        Product.get_motor_collection(),
                         product1_embedding,
                         excludes, action_response.embedding_query, 1, model)
                     if len(product1_documents) == 0:
@@ -446,7 +544,7 @@ class LLMService:
                     product1 = product1_documents[0]
 
             if product2Id != "":
-                product2 = await ProductService.get_product_by_id(product2Id)
+                product2 = await ProductService.get_product_view(product2Id, ProductOut)
                 # A bit too complicated for now can be added in future features
                 # if not product2:
                 #     url1 = f"https://www.amazon.com/dp/{product1Id}"
@@ -459,7 +557,6 @@ class LLMService:
                 product2_embedding = await LLMService.create_embedding(product2Name)
 
                 product2_documents, message = await LLMService.find_similar_embeddings(
-                    Product.get_motor_collection(),
                     product2_embedding,
                     excludes,
                     action_response.embedding_query,
@@ -468,14 +565,15 @@ class LLMService:
                     return ("No similar product found, we may not have that product in our database yet, "
                             "try using the link feature to add it")
                 product2 = product2_documents[0]
-            response = await LLMService.compare(product1, product2, action_response.user_query, model)
+            response = await LLMService.compare(product1, product2, action_response.user_query, model, on_delta)
             product1Identifier = product_identifier_serializer(product1)
             product2Identifier = product_identifier_serializer(product2)
             return {"related_products": [product1Identifier, product2Identifier], "message": response}
 
     # TODO: Refactor this to return a Message object
     @staticmethod
-    async def get_action_from_llm(query, conversation: Conversation, model):
+    async def get_action_from_llm(query, conversation: Conversation, model, use_cache: bool = True,
+                                  on_delta: Optional[OnDelta] = None):
         # try:
         response = await LLMService.manager(query, conversation, model)
         if "action" not in response:
@@ -492,29 +590,39 @@ class LLMService:
                     return actionResponse.response
             case "get_product_details":
                 logger.info("In get_product_details case")
-                return await LLMService.get_product_details(actionResponse, model, conversation.user_id)
+                return await LLMService.get_product_details(actionResponse, model, conversation.user_id, on_delta)
             case "find_similar":
                 logger.info("In find_similar case")
                 return await LLMService.find_similar(actionResponse, model, conversation.user_id)
             case "compare_products":
                 logger.info("In compare_products case")
-                return await LLMService.compare_products(actionResponse, model, conversation.user_id)
+                return await LLMService.compare_products(actionResponse, model, conversation.user_id, on_delta)
             case "search":
                 logger.info("In search case")
 
                 if actionResponse.embedding_query and actionResponse.embedding_query != "":
                     embedding = await LLMService.create_embedding(actionResponse.embedding_query)
+                    # Cached results were found without the filters of this query
+                    cacheable = settings.SEMANTIC_CACHE_ENABLED and not actionResponse.filters
+                    if cacheable:
+                        if use_cache:
+                            cached = semantic_cache.lookup(embedding)
+                            if cached:
+                                logger.info(f"Semantic cache hit for '{actionResponse.embedding_query}' "
+                                            f"matching '{cached.query}' ({cached.similarity:.3f})")
+                                return {"products": cached.products, "message": cached.message}
+                        else:
+                            semantic_cache.bypassed += 1
                     excludes = [
                         "_id",
                         "reviews",
                         "embedding",
                         "qa"
                     ]
-                    documents, message = await LLMService.find_similar_embeddings(Product.get_motor_collection(),
-                                                                                  embedding,
-                                                                                  excludes,
-                                                                                  actionResponse.embedding_query, 5,
-                                                                                  model)
+                    # The user's own words keep model numbers the rewritten query may have dropped
+                    documents, message = await LLMService.find_similar_embeddings(
+                        embedding, excludes, actionResponse.embedding_query, 5, model,
+                        lexical_query=f"{actionResponse.embedding_query} {query}", filters=actionResponse.filters)
                     if len(documents) == 0:
                         job = await JobService.search_amazon_products(actionResponse.embedding_query,
                                                                       conversation.user_id,
@@ -526,5 +634,23 @@ class LLMService:
                     productCards = []
                     for product in documents:
                         productCards.append(ProductCard(**product))
+                    if cacheable:
+                        semantic_cache.store(actionResponse.embedding_query, embedding, productCards, message)
                     return {"products": productCards, "message": message}
         return "I'm sorry, I don't understand that request"
+
+
+# Concurrent create_embedding calls that miss the cache are sent to OpenAI together
+openai_embedding_batcher = EmbeddingBatcher(
+    LLMService.create_open_ai_embeddings,
+    max_batch_size=settings.EMBEDDING_BATCH_SIZE,
+    max_batch_tokens=settings.EMBEDDING_BATCH_TOKENS,
+    max_wait=settings.EMBEDDING_BATCH_WAIT,
+)
+# Builds the manager's prompt within each model's token budget and keeps the conversation summaries current
+manager_context = ContextBuilder(
+    budgets={GPT3: 4000, GEMINI: 8000, Llama: 4000},
+    default_budget=settings.CONTEXT_TOKEN_BUDGET,
+    max_messages=settings.SESSION_CACHE_MESSAGES,
+    summarize=LLMService.summarize_conversation,
+)
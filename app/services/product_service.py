@@ -1,7 +1,57 @@
-from typing import Optional
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple, Type, TypeVar
 
-from app.models.product_model import Product
+import numpy as np
+from beanie.odm.utils.dump import get_dict
+from pymongo import UpdateOne
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.models.product_model import Product, stock_available
 from app.models.product_error_model import ProductError
+from app.schemas.product_schema import ProductOut
+from app.services.lexical_search import LEXICAL_FIELDS, lexical_search
+from app.services.vector_search import FILTER_FIELDS, vector_search
+from app.utils.embedding import Embedding, decode_embedding, encode_embedding
+from app.utils.pagination import DEFAULT_PAGE_SIZE, find_page, stream_documents
+
+# Projection views, each only fetches its own fields from MongoDB:
+# ProductCard for lists and chat cards, ProductForUser for the product page and ProductOut for everything but the
+# embedding, which is what the LLM prompts use
+View = TypeVar("View", bound=BaseModel)
+
+# Fields written by update_product when the product has no saved state to diff against
+UPDATABLE_FIELDS = {
+    "job_id", "domain", "title", "description", "price", "image_url", "specs", "features", "reviews", "rating",
+    "embedding", "embedding_text", "similar_products", "variants", "number_of_reviews", "qa",
+    "generated_review", "affiliate_url",
+}
+
+
+def pack_embedding(embedding) -> Embedding:
+    # New embeddings are written in the configured EMBEDDING_STORAGE format
+    return Embedding(encode_embedding(embedding, settings.EMBEDDING_STORAGE))
+
+
+# Fields the in-process search indexes keep, see index_product
+INDEXED_FIELDS = {"embedding", *LEXICAL_FIELDS, *FILTER_FIELDS}
+
+
+def pack_fields(fields: dict) -> dict:
+    if "stock" in fields and "in_stock" not in fields:
+        fields = {**fields, "in_stock": stock_available(fields["stock"])}
+    if "embedding" not in fields:
+        return fields
+    return {**fields, "embedding": encode_embedding(fields["embedding"], settings.EMBEDDING_STORAGE)}
+
+
+def index_product(product_id: str, fields: dict):
+    # Keeps the in-process search indexes in step with the fields just written, other keys are ignored
+    if "embedding" in fields:
+        vector_search.upsert(product_id, fields["embedding"])
+    vector_search.set_metadata(product_id, fields)
+    lexical_search.upsert(product_id, fields)
 
 
 class ProductService:
@@ -26,7 +76,9 @@ class ProductService:
 
     @staticmethod
     async def create_product(product: Product) -> Optional[Product]:
+        product.embedding = pack_embedding(product.embedding)
         await product.save()
+        index_product(product.product_id, product.dict(include=INDEXED_FIELDS))
         return product
 
     @staticmethod
@@ -37,9 +89,91 @@ class ProductService:
         return product
 
     @staticmethod
-    async def get_products():
-        products = await Product.all().to_list()
-        return products
+    async def get_product_view(product_id: str, view: Type[View]) -> Optional[View]:
+        """
+        Returns the product as the given view, fetching only the view's fields.
+
+        Parameters:
+            product_id (str): The product to fetch.
+            view (Type[BaseModel]): ProductCard, ProductForUser, ProductOut or any model with a subset of the fields.
+        """
+        return await Product.find_one(Product.product_id == product_id).project(view)
+
+    @staticmethod
+    async def get_product_embedding(product_id: str) -> Optional[np.ndarray]:
+        product = await Product.get_motor_collection().find_one({"product_id": product_id}, {"_id": 0, "embedding": 1})
+        if not product:
+            return None
+        return decode_embedding(product.get("embedding"))
+
+    @staticmethod
+    async def product_exists(product_id: str) -> bool:
+        return await Product.get_motor_collection().find_one({"product_id": product_id}, {"_id": 1}) is not None
+
+    @staticmethod
+    async def existing_product_ids(product_ids: Iterable[str]) -> Set[str]:
+        cursor = Product.get_motor_collection().find({"product_id": {"$in": list(product_ids)}},
+                                                     {"_id": 0, "product_id": 1})
+        return {product["product_id"] async for product in cursor}
+
+    @staticmethod
+    async def insert_products(products: List[Product]) -> List[Product]:
+        """
+        Inserts the products with one bulk_write of upserts and returns the ones that were new.
+
+        A product inserted concurrently by another job is left untouched and not returned.
+        """
+        if not products:
+            return []
+        for product in products:
+            product.embedding = pack_embedding(product.embedding)
+        operations = [
+            UpdateOne({"product_id": product.product_id}, {"$setOnInsert": get_dict(product, to_db=True)}, upsert=True)
+            for product in products
+        ]
+        result = await Product.get_motor_collection().bulk_write(operations, ordered=False)
+        inserted = []
+        for index, product_id in result.upserted_ids.items():
+            product = products[index]
+            product.id = product_id
+            index_product(product.product_id, product.dict(include=INDEXED_FIELDS))
+            inserted.append(product)
+        return inserted
+
+    @staticmethod
+    async def update_products_fields(updates: Dict[str, dict]):
+        """
+        Sets fields on many products with one bulk_write, updates maps product_id to the fields to $set.
+        """
+        if not updates:
+            return
+        now = datetime.now()
+        updates = {product_id: pack_fields(fields) for product_id, fields in updates.items()}
+        operations = [
+            UpdateOne({"product_id": product_id}, {"$set": {"updated_at": now, **fields}})
+            for product_id, fields in updates.items()
+        ]
+        await Product.get_motor_collection().bulk_write(operations, ordered=False)
+        for product_id, fields in updates.items():
+            index_product(product_id, fields)
+
+    @staticmethod
+    async def get_products(view: Optional[Type[View]] = None) -> List:
+        """
+        Returns every product, as full documents or, when a view is given, with only the view's fields.
+        """
+        if view is None:
+            return await Product.all().to_list()
+        return await Product.find_all().project(view).to_list()
+
+    @staticmethod
+    async def get_products_page(limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                                view: Type[View] = ProductOut) -> Tuple[List[View], Optional[str]]:
+        return await find_page(Product.get_motor_collection(), {}, view, limit, after)
+
+    @staticmethod
+    def stream_products(after: Optional[str] = None, view: Type[View] = ProductOut) -> AsyncIterator[View]:
+        return stream_documents(Product.get_motor_collection(), {}, view, after)
 
     @staticmethod
     async def get_products_by_job(job_id: str):
@@ -62,31 +196,59 @@ class ProductService:
         return products
 
     @staticmethod
-    async def update_product(product_id: str, product: Product) -> Optional[Product]:
-        existing_product = await Product.find_one(Product.product_id == product_id)
-        if not existing_product:
+    async def update_product_fields(product_id: str, fields: dict,
+                                    expected_updated_at: Optional[datetime] = None) -> Optional[datetime]:
+        """
+        Sets the given fields with a single update_one, without reading the product first.
+
+        updated_at is always bumped, an updated_at among the fields is ignored. When expected_updated_at is given the
+        update only applies if the stored product still has that updated_at, otherwise a 409 is raised.
+
+        Parameters:
+            product_id (str): The product to update.
+            fields (dict): The field values to $set.
+            expected_updated_at (datetime): The updated_at the caller last read, for optimistic concurrency.
+
+        Returns:
+            The new updated_at, or None if the product does not exist.
+        """
+        # A caller-supplied updated_at would let the next writer holding the old value pass the check
+        fields = {**pack_fields(fields), "updated_at": datetime.now()}
+        query = {"product_id": product_id}
+        if expected_updated_at is not None:
+            query["updated_at"] = expected_updated_at
+        result = await Product.get_motor_collection().update_one(query, {"$set": fields})
+        if result.matched_count == 0:
+            if expected_updated_at is not None and await ProductService.product_exists(product_id):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="Product was modified by another request")
             return None
-        existing_product.job_id = product.job_id
-        existing_product.domain = product.domain
-        existing_product.title = product.title
-        existing_product.description = product.description
-        existing_product.price = product.price
-        existing_product.image_url = product.image_url
-        existing_product.specs = product.specs
-        existing_product.features = product.features
-        existing_product.reviews = product.reviews
-        existing_product.rating = product.rating
-        existing_product.embedding = product.embedding
-        existing_product.embedding_text = product.embedding_text
-        existing_product.updated_at = product.updated_at
-        existing_product.similar_products = product.similar_products
-        existing_product.variants = product.variants
-        existing_product.number_of_reviews = product.number_of_reviews
-        existing_product.qa = product.qa
-        existing_product.generated_review = product.generated_review
-        existing_product.affiliate_url = product.affiliate_url
-        await existing_product.save()
-        return existing_product
+        index_product(product_id, fields)
+        return fields["updated_at"]
+
+    @staticmethod
+    async def update_product(product_id: str, product: Product, expected_updated_at: Optional[datetime] = None,
+                             fields: Optional[Iterable[str]] = None) -> Optional[Product]:
+        """
+        Writes the given fields of the product, or every updatable field, with a single $set.
+
+        Callers that changed a few fields of a product they read name them, so the rest of the document, embedding
+        included, is neither encoded nor sent. Products are not diffed against their loaded state, keeping that
+        state would cost an encode of the whole document on every read.
+
+        Parameters:
+            product_id (str): The product to update.
+            product (Product): The new values.
+            expected_updated_at (datetime): The updated_at the caller last read, for optimistic concurrency.
+            fields (Iterable[str]): The fields to write, every updatable field when None.
+        """
+        names = UPDATABLE_FIELDS if fields is None else set(fields)
+        values = {name: value for name, value in get_dict(product, to_db=True).items() if name in names}
+        updated_at = await ProductService.update_product_fields(product_id, values, expected_updated_at)
+        if updated_at is None:
+            return None
+        product.updated_at = updated_at
+        return product
 
     @staticmethod
     async def delete_product(product_id: str) -> Optional[Product]:
@@ -94,6 +256,8 @@ class ProductService:
         if not product:
             return None
         await product.delete()
+        vector_search.remove(product.product_id)
+        lexical_search.remove(product.product_id)
         return product
 
 
@@ -103,6 +267,11 @@ class ProductErrorService:
         await product_error.save()
         return product_error
 
+    @staticmethod
+    async def create_product_errors(product_errors: List[ProductError]):
+        if product_errors:
+            await ProductError.insert_many(product_errors)
+
     @staticmethod
     async def get_product_error_by_id(product_id: str) -> Optional[ProductError]:
         product_error = await ProductError.find_one(ProductError.product_id == product_id)
@@ -115,6 +284,15 @@ class ProductErrorService:
         product_errors = await ProductError.all().to_list()
         return product_errors
 
+    @staticmethod
+    async def get_product_errors_page(limit: int = DEFAULT_PAGE_SIZE,
+                                      after: Optional[str] = None) -> Tuple[List[ProductError], Optional[str]]:
+        return await find_page(ProductError.get_motor_collection(), {}, ProductError, limit, after)
+
+    @staticmethod
+    def stream_product_errors(after: Optional[str] = None) -> AsyncIterator[ProductError]:
+        return stream_documents(ProductError.get_motor_collection(), {}, ProductError, after)
+
     @staticmethod
     async def get_product_error_by_job(job_id: str):
         product_errors = await ProductError.find(ProductError.job_id == job_id).to_list()
@@ -0,0 +1,210 @@
+import json
+import re
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.lexical_search import LEXICAL_FIELDS, field_text, tokenize
+
+RELEVANT = "relevant"
+IRRELEVANT = "irrelevant"
+UNCERTAIN = "uncertain"
+
+# Words of a shopping query that say nothing about the product itself
+QUERY_STOPWORDS = frozenset(
+    "best buy cheap cheapest good find looking need want show recommend some any under below over above less more "
+    "than between price priced cost costs budget dollars usd around about least most max maximum min minimum rated "
+    "rating stars star please can could would like get something one up"
+    .split()
+)
+# Sizes and capacities such as 16gb or 65w, they mix letters and digits without being model numbers
+_UNIT = re.compile(r"^\d+(?:\.\d+)?(?:gb|tb|mb|mp|hz|khz|mhz|ghz|w|mah|in|inch|mm|cm|k|oz|lb|lbs|ft|v|p)$")
+_NUMBER = r"(\d+(?:,\d{3})*(?:\.\d+)?)"
+_PART = re.compile(r"[a-z0-9]+")
+_RATING = re.compile(r"(?:rated\s+(?:at\s+least\s+)?" + _NUMBER + r"|" + _NUMBER + r"\s*\+?\s*stars?)")
+_PRICE_RANGE = re.compile(r"between\s+\$?\s*" + _NUMBER + r"\s+and\s+\$?\s*" + _NUMBER
+                          + r"|\$\s*" + _NUMBER + r"\s*(?:-|to)\s*\$?\s*" + _NUMBER)
+# A number followed by a unit is not a price, as in "up to 16gb"
+_NOT_UNIT = r"(?!\d|[.,]\d|\s*(?:gb|tb|mb|ghz|hz|w|mah|inch|in|mm|cm|hours?|lbs?|oz|%)\b)"
+_MAX_PRICE = re.compile(r"(?:under|below|less than|cheaper than|up to|no more than|at most|max(?:imum)?|within|<)"
+                        r"\s*\$?\s*" + _NUMBER + _NOT_UNIT)
+_MIN_PRICE = re.compile(r"(?:over|above|more than|at least|min(?:imum)?|>)\s*\$?\s*" + _NUMBER + _NOT_UNIT)
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+class QueryConstraints(BaseModel):
+    terms: List[str] = []
+    identifiers: List[str] = []
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_rating: Optional[float] = None
+
+
+def is_identifier(token: str) -> bool:
+    # Model numbers and ASINs mix letters and digits, like e1504fa-as52 or b0cv5j4ztd
+    return (len(token) >= 4 and any(c.isdigit() for c in token) and any(c.isalpha() for c in token)
+            and not _UNIT.match(token))
+
+
+def extract_constraints(query: str) -> QueryConstraints:
+    """
+    Pulls the price range, minimum rating, model numbers and content words out of a shopping query.
+    """
+    text = query.lower()
+    constraints = QueryConstraints()
+    rating = _RATING.search(text)
+    if rating:
+        value = _number(rating.group(1) or rating.group(2))
+        if value <= 5:
+            constraints.min_rating = value
+        text = text[:rating.start()] + " " + text[rating.end():]
+    price_range = _PRICE_RANGE.search(text)
+    if price_range:
+        low, high = [_number(value) for value in price_range.groups() if value]
+        constraints.min_price, constraints.max_price = min(low, high), max(low, high)
+        text = text[:price_range.start()] + " " + text[price_range.end():]
+    else:
+        max_price = _MAX_PRICE.search(text)
+        if max_price:
+            constraints.max_price = _number(max_price.group(1))
+            text = text[:max_price.start()] + " " + text[max_price.end():]
+        min_price = _MIN_PRICE.search(text)
+        if min_price:
+            constraints.min_price = _number(min_price.group(1))
+            text = text[:min_price.start()] + " " + text[min_price.end():]
+    tokens = list(dict.fromkeys(tokenize(text)))
+    # tokenize also yields the parts of a model number, it must match whole
+    parts = {part for token in tokens if is_identifier(token) and not token.isalnum() for part in _PART.findall(token)}
+    constraints.identifiers = [token for token in tokens if is_identifier(token) and token not in parts]
+    constraints.terms = [
+        token for token in tokens
+        if token.isalnum() and not token.isdigit() and not is_identifier(token) and token not in parts
+        and token not in QUERY_STOPWORDS
+    ]
+    return constraints
+
+
+class Judgement(BaseModel):
+    product_id: str
+    verdict: str
+    relevance: float
+    reason: str = ""
+
+
+class RelevanceScorer:
+    """
+    Decides locally whether a search result matches the query, so the LLM only validates the results it cannot
+    decide.
+
+    A product outside the query's price range or below its minimum rating is irrelevant, one carrying the model
+    number the user asked for is relevant. Otherwise the relevance mixes the vector score, rescaled from
+    [vector_floor, vector_ceiling] to [0, 1], with the share of the query's words found in the product. Products at
+    or above accept are relevant, below reject irrelevant and the rest uncertain.
+
+    Parameters:
+        accept (float): The relevance from which a product is kept without asking the LLM.
+        reject (float): The relevance under which a product is dropped without asking the LLM.
+        vector_floor (float): The vector score of unrelated products, it counts as 0.
+        vector_ceiling (float): The vector score of clear matches, it counts as 1.
+        vector_weight (float): The share of the relevance given to the vector score, the rest goes to word overlap.
+    """
+
+    def __init__(self, accept: float = 0.7, reject: float = 0.35, vector_floor: float = 0.9,
+                 vector_ceiling: float = 0.95, vector_weight: float = 0.6):
+        self.accept = accept
+        self.reject = reject
+        self.vector_floor = vector_floor
+        self.vector_ceiling = vector_ceiling
+        self.vector_weight = vector_weight
+        self.verdicts = {RELEVANT: 0, IRRELEVANT: 0, UNCERTAIN: 0}
+        self.searches = 0
+        self.llm_validations = 0
+
+    def judge_one(self, constraints: QueryConstraints, document: dict) -> Judgement:
+        product_id = document["product_id"]
+        price = document.get("price") or 0
+        if price and constraints.max_price is not None and price > constraints.max_price:
+            return Judgement(product_id=product_id, verdict=IRRELEVANT, relevance=0.0, reason="over budget")
+        if price and constraints.min_price is not None and price < constraints.min_price:
+            return Judgement(product_id=product_id, verdict=IRRELEVANT, relevance=0.0, reason="under price range")
+        rating = document.get("rating") or 0
+        if rating and constraints.min_rating is not None and rating < constraints.min_rating:
+            return Judgement(product_id=product_id, verdict=IRRELEVANT, relevance=0.0, reason="rating too low")
+        tokens = set(tokenize(" ".join(field_text(document.get(name)) for name in LEXICAL_FIELDS)))
+        tokens.add(product_id.lower())
+        if any(identifier in tokens for identifier in constraints.identifiers):
+            return Judgement(product_id=product_id, verdict=RELEVANT, relevance=1.0, reason="model number")
+        # Hybrid results carry the vector score separately, plain vector results as their score
+        vector_score = document["vector_score"] if "vector_score" in document else document.get("score")
+        vector = 0.0
+        if vector_score is not None:
+            vector = (vector_score - self.vector_floor) / (self.vector_ceiling - self.vector_floor)
+            vector = min(max(vector, 0.0), 1.0)
+        words = constraints.terms + constraints.identifiers
+        overlap = sum(word in tokens for word in words) / len(words) if words else vector
+        relevance = self.vector_weight * vector + (1 - self.vector_weight) * overlap
+        if relevance >= self.accept:
+            verdict = RELEVANT
+        elif relevance < self.reject:
+            verdict = IRRELEVANT
+        else:
+            verdict = UNCERTAIN
+        return Judgement(product_id=product_id, verdict=verdict, relevance=round(relevance, 4))
+
+    def judge(self, query: str, documents: Iterable[dict]) -> List[Judgement]:
+        constraints = extract_constraints(query)
+        judgements = [self.judge_one(constraints, document) for document in documents]
+        self.searches += 1
+        for judgement in judgements:
+            self.verdicts[judgement.verdict] += 1
+        return judgements
+
+    @staticmethod
+    def message(documents: List[dict]) -> str:
+        # Stands in for the LLM's message when every product was decided locally
+        if not documents:
+            return "No products found"
+        titles = ", ".join(document.get("title", document["product_id"]) for document in documents[:3])
+        more = f" and {len(documents) - 3} more" if len(documents) > 3 else ""
+        return f"These products match what you are looking for: {titles}{more}"
+
+    def stats(self) -> dict:
+        return {
+            "searches": self.searches,
+            "verdicts": dict(self.verdicts),
+            "llm_validations": self.llm_validations,
+            "llm_validation_rate": round(self.llm_validations / self.searches, 4) if self.searches else 0.0,
+        }
+
+
+def record_validation(path: str, query: str, documents: List[dict], relevant_ids: List[str]):
+    """
+    Appends a query, its candidates and the ids the LLM kept to a JSON lines file, the input of the offline
+    evaluation in benchmarks/eval_reranker.py.
+    """
+    fields = ("product_id", "price", "rating", "score", "vector_score", "lexical_score", *LEXICAL_FIELDS)
+    record = {
+        "query": query,
+        "recorded_at": datetime.now().isoformat(),
+        "candidates": [{name: document[name] for name in fields if name in document} for document in documents],
+        "relevant": relevant_ids,
+    }
+    try:
+        with open(path, "a") as file:
+            file.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        logger.error(f"Could not record search validation to {path}: {e}")
+
+
+reranker = RelevanceScorer(
+    accept=settings.RERANK_ACCEPT,
+    reject=settings.RERANK_REJECT,
+    vector_floor=settings.RERANK_VECTOR_FLOOR,
+    vector_ceiling=settings.RERANK_VECTOR_CEILING,
+)
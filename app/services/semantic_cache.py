@@ -0,0 +1,118 @@
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+# Upper edges of the similarity histogram buckets, finer near the thresholds that matter
+SIMILARITY_BUCKETS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99, 1.0]
+
+
+class SemanticCacheEntry(BaseModel):
+    query: str
+    products: List[Any]
+    message: str
+    similarity: float = 1.0
+
+
+class SemanticCache:
+    """
+    Serves search results for queries whose embedding is close enough to a query answered before.
+
+    Embeddings are kept normalized in one preallocated float32 matrix, so a lookup is a single matrix-vector
+    product. When the cache is full the oldest entry is overwritten, and entries older than ttl are ignored.
+
+    Parameters:
+        threshold (float): The minimum cosine similarity for a cached entry to be served.
+        ttl (float): How many seconds an entry stays fresh.
+        max_entries (int): The number of entries kept.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.vectors: Optional[np.ndarray] = None
+        self.expires_at = np.zeros(max_entries, dtype=np.float64)
+        self.entries: List[Optional[SemanticCacheEntry]] = [None] * max_entries
+        self.size = 0
+        self.next_slot = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.histogram = [0] * len(SIMILARITY_BUCKETS)
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def _record_similarity(self, similarity: float):
+        bucket = int(np.searchsorted(SIMILARITY_BUCKETS, similarity, side="left"))
+        self.histogram[min(bucket, len(SIMILARITY_BUCKETS) - 1)] += 1
+
+    def lookup(self, embedding) -> Optional[SemanticCacheEntry]:
+        vector = self._normalize(embedding)
+        if self.size == 0 or vector is None or self.vectors is None or vector.shape[0] != self.vectors.shape[1]:
+            self.misses += 1
+            return None
+        similarities = self.vectors[:self.size] @ vector
+        similarities[self.expires_at[:self.size] <= time.monotonic()] = -np.inf
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity == -np.inf:
+            self.misses += 1
+            return None
+        self._record_similarity(similarity)
+        if similarity < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.entries[best].copy(update={"similarity": similarity})
+
+    def store(self, query: str, embedding, products: List[Any], message: str):
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self.vectors.shape[1]:
+            return
+        slot = self.next_slot
+        self.vectors[slot] = vector
+        self.expires_at[slot] = time.monotonic() + self.ttl
+        self.entries[slot] = SemanticCacheEntry(query=query, products=products, message=message)
+        self.next_slot = (slot + 1) % self.max_entries
+        self.size = min(self.size + 1, self.max_entries)
+
+    def clear(self):
+        self.size = 0
+        self.next_slot = 0
+        self.entries = [None] * self.max_entries
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self.size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / total if total else 0.0,
+            "similarity_histogram": {
+                f"<={edge}": count for edge, count in zip(SIMILARITY_BUCKETS, self.histogram)
+            },
+        }
+
+
+semantic_cache = SemanticCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    max_entries=settings.SEMANTIC_CACHE_SIZE,
+)
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from app.models.conversation_model import Conversation, Message
+from app.schemas.product_schema import ProductCard
+from app.services.context_builder import ContextBuilder
+
+
+def make_card(i):
+    return ProductCard(product_id=f"B0{i:08d}", title=f"Product {i} " + "with a very long title " * 10,
+                       image_url="https://example.com/image.jpg", price=9.99)
+
+
+def test_products_are_compacted_and_history_fits_the_budget():
+    summarized = []
+
+    async def summarize(user_id, until):
+        summarized.append((user_id, until))
+
+    async def main():
+        builder = ContextBuilder(budgets={"small": 300}, max_messages=10, summarize=summarize)
+        messages = [Message(role="assistant", content=f"Answer {i}", products=[make_card(i)]) for i in range(10)]
+        conversation = Conversation.construct(user_id="user-1", messages=messages, summary="Wants a laptop")
+
+        full = builder.build("You are a shopping assistant", conversation, "which is cheapest?", "unknown")
+        assert len(full) == 13
+        assert full[1]["content"].endswith("Wants a laptop")
+        products = json.loads(full[2]["content"])["products"]
+        assert products == [{"product_id": "B000000000", "title": messages[0].products[0].title[:80]}]
+
+        small = builder.build("You are a shopping assistant", conversation, "which is cheapest?", "small")
+        assert 3 < len(small) < 13
+        assert json.loads(small[-2]["content"])["message"] == "Answer 9"
+
+        stats = builder.stats()
+        assert stats["truncated"] == 1
+        assert stats["prompt_tokens_after"] < stats["prompt_tokens_before"]
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    # The second build was scheduled while the first summary was still running
+    assert [user_id for user_id, _ in summarized] == ["user-1"]
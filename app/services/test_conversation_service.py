@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.models.conversation_model import ChatMessage, Conversation, Message
+from app.services.conversation_service import ConversationService
+
+
+@pytest.fixture
+def collections(fake_collection):
+    return fake_collection(ChatMessage), fake_collection(Conversation)
+
+
+def make_turns(count: int):
+    # The user message and the reply of a turn are written together and share a timestamp
+    start = datetime(2024, 5, 1, 12, 0)
+    messages = []
+    for turn in range(count):
+        timestamp = start + timedelta(minutes=turn)
+        messages.append(Message(timestamp=timestamp, role="user", content=f"question {turn}"))
+        messages.append(Message(timestamp=timestamp, role="assistant", content=f"answer {turn}"))
+    return messages
+
+
+def test_recent_messages_are_returned_oldest_first(collections):
+    async def run():
+        await ConversationService.append_messages("user-1", make_turns(3))
+        await ConversationService.append_messages("user-2", make_turns(1))
+        return await ConversationService.get_recent_messages("user-1", limit=3)
+
+    messages = asyncio.run(run())
+    assert [message["content"] for message in messages] == ["answer 1", "question 2", "answer 2"]
+    assert all("_id" not in message and "user_id" not in message for message in messages)
+
+
+def test_message_pages_split_turns_without_losing_messages(collections):
+    async def run():
+        await ConversationService.append_messages("user-1", make_turns(4))
+        pages = [await ConversationService.get_message_page("user-1", limit=3)]
+        while pages[-1].next_before is not None:
+            pages.append(await ConversationService.get_message_page(
+                "user-1", limit=3, before=pages[-1].next_before, before_id=ObjectId(pages[-1].next_before_id)))
+        return pages
+
+    pages = asyncio.run(run())
+    contents = [message["content"] for page in reversed(pages) for message in page.messages]
+    assert contents == [f"{kind} {turn}" for turn in range(4) for kind in ("question", "answer")]
+    # The first page ends in the middle of a turn, the next one still starts with its question
+    assert pages[0].messages[0]["content"] == "answer 2"
+    assert pages[1].messages[-1]["content"] == "question 2"
+
+
+def test_summary_resumes_inside_a_turn(collections):
+    async def run():
+        await ConversationService.append_messages("user-1", make_turns(3))
+        until = datetime(2024, 5, 1, 13, 0)
+        first = await ConversationService.get_messages_between("user-1", None, until, limit=3)
+        # The limit stopped after the question of turn 1, its answer shares the timestamp
+        rest = await ConversationService.get_messages_between("user-1", first[-1]["timestamp"], until,
+                                                             after_id=first[-1]["_id"])
+        return first, rest
+
+    first, rest = asyncio.run(run())
+    assert [message["content"] for message in first + rest] == \
+           [f"{kind} {turn}" for turn in range(3) for kind in ("question", "answer")]
+
+
+def test_messages_live_outside_the_header_and_are_deleted_with_it(collections):
+    messages, headers = collections
+
+    async def run():
+        await ConversationService.append_messages("user-1", make_turns(2))
+        await ConversationService.append_messages("user-1", make_turns(1))
+        await ConversationService.append_messages("user-2", make_turns(1))
+        stored = (len(messages.documents), len(headers.documents), headers.documents[0].get("messages"))
+        deleted = await ConversationService.delete_conversation("user-1")
+        return stored, deleted, await ConversationService.delete_conversation("user-1")
+
+    (stored_messages, stored_headers, embedded), deleted, missing = asyncio.run(run())
+    assert (stored_messages, stored_headers, embedded) == (8, 2, None)
+    assert deleted.user_id == "user-1" and missing is None
+    assert [document["user_id"] for document in messages.documents] == ["user-2", "user-2"]
+    assert [document["user_id"] for document in headers.documents] == ["user-2"]
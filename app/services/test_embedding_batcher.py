@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+
+def test_concurrent_requests_share_one_call():
+    calls = []
+
+    async def embed_batch(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=4, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed("x" * i) for i in range(1, 7)))
+
+    assert asyncio.run(run()) == [[float(i)] for i in range(1, 7)]
+    assert [len(call) for call in calls] == [4, 2]
+
+
+def test_token_limit_splits_batches():
+    calls = []
+
+    async def embed_batch(texts):
+        calls.append(len(texts))
+        return [[0.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=10, max_batch_tokens=30, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed("y" * 40) for _ in range(5)))
+
+    asyncio.run(run())
+    assert sum(calls) == 5
+    assert max(calls) <= 2
+
+
+def test_bad_input_only_fails_its_caller():
+    async def embed_batch(texts):
+        if "bad" in texts:
+            raise ValueError("bad input")
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(batcher.embed("good"), batcher.embed("bad"), batcher.embed("fine"),
+                                    return_exceptions=True)
+
+    good, bad, fine = asyncio.run(run())
+    assert good == [1.0] and fine == [1.0]
+    assert isinstance(bad, ValueError)
+    assert batcher.failed_inputs == 1
+
+
+def test_failed_batch_is_retried_with_bounded_concurrency():
+    in_flight = []
+    peak = []
+
+    async def embed_batch(texts):
+        if len(texts) > 1:
+            raise TimeoutError("batch timed out")
+        in_flight.append(texts[0])
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.001)
+        in_flight.remove(texts[0])
+        return [[1.0]]
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=16, max_wait=0.01, retry_concurrency=2)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed(f"text {i}") for i in range(16)))
+
+    assert asyncio.run(run()) == [[1.0]] * 16
+    assert max(peak) <= 2
+
+
+def test_rate_limited_batch_fails_without_retries():
+    calls = []
+
+    class RateLimitError(Exception):
+        status_code = 429
+
+    async def embed_batch(texts):
+        calls.append(len(texts))
+        raise RateLimitError("slow down")
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed(f"text {i}") for i in range(8)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RateLimitError) for result in results)
+    assert calls == [8]
+    assert batcher.failed_inputs == 8
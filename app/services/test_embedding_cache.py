@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.models.embedding_cache_model import EmbeddingCacheEntry
+from app.services.embedding_cache import EmbeddingStore, embedding_cache_key
+from app.utils.embedding import FLOAT32, decode_embedding, encode_embedding
+
+
+@pytest.fixture
+def collection(fake_collection):
+    return fake_collection(EmbeddingCacheEntry)
+
+
+def counting_embed(calls, delay=0.0):
+    async def embed(text):
+        calls.append(text)
+        await asyncio.sleep(delay)
+        return [0.1, 0.2, float(len(text))]
+
+    return embed
+
+
+def test_memory_hit_skips_mongo_and_provider(collection):
+    calls = []
+    store = EmbeddingStore(maxsize=10)
+
+    async def run():
+        first = await store.get("laptop", "text-embedding-3-small", counting_embed(calls))
+        second = await store.get("laptop", "text-embedding-3-small", counting_embed(calls))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert calls == ["laptop"]
+    assert collection.count("find_one") == 1
+    assert store.stats()["provider_calls"] == 1
+
+
+def test_mongo_hit_fills_memory_with_packed_float32(collection):
+    vector = np.array([0.1, -2.5, 3.75], dtype=np.float32)
+    key = embedding_cache_key("text-embedding-3-small", "headphones")
+    collection.documents.append({"key": key, "embedding": encode_embedding(vector, FLOAT32)})
+    calls = []
+    store = EmbeddingStore(maxsize=10)
+
+    result = asyncio.run(store.get("headphones", "text-embedding-3-small", counting_embed(calls)))
+    assert result == vector.tolist()
+    assert calls == []
+    assert store.mongo_hits == 1
+    assert store.memory.get(key) is not None
+
+    # A provider result is written packed and reads back unchanged
+    written = asyncio.run(store.get("monitor", "text-embedding-3-small", counting_embed(calls)))
+    stored = collection.documents[-1]["embedding"]
+    assert collection.documents[-1]["key"] == embedding_cache_key("text-embedding-3-small", "monitor")
+    assert stored == encode_embedding(written, FLOAT32)
+    assert decode_embedding(stored).tolist() == written
+
+
+def test_concurrent_misses_make_one_provider_call(collection):
+    calls = []
+    store = EmbeddingStore(maxsize=10)
+
+    async def run():
+        embed = counting_embed(calls, delay=0.01)
+        return await asyncio.gather(*(store.get("keyboard", "text-embedding-3-small", embed) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert calls == ["keyboard"]
+    assert all(result == results[0] for result in results)
+    assert store.stats()["coalesced"] == 4
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+
+from app.models.product_model import Product
+from app.services.lexical_search import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def make_index():
+    index = BM25Index(refresh_interval=0)
+    index.upsert("B0CV5J4ZTD", {
+        "title": "ASUS Vivobook Go 15 E1504FA-AS52 Laptop",
+        "features": ["15.6 inch FHD display", "AMD Ryzen 5 7520U"],
+        "specs": {"Brand": "ASUS", "RAM": "8 GB"},
+        "embedding_text": "Thin and light laptop for students",
+    })
+    index.upsert("B0BSHF7WHW", {
+        "title": "Lenovo IdeaPad 1 Laptop",
+        "features": ["15.6 inch HD display", "AMD Ryzen 5 7520U"],
+        "specs": {"Brand": "Lenovo", "RAM": "8 GB"},
+        "embedding_text": "Budget laptop for students and home office",
+    })
+    index.upsert("B09G9FPHY6", {
+        "title": "Sony WH-1000XM5 Wireless Headphones",
+        "features": ["Noise cancelling"],
+        "specs": {"Brand": "Sony"},
+        "embedding_text": "Over-ear headphones for travel",
+    })
+    return index
+
+
+def test_model_numbers_are_kept_whole_and_split():
+    assert tokenize("The E1504FA-AS52 is a laptop") == ["e1504fa-as52", "e1504fa", "as52", "laptop"]
+
+
+def test_exact_model_number_ranks_first():
+    index = make_index()
+    assert index.top_k("asus E1504FA-AS52", 3)[0][0] == "B0CV5J4ZTD"
+    assert index.top_k("e1504fa", 3) == index.top_k("E1504FA", 3)
+    assert index.top_k("wh-1000xm5", 3)[0][0] == "B09G9FPHY6"
+    assert [product_id for product_id, _ in index.top_k("ryzen laptop", 3, ["B0CV5J4ZTD"])] == ["B0BSHF7WHW"]
+    assert index.top_k("refrigerator", 3) == []
+
+
+def test_partial_updates_and_removal():
+    index = make_index()
+    # Only embedding_text is written when a product is re-embedded, its title stays indexed
+    index.upsert("B09G9FPHY6", {"embedding_text": "Bluetooth headset for flights", "embedding": [0.1, 0.2]})
+    assert index.top_k("sony flights", 1)[0][0] == "B09G9FPHY6"
+    assert index.top_k("travel", 3) == []
+
+    index.remove("B09G9FPHY6")
+    assert index.top_k("sony", 3) == []
+    assert "sony" not in index.postings
+    assert len(index) == 2
+    assert index.total_length == sum(index.lengths.values())
+
+
+def test_refresh_drops_products_deleted_elsewhere(fake_collection):
+    index = make_index()
+    index.loaded_at = datetime(2024, 5, 1, 12, 0)
+    # Another instance deleted the headphones, the laptops are still stored and unchanged
+    fake_collection(Product, [{"product_id": "B0CV5J4ZTD", "updated_at": index.loaded_at},
+                              {"product_id": "B0BSHF7WHW", "updated_at": index.loaded_at}])
+    asyncio.run(index.load(since=datetime(2024, 5, 1, 13, 0)))
+    assert set(index.documents) == {"B0CV5J4ZTD", "B0BSHF7WHW"}
+    assert index.top_k("sony", 3) == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], k=60)
+    assert [product_id for product_id, _ in fused] == ["a", "c", "b", "d"]
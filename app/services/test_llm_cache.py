@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.services.llm_cache import MemoryResponseCache, ResponseCache, TieredResponseCache, response_cache_key
+
+
+class FailingCache(MemoryResponseCache):
+    async def get(self, key):
+        raise ConnectionError("tier down")
+
+
+def test_cache_key_is_canonical():
+    messages = [{"role": "system", "content": "prompt"}, {"content": "laptops", "role": "user"}]
+    reordered = [{"content": "prompt", "role": "system"}, {"role": "user", "content": "laptops"}]
+    assert response_cache_key("gpt-4o", "abc123", messages) == response_cache_key("gpt-4o", "abc123", reordered)
+    assert response_cache_key("gpt-4o", "abc123", messages) != response_cache_key("gpt-4o", "def456", messages)
+    assert response_cache_key("gpt-4o", "abc123", messages) != response_cache_key("gpt-4o-mini", "abc123", messages)
+
+
+def test_response_cache_is_abstract():
+    with pytest.raises(TypeError):
+        ResponseCache()
+
+
+def test_memory_cache_evicts_least_recently_used_by_size():
+    async def run():
+        cache = MemoryResponseCache(max_bytes=10)
+        await cache.set("a", "aaaa")
+        await cache.set("b", "bbbb")
+        assert await cache.get("a") == "aaaa"
+        # Making room for c evicts b, a was used more recently
+        await cache.set("c", "cccc")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "aaaa" and await cache.get("c") == "cccc"
+        assert cache.stats() == {"entries": 2, "bytes": 8, "max_bytes": 10}
+
+        # A response larger than the whole cache is not stored
+        await cache.set("d", "d" * 11)
+        assert await cache.get("d") is None
+        assert cache.size == 8
+
+    asyncio.run(run())
+
+
+def test_tiered_cache_backfills_faster_tiers():
+    async def run():
+        memory, slow = MemoryResponseCache(max_bytes=1000), MemoryResponseCache(max_bytes=1000)
+        cache = TieredResponseCache([memory, slow])
+        await slow.set("key", "response")
+
+        assert await cache.get("key") == "response"
+        assert await memory.get("key") == "response"
+        assert await cache.get("key") == "response"
+        assert await cache.get("missing") is None
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (2, 1)
+        assert [tier["hits"] for tier in stats["tiers"]] == [1, 1]
+
+        # A failing tier is skipped rather than failing the lookup
+        failing = TieredResponseCache([FailingCache(max_bytes=1000), slow])
+        assert await failing.get("key") == "response"
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm_service
+from app.services.llm_cache import MemoryResponseCache, response_cache_key
+from app.services.llm_service import GEMINI, GPT3, Llama, LLMService
+
+CONVERSATION = [{"role": "system", "content": "prompt"}, {"role": "user", "content": "laptops"}]
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+
+def completion_chunk(content):
+    # OpenAI and Groq stream the same chunk shape, the last chunk has no content
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class BlockedChunk:
+    # Like the Gemini SDK, a chunk without parts raises when its text is read
+    parts = []
+
+    @property
+    def text(self):
+        raise ValueError("The response has no parts")
+
+
+def gemini_chunk(text):
+    return SimpleNamespace(parts=[text], text=text) if text is not None else BlockedChunk()
+
+
+class FakeCompletions:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        return FakeStream(self.chunks)
+
+
+class FakeGeminiModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.requests = []
+
+    async def generate_content_async(self, content, stream=False):
+        self.requests.append(stream)
+        return FakeStream(self.chunks)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    deltas = ["Two ", "laptops ", "match."]
+    openai = FakeCompletions([completion_chunk(delta) for delta in deltas] + [completion_chunk(None)])
+    groq = FakeCompletions([completion_chunk(delta) for delta in deltas] + [SimpleNamespace(choices=[])])
+    gemini = FakeGeminiModel([gemini_chunk(deltas[0]), gemini_chunk(None), gemini_chunk(deltas[1]),
+                              gemini_chunk(deltas[2])])
+    fake = SimpleNamespace(openai=SimpleNamespace(chat=SimpleNamespace(completions=openai)),
+                           groq=SimpleNamespace(chat=SimpleNamespace(completions=groq)),
+                           gemini=lambda model: gemini)
+    monkeypatch.setattr(llm_service, "llm_clients", fake)
+    monkeypatch.setattr(llm_service, "llm_response_cache", MemoryResponseCache(max_bytes=10000))
+    return {GPT3: openai, Llama: groq, GEMINI: gemini}
+
+
+def collecting(deltas):
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    return on_delta
+
+
+@pytest.mark.parametrize("model", [GPT3, GEMINI, Llama])
+def test_streamed_response_is_returned_and_cached(clients, model):
+    deltas = []
+    response = asyncio.run(LLMService.llm_request(CONVERSATION, model, prompt_version="v1",
+                                                  on_delta=collecting(deltas)))
+    assert deltas == ["Two ", "laptops ", "match."]
+    assert response == "Two laptops match."
+    key = response_cache_key(model, "v1", CONVERSATION)
+    assert asyncio.run(llm_service.llm_response_cache.get(key)) == response
+    # Gemini records the stream flag, the completion clients the whole request
+    request = clients[model].requests[0]
+    assert (request if model == GEMINI else request["stream"]) is True
+
+
+def test_cache_hit_is_one_delta(clients):
+    key = response_cache_key(GPT3, "v1", CONVERSATION)
+    asyncio.run(llm_service.llm_response_cache.set(key, "Cached answer."))
+    deltas = []
+    response = asyncio.run(LLMService.llm_request(CONVERSATION, GPT3, prompt_version="v1",
+                                                  on_delta=collecting(deltas)))
+    assert response == "Cached answer."
+    assert deltas == ["Cached answer."]
+    assert clients[GPT3].requests == []
+
+
+def test_locally_accepted_products_are_described_with_the_llm_ones(monkeypatch):
+    documents = [
+        {"product_id": "B0CV5J4ZTD", "title": "ASUS Vivobook Go 15 E1504FA-AS52 Laptop", "score": 0.88},
+        {"product_id": "B0B2MLLZ8J", "title": "Laptop sleeve", "score": 0.93},
+    ]
+
+    async def search_documents(*args):
+        return documents
+
+    validated = []
+
+    async def validate_with_llm(uncertain, query, model):
+        # The LLM only sees the sleeve and rejects it
+        validated.extend(document["product_id"] for document in uncertain)
+        return [], "None of these products match"
+
+    monkeypatch.setattr(llm_service.vector_search, "search_documents", search_documents)
+    monkeypatch.setattr(LLMService, "validate_with_llm", staticmethod(validate_with_llm))
+    monkeypatch.setattr(llm_service.settings, "RERANK_RECORD_PATH", "")
+
+    relevant, message = asyncio.run(LLMService.find_similar_embeddings([0.1], [], "asus e1504fa-as52 laptop"))
+    assert validated == ["B0B2MLLZ8J"]
+    assert [document["product_id"] for document in relevant] == ["B0CV5J4ZTD"]
+    assert message == llm_service.reranker.message(relevant)
+    assert "None of these" not in message
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.product_model import Product
+from app.services import product_service
+from app.services.product_service import ProductService
+
+
+@pytest.fixture
+def products(fake_collection):
+    return fake_collection(Product)
+
+
+def make_product(**fields) -> Product:
+    values = dict(product_id="B0CV5J4ZTD", job_id="job", domain="www.amazon.com", title="ASUS Vivobook Go 15",
+                  description="Laptop", price=379.0, image_url="https://example.com/image.jpg", specs={"RAM": "8 GB"},
+                  features=["15.6 inch display"], reviews=[], rating=4.3)
+    return Product(**{**values, **fields})
+
+
+def stored(products, read_at: datetime) -> Product:
+    product = make_product(updated_at=read_at)
+    products.documents.append({"product_id": product.product_id, "price": product.price, "updated_at": read_at})
+    return product
+
+
+def test_update_sends_only_the_named_fields_and_bumps_updated_at(products):
+    read_at = datetime(2024, 5, 1, 12, 0)
+    product = stored(products, read_at)
+    product.price = 349.0
+    product.title = "Not sent"
+
+    updated = asyncio.run(ProductService.update_product(product.product_id, product, read_at, fields=["price"]))
+    document = products.documents[0]
+    assert document["price"] == 349.0 and "title" not in document
+    assert document["updated_at"] > read_at
+    assert updated.updated_at == document["updated_at"]
+
+
+def test_echoed_updated_at_is_replaced(products):
+    read_at = datetime(2024, 5, 1, 12, 0)
+    # A PUT body sends every updatable field and echoes the updated_at it read
+    body = stored(products, read_at)
+    body.price = 349.0
+
+    asyncio.run(ProductService.update_product(body.product_id, body, read_at))
+    assert products.documents[0]["price"] == 349.0
+    assert products.documents[0]["updated_at"] > read_at
+    with pytest.raises(HTTPException):
+        asyncio.run(ProductService.update_product(body.product_id, make_product(updated_at=read_at), read_at))
+
+
+def test_stale_updated_at_is_a_conflict(products):
+    read_at = datetime(2024, 5, 1, 12, 0)
+    first = stored(products, read_at)
+    second = make_product(updated_at=read_at)
+    first.price = 349.0
+    asyncio.run(ProductService.update_product(first.product_id, first, read_at, fields=["price"]))
+
+    # The second writer still holds the first read, it loses instead of overwriting
+    second.title = "ASUS Vivobook Go 15 (2024)"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(ProductService.update_product(second.product_id, second, read_at, fields=["title"]))
+    assert error.value.status_code == 409
+    assert products.documents[0].get("title") is None
+
+
+def test_missing_product_is_none(products):
+    product = make_product()
+    assert asyncio.run(ProductService.update_product("B000000000", product, fields=["price"])) is None
+    assert products.documents == []
+
+
+def test_insert_returns_only_the_products_that_were_upserted(products, monkeypatch):
+    indexed = []
+    monkeypatch.setattr(product_service, "index_product", lambda product_id, fields: indexed.append(product_id))
+    # Another job inserted the second product between the existence check and the write
+    products.documents.append({"product_id": "B0BSHF7WHW", "title": "Inserted concurrently"})
+    batch = [make_product(product_id=product_id) for product_id in ("B0CV5J4ZTD", "B0BSHF7WHW", "B07W6JN8V8")]
+
+    inserted = asyncio.run(ProductService.insert_products(batch))
+    assert [product.product_id for product in inserted] == ["B0CV5J4ZTD", "B07W6JN8V8"]
+    assert indexed == ["B0CV5J4ZTD", "B07W6JN8V8"]
+    # The ids come from upserted_ids, whose indexes skip the no-op upsert
+    documents = {document["product_id"]: document for document in products.documents}
+    assert [product.id for product in inserted] == [documents["B0CV5J4ZTD"]["_id"], documents["B07W6JN8V8"]["_id"]]
+    assert documents["B0BSHF7WHW"] == {"product_id": "B0BSHF7WHW", "title": "Inserted concurrently"}
+    assert products.count("bulk_write") == 1
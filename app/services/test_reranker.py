@@ -0,0 +1,38 @@
+from app.services.reranker import IRRELEVANT, RELEVANT, UNCERTAIN, RelevanceScorer, extract_constraints
+
+
+def make_product(product_id, title, price=100.0, rating=4.5, vector_score=0.92, **fields):
+    return {"product_id": product_id, "title": title, "price": price, "rating": rating, "score": vector_score,
+            "features": [], "specs": {}, "embedding_text": "", **fields}
+
+
+def test_constraints_are_extracted_from_the_query():
+    constraints = extract_constraints("Wireless headphones between $100 and $200 rated 4+ stars")
+    assert (constraints.min_price, constraints.max_price, constraints.min_rating) == (100, 200, 4)
+    assert constraints.terms == ["wireless", "headphones"]
+
+    constraints = extract_constraints("ASUS E1504FA-AS52 with up to 16gb ram under $500.")
+    assert constraints.max_price == 500 and constraints.min_price is None
+    assert constraints.identifiers == ["e1504fa-as52"]
+    assert constraints.terms == ["asus", "16gb", "ram"]
+
+
+def test_scorer_decides_clear_cases_and_leaves_the_rest():
+    scorer = RelevanceScorer(accept=0.7, reject=0.35, vector_floor=0.9, vector_ceiling=0.95)
+    documents = [
+        make_product("B0CV5J4ZTD", "ASUS Vivobook Go 15 E1504FA-AS52 Laptop", vector_score=0.88),
+        make_product("B0BSHF7WHW", "Lenovo IdeaPad 1 Laptop", price=379.0, vector_score=0.96),
+        make_product("B0C1ZJ5CZK", "ASUS Vivobook 16 Laptop", price=649.0, vector_score=0.96),
+        make_product("B0B2MLLZ8J", "Laptop sleeve", price=19.0, vector_score=0.93),
+        make_product("B07W6JN8V8", "Wireless keyboard", price=27.0, vector_score=0.85),
+    ]
+    judgements = scorer.judge("asus e1504fa-as52 laptop under $500", documents)
+    assert [judgement.verdict for judgement in judgements] == [RELEVANT, RELEVANT, IRRELEVANT, UNCERTAIN, IRRELEVANT]
+    assert judgements[0].reason == "model number"
+    assert judgements[2].reason == "over budget"
+    assert scorer.stats()["verdicts"] == {RELEVANT: 2, IRRELEVANT: 2, UNCERTAIN: 1}
+
+    # Hybrid results only found by the keyword search have no vector score
+    keyword_only = make_product("B0BSHF7WHW", "Lenovo IdeaPad 1 Laptop", vector_score=None)
+    keyword_only["vector_score"] = None
+    assert scorer.judge("lenovo ideapad laptop", [keyword_only])[0].verdict == UNCERTAIN
@@ -0,0 +1,34 @@
+import numpy as np
+
+from app.services.semantic_cache import SemanticCache
+
+
+def test_lookup_serves_close_queries_only():
+    cache = SemanticCache(threshold=0.95, ttl=60, max_entries=4)
+    rng = np.random.default_rng(0)
+    laptop = rng.normal(size=64)
+    cache.store("gaming laptop under 1000", laptop, ["B0LAPTOP01"], "Here are some laptops")
+
+    close = laptop + rng.normal(scale=0.05, size=64)
+    hit = cache.lookup(close)
+    assert hit is not None
+    assert hit.products == ["B0LAPTOP01"]
+    assert hit.similarity > 0.95
+
+    assert cache.lookup(rng.normal(size=64)) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert sum(stats["similarity_histogram"].values()) == 2
+
+
+def test_expired_and_overwritten_entries_are_not_served():
+    cache = SemanticCache(threshold=0.9, ttl=-1, max_entries=2)
+    cache.store("stale", [1.0, 0.0], ["B0STALE001"], "")
+    assert cache.lookup([1.0, 0.0]) is None
+
+    cache.ttl = 60
+    cache.store("first", [1.0, 0.0], ["B0FIRST001"], "")
+    cache.store("second", [0.0, 1.0], ["B0SECOND01"], "")
+    assert cache.size == 2
+    assert cache.lookup([1.0, 0.0]).query == "first"
+    assert cache.lookup([0.0, 1.0]).query == "second"
@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.models.product_model import Product, stock_available
+from app.schemas.product_schema import ProductFilters
+from app.services.vector_search import HNSW_AVAILABLE, HNSWVectorIndex, LocalVectorIndex, VectorSearchBackend
+
+
+def brute_force(vectors: dict, query, limit, exclude_ids=()):
+    # float64 reference over every vector, no index involved
+    query = np.asarray(query, dtype=np.float64)
+    scores = {
+        product_id: (1 + vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query))) / 2
+        for product_id, vector in vectors.items() if product_id not in exclude_ids
+    }
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def make_vectors(count, dimensions=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"B0{i:08d}": rng.normal(size=dimensions) for i in range(count)}
+
+
+def test_local_index_matches_brute_force():
+    vectors = make_vectors(3000)
+    index = LocalVectorIndex(refresh_interval=0)
+    for product_id, vector in vectors.items():
+        index.upsert(product_id, vector.tolist())
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        query = rng.normal(size=32)
+        excluded = set(rng.choice(list(vectors), size=5, replace=False))
+        expected = brute_force(vectors, query, 10, excluded)
+        results = index.top_k(query.tolist(), 10, excluded)
+        assert [product_id for product_id, _ in results] == [product_id for product_id, _ in expected]
+        assert np.allclose([score for _, score in results], [score for _, score in expected], atol=1e-5)
+
+
+def test_local_index_upsert_and_remove():
+    vectors = make_vectors(100)
+    index = LocalVectorIndex(refresh_interval=0)
+    for product_id, vector in vectors.items():
+        index.upsert(product_id, vector)
+    query = vectors["B000000007"]
+    assert index.top_k(query, 1)[0][0] == "B000000007"
+    assert index.top_k(query, 1, ["B000000007"])[0][0] != "B000000007"
+
+    index.remove("B000000007")
+    assert "B000000007" not in [product_id for product_id, _ in index.top_k(query, 100)]
+    assert len(index.top_k(query, 1000)) == 99
+
+    # Re-embedding moves the product, the freed row is reused by the next insert
+    index.upsert("B000000003", query)
+    index.upsert("B999999999", -query)
+    assert index.top_k(query, 1)[0][0] == "B000000003"
+    assert index.top_k(-query, 1)[0][0] == "B999999999"
+    assert index.stats()["vectors"] == 100
+    assert index.size == 100
+
+    # A product whose embedding is cleared leaves the index
+    index.upsert("B000000003", [])
+    assert len(index) == 99
+
+
+def test_refresh_drops_products_deleted_elsewhere(fake_collection):
+    vectors = make_vectors(3)
+    written = datetime(2024, 5, 1, 12, 0)
+    products = fake_collection(Product, [{"product_id": product_id, "embedding": vector.tolist(), "updated_at": written}
+                                         for product_id, vector in vectors.items()])
+    index = LocalVectorIndex(refresh_interval=0)
+    asyncio.run(index.load())
+    assert len(index) == 3
+
+    # Another instance deletes one product and adds one
+    products.documents.pop(0)
+    products.documents.append({"product_id": "B999999999", "embedding": vectors["B000000000"].tolist(),
+                               "updated_at": datetime.now() + timedelta(seconds=1)})
+    asyncio.run(index.load(since=index.loaded_at))
+    assert set(index.rows) == {"B000000001", "B000000002", "B999999999"}
+    assert index.top_k(vectors["B000000000"], 1)[0][0] == "B999999999"
+
+
+def test_local_index_filters_before_the_top_k():
+    vectors = make_vectors(3000)
+    index = LocalVectorIndex(refresh_interval=0)
+    metadata = {}
+    for i, (product_id, vector) in enumerate(vectors.items()):
+        metadata[product_id] = {"price": 10.0 * (i % 100), "rating": 1 + i % 5,
+                                "domain": "www.amazon.com" if i % 2 else "www.amazon.co.uk", "in_stock": i % 3 != 0}
+        index.upsert(product_id, vector)
+        index.set_metadata(product_id, metadata[product_id])
+    # Products without metadata never pass a filter on it
+    index.upsert("B999999999", vectors["B000000001"])
+
+    filters = ProductFilters(max_price=300, min_rating=4, domain="www.amazon.com", in_stock=True)
+    assert filters.to_query() == {"price": {"$lte": 300}, "rating": {"$gte": 4}, "domain": "www.amazon.com",
+                                  "in_stock": True}
+    matching = {
+        product_id: vector for product_id, vector in vectors.items()
+        if metadata[product_id]["price"] <= 300 and metadata[product_id]["rating"] >= 4
+        and metadata[product_id]["domain"] == "www.amazon.com" and metadata[product_id]["in_stock"]
+    }
+    query = vectors["B000000001"]
+    expected = brute_force(matching, query, 10)
+    assert [product_id for product_id, _ in index.top_k(query, 10, filters=filters)] == \
+           [product_id for product_id, _ in expected]
+    assert len(index.top_k(query, 1000, filters=filters)) == len(matching)
+    assert index.top_k(query, 10, filters=ProductFilters(domain="www.bestbuy.com")) == []
+
+    # Metadata is updated field by field and cleared with the row
+    product_id = expected[0][0]
+    index.set_metadata(product_id, {"price": 999.0})
+    assert product_id not in dict(index.top_k(query, 1000, filters=filters))
+    index.remove(product_id)
+    index.upsert("B888888888", query)
+    assert "B888888888" not in dict(index.top_k(query, 1000, filters=filters))
+
+
+def test_stock_text_is_read_as_availability():
+    assert stock_available("In Stock") is True
+    assert stock_available("Only 3 left in stock - order soon.") is True
+    assert stock_available("Currently unavailable.") is False
+    assert stock_available("") is None
+
+
+@pytest.mark.skipif(not HNSW_AVAILABLE, reason="hnswlib is not installed")
+def test_hnsw_index_recall():
+    vectors = make_vectors(2000)
+    index = HNSWVectorIndex(refresh_interval=0, ef_search=200)
+    for product_id, vector in vectors.items():
+        index.upsert(product_id, vector)
+    rng = np.random.default_rng(2)
+    found = 0
+    for _ in range(20):
+        query = rng.normal(size=32)
+        expected = {product_id for product_id, _ in brute_force(vectors, query, 10, {"B000000001"})}
+        results = index.top_k(query, 10, ["B000000001"])
+        assert "B000000001" not in [product_id for product_id, _ in results]
+        found += len(expected & {product_id for product_id, _ in results})
+    assert found / 200 >= 0.95
+
+
+def test_backends_must_implement_search():
+    with pytest.raises(TypeError):
+        VectorSearchBackend()
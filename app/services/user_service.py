@@ -1,10 +1,37 @@
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
+from app.core.config import settings
 from app.models.user_model import User
-from app.schemas.user_schema import Auth0User
+from app.schemas.user_schema import Auth0User, UserOut
+from app.utils.cache import TTLCache
+from app.utils.pagination import DEFAULT_PAGE_SIZE, find_page, stream_documents
+
+# Users keyed by ("email", email) and ("sub", user_id), both keys point at the same document
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
 
 
 class UserService:
+    @staticmethod
+    def cache_user(user: User):
+        user_cache.set(("email", user.email), user)
+        user_cache.set(("sub", user.user_id), user)
+
+    @staticmethod
+    def get_cached_user_by_email(email: str) -> Optional[User]:
+        return user_cache.get(("email", email))
+
+    @staticmethod
+    def invalidate_user(email: Optional[str] = None, user_id: Optional[str] = None):
+        cached = None
+        if email:
+            cached = user_cache.pop(("email", email))
+        if user_id:
+            cached = user_cache.pop(("sub", user_id)) or cached
+        # Drop the sibling key so a stale document is not served under the other identifier
+        if cached is not None:
+            user_cache.pop(("email", cached.email))
+            user_cache.pop(("sub", cached.user_id))
+
     @staticmethod
     async def create_user(auth0_user: Auth0User) -> Optional[User]:
         username = auth0_user.nickname
@@ -18,21 +45,31 @@ class UserService:
             last_name=auth0_user.family_name,
             picture=auth0_user.picture,
         )
+        UserService.invalidate_user(email=user.email, user_id=user.user_id)
         await user.save()
+        UserService.cache_user(user)
         return user
 
     @staticmethod
     async def get_user_by_id(user_id: str) -> Optional[User]:
+        user = user_cache.get(("sub", user_id))
+        if user is not None:
+            return user
         user = await User.find_one(User.user_id == user_id)
         if not user:
             return None
+        UserService.cache_user(user)
         return user
 
     @staticmethod
     async def get_user_by_email(email: str) -> Optional[User]:
+        user = user_cache.get(("email", email))
+        if user is not None:
+            return user
         user = await User.by_email(email)
         if not user:
             return None
+        UserService.cache_user(user)
         return user
 
     @staticmethod
@@ -40,6 +77,15 @@ class UserService:
         users = await User.all().to_list()
         return users
 
+    @staticmethod
+    async def get_users_page(limit: int = DEFAULT_PAGE_SIZE,
+                             after: Optional[str] = None) -> Tuple[List[UserOut], Optional[str]]:
+        return await find_page(User.get_motor_collection(), {}, UserOut, limit, after)
+
+    @staticmethod
+    def stream_users(after: Optional[str] = None) -> AsyncIterator[UserOut]:
+        return stream_documents(User.get_motor_collection(), {}, UserOut, after)
+
     @staticmethod
     async def get_admin_users():
         users = await User.find(User.roles == 'admin').to_list()
@@ -0,0 +1,415 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.models.product_model import Product
+from app.schemas.product_schema import ProductFilters
+from app.utils.embedding import ARRAY, decode_embedding
+
+try:
+    import hnswlib
+    HNSW_AVAILABLE = True
+except ImportError:
+    HNSW_AVAILABLE = False
+
+# Products read per round trip while loading the local index
+LOAD_BATCH_SIZE = 1000
+# Product fields the local indexes keep next to the vectors to apply ProductFilters
+FILTER_FIELDS = ("price", "rating", "domain", "in_stock")
+
+
+def cosine_to_score(similarities: np.ndarray) -> np.ndarray:
+    # Atlas reports cosine similarity rescaled to [0, 1], local backends do the same so scores are comparable
+    return (1.0 + similarities) / 2.0
+
+
+async def stored_product_ids() -> Set[str]:
+    """The product_id of every stored product, refreshes drop the indexed products missing from it"""
+    cursor = Product.get_motor_collection().find({}, {"_id": 0, "product_id": 1}, batch_size=LOAD_BATCH_SIZE)
+    return {product["product_id"] async for product in cursor}
+
+
+async def fetch_scored_documents(hits: List[Tuple[str, float]], excludes: Iterable[str] = (),
+                                 filters: Optional[ProductFilters] = None) -> List[dict]:
+    """
+    Fetches the products of (product_id, score) pairs with one query, best score first and with the score added.
+    Products that do not pass the filters are left out.
+    """
+    if not hits:
+        return []
+    scores = dict(hits)
+    projection = {field: 0 for field in excludes}
+    query = {"product_id": {"$in": list(scores)}, **(filters.to_query() if filters else {})}
+    cursor = Product.get_motor_collection().find(query, projection or None)
+    documents = [document async for document in cursor]
+    for document in documents:
+        document["score"] = scores[document["product_id"]]
+    return sorted(documents, key=lambda document: document["score"], reverse=True)
+
+
+class VectorSearchBackend(ABC):
+    """
+    Finds the products whose embeddings are closest to a query embedding.
+
+    search returns (product_id, score) pairs, best first, among the products that pass the filters.
+    search_documents also fetches the products, without the fields in excludes, and adds the score to each of them.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def search(self, embedding: Sequence[float], limit: int, exclude_ids: Iterable[str] = (),
+                     filters: Optional[ProductFilters] = None) -> List[Tuple[str, float]]:
+        ...
+
+    async def search_documents(self, embedding: Sequence[float], limit: int, excludes: Iterable[str] = (),
+                               exclude_ids: Iterable[str] = (), filters: Optional[ProductFilters] = None) -> List[dict]:
+        return await fetch_scored_documents(await self.search(embedding, limit, exclude_ids, filters), excludes)
+
+    async def load(self):
+        pass
+
+    def upsert(self, product_id: str, embedding: Optional[Sequence[float]]):
+        pass
+
+    def set_metadata(self, product_id: str, fields: dict):
+        pass
+
+    def remove(self, product_id: str):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class AtlasVectorSearch(VectorSearchBackend):
+    """
+    Runs $vectorSearch on MongoDB Atlas, the index is maintained by Atlas itself.
+
+    Filters are passed as the filter of $vectorSearch, so they apply before the nearest neighbours are picked. The
+    Atlas index must declare price, rating, domain and in_stock as filter fields.
+
+    Parameters:
+        index (str): The name of the Atlas vector search index.
+        num_candidates (int): The nearest neighbours Atlas considers before returning the top results.
+    """
+
+    name = "atlas"
+
+    def __init__(self, index: str = "vector_index", num_candidates: int = 100):
+        self.index = index
+        self.num_candidates = num_candidates
+
+    def _pipeline(self, embedding: Sequence[float], limit: int, exclude_ids: List[str], project: dict,
+                  filters: Optional[ProductFilters] = None) -> list:
+        vector_search = {
+            "queryVector": [float(value) for value in embedding],
+            "path": "embedding",
+            "numCandidates": max(self.num_candidates, limit + len(exclude_ids)),
+            # Excluded products are dropped after the search, ask for enough to still fill the limit
+            "limit": limit + len(exclude_ids),
+            "index": self.index,
+        }
+        if filters and filters.to_query():
+            vector_search["filter"] = filters.to_query()
+        return [
+            {"$vectorSearch": vector_search},
+            {"$match": {"product_id": {"$nin": exclude_ids}}},
+            {"$limit": limit},
+            {"$project": {"score": {"$meta": "vectorSearchScore"}, **project}},
+        ]
+
+    async def search(self, embedding: Sequence[float], limit: int, exclude_ids: Iterable[str] = (),
+                     filters: Optional[ProductFilters] = None) -> List[Tuple[str, float]]:
+        pipeline = self._pipeline(embedding, limit, list(exclude_ids), {"_id": 0, "product_id": 1}, filters)
+        return [(document["product_id"], document["score"])
+                async for document in Product.get_motor_collection().aggregate(pipeline)]
+
+    async def search_documents(self, embedding: Sequence[float], limit: int, excludes: Iterable[str] = (),
+                               exclude_ids: Iterable[str] = (), filters: Optional[ProductFilters] = None) -> List[dict]:
+        # One round trip, Atlas projects the documents itself
+        pipeline = self._pipeline(embedding, limit, list(exclude_ids), {field: 0 for field in excludes}, filters)
+        return [document async for document in Product.get_motor_collection().aggregate(pipeline)]
+
+
+class LocalVectorIndex(VectorSearchBackend):
+    """
+    Exact in-process search over every product embedding, kept normalized in one contiguous float32 matrix.
+
+    The matrix grows by doubling, and a removed product's row is reused by the next insert. The price, rating,
+    domain and stock of each row are kept in arrays beside it, so filters are a mask applied before the top-k.
+    Products written by other instances are picked up by refreshing from products updated since the last load, and
+    products they deleted are dropped by comparing the indexed ids with the stored ones on each refresh.
+
+    Parameters:
+        refresh_interval (float): Seconds between refreshes from MongoDB, 0 disables them.
+    """
+
+    name = "local"
+
+    def __init__(self, refresh_interval: float = 60):
+        self.refresh_interval = refresh_interval
+        self.matrix: Optional[np.ndarray] = None
+        self.ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free_rows: List[int] = []
+        self.size = 0
+        # Unknown values are NaN or -1, they never pass a filter on their field
+        self.prices = np.zeros(0, dtype=np.float32)
+        self.ratings = np.zeros(0, dtype=np.float32)
+        self.in_stock = np.zeros(0, dtype=np.int8)
+        self.domains = np.zeros(0, dtype=np.int32)
+        self.domain_codes: Dict[str, int] = {}
+        self.loaded_at: Optional[datetime] = None
+        self._refreshed = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.searches = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = decode_embedding(embedding)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        return vector / norm
+
+    def _grow(self, capacity: int, dimensions: int):
+        matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        prices = np.full(capacity, np.nan, dtype=np.float32)
+        ratings = np.full(capacity, np.nan, dtype=np.float32)
+        in_stock = np.full(capacity, -1, dtype=np.int8)
+        domains = np.full(capacity, -1, dtype=np.int32)
+        if self.matrix is not None:
+            matrix[:self.size] = self.matrix[:self.size]
+            prices[:self.size] = self.prices[:self.size]
+            ratings[:self.size] = self.ratings[:self.size]
+            in_stock[:self.size] = self.in_stock[:self.size]
+            domains[:self.size] = self.domains[:self.size]
+        self.matrix, self.prices, self.ratings, self.in_stock, self.domains = matrix, prices, ratings, in_stock, domains
+
+    def _allocate_row(self, dimensions: int) -> int:
+        if self.free_rows:
+            return self.free_rows.pop()
+        if self.matrix is None:
+            self._grow(1024, dimensions)
+        elif self.size == self.matrix.shape[0]:
+            self._grow(self.matrix.shape[0] * 2, dimensions)
+        self.ids.append(None)
+        self.size += 1
+        return self.size - 1
+
+    def upsert(self, product_id: str, embedding: Optional[Sequence[float]]):
+        vector = self._normalize(embedding)
+        if vector is None or (self.matrix is not None and vector.shape[0] != self.matrix.shape[1]):
+            self.remove(product_id)
+            return
+        row = self.rows.get(product_id)
+        if row is None:
+            row = self._allocate_row(vector.shape[0])
+            self.rows[product_id] = row
+            self.ids[row] = product_id
+        self.matrix[row] = vector
+
+    def set_metadata(self, product_id: str, fields: dict):
+        """
+        Stores the filterable fields found in fields for an indexed product, other keys are ignored.
+        """
+        row = self.rows.get(product_id)
+        if row is None:
+            return
+        if "price" in fields:
+            self.prices[row] = np.nan if fields["price"] is None else fields["price"]
+        if "rating" in fields:
+            self.ratings[row] = np.nan if fields["rating"] is None else fields["rating"]
+        if "in_stock" in fields:
+            self.in_stock[row] = -1 if fields["in_stock"] is None else int(fields["in_stock"])
+        if "domain" in fields:
+            domain = fields["domain"]
+            self.domains[row] = -1 if not domain else self.domain_codes.setdefault(domain, len(self.domain_codes))
+
+    def remove(self, product_id: str):
+        row = self.rows.pop(product_id, None)
+        if row is not None:
+            self.ids[row] = None
+            self.matrix[row] = 0
+            self.prices[row] = self.ratings[row] = np.nan
+            self.in_stock[row] = self.domains[row] = -1
+            self.free_rows.append(row)
+
+    def _allowed_rows(self, exclude_ids: Iterable[str], filters: Optional[ProductFilters]) -> np.ndarray:
+        allowed = np.ones(self.size, dtype=bool)
+        allowed[self.free_rows] = False
+        allowed[[self.rows[product_id] for product_id in exclude_ids if product_id in self.rows]] = False
+        if filters is None:
+            return allowed
+        # Comparisons with NaN are False, so products with an unknown price or rating are filtered out
+        if filters.min_price is not None:
+            allowed &= self.prices[:self.size] >= filters.min_price
+        if filters.max_price is not None:
+            allowed &= self.prices[:self.size] <= filters.max_price
+        if filters.min_rating is not None:
+            allowed &= self.ratings[:self.size] >= filters.min_rating
+        if filters.in_stock is not None:
+            allowed &= self.in_stock[:self.size] == int(filters.in_stock)
+        if filters.domain:
+            allowed &= self.domains[:self.size] == self.domain_codes.get(filters.domain, -2)
+        return allowed
+
+    def top_k(self, embedding: Sequence[float], limit: int, exclude_ids: Iterable[str] = (),
+              filters: Optional[ProductFilters] = None) -> List[Tuple[str, float]]:
+        query = self._normalize(embedding)
+        if query is None or self.matrix is None or not self.rows or query.shape[0] != self.matrix.shape[1]:
+            return []
+        allowed = self._allowed_rows(exclude_ids, filters)
+        limit = min(limit, int(allowed.sum()))
+        if limit <= 0:
+            return []
+        similarities = self.matrix[:self.size] @ query
+        similarities[~allowed] = -np.inf
+        best = np.argpartition(-similarities, limit - 1)[:limit]
+        best = best[np.argsort(-similarities[best], kind="stable")]
+        scores = cosine_to_score(similarities[best])
+        return [(self.ids[row], float(score)) for row, score in zip(best, scores)]
+
+    async def search(self, embedding: Sequence[float], limit: int, exclude_ids: Iterable[str] = (),
+                     filters: Optional[ProductFilters] = None) -> List[Tuple[str, float]]:
+        self.searches += 1
+        self._schedule_refresh()
+        return self.top_k(embedding, limit, exclude_ids, filters)
+
+    async def load(self, since: Optional[datetime] = None):
+        """
+        Loads the embeddings of every product, or only of those updated since the given time.
+        """
+        started = time.perf_counter()
+        loaded_at = datetime.now()
+        if since:
+            # Deleted products leave nothing to find by updated_at. Only ids indexed before the listing are
+            # compared, a product inserted meanwhile may be missing from it
+            indexed = set(self.rows)
+            for product_id in indexed - await stored_product_ids():
+                self.remove(product_id)
+        query = {"updated_at": {"$gte": since}} if since else {}
+        projection = {"_id": 0, "product_id": 1, "embedding": 1, **{field: 1 for field in FILTER_FIELDS}}
+        cursor = Product.get_motor_collection().find(query, projection, batch_size=LOAD_BATCH_SIZE)
+        count = 0
+        async for product in cursor:
+            self.upsert(product["product_id"], product.get("embedding"))
+            self.set_metadata(product["product_id"], product)
+            count += 1
+        self.loaded_at = loaded_at
+        self._refreshed = time.monotonic()
+        logger.info(f"Loaded {count} product embeddings into the vector index in {time.perf_counter() - started:.2f}s")
+
+    def _schedule_refresh(self):
+        if not self.refresh_interval or self.loaded_at is None:
+            return
+        if time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refreshed = time.monotonic()
+            self._refresh_task = asyncio.ensure_future(self.load(since=self.loaded_at))
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "vectors": len(self.rows),
+            "capacity": 0 if self.matrix is None else self.matrix.shape[0],
+            "dimensions": 0 if self.matrix is None else self.matrix.shape[1],
+            "searches": self.searches,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class HNSWVectorIndex(LocalVectorIndex):
+    """
+    Approximate search through an hnswlib graph for catalogs too large to scan on every query.
+
+    The normalized matrix is still kept, it is the source the graph is built from and gives exact scores.
+
+    Parameters:
+        refresh_interval (float): Seconds between refreshes from MongoDB, 0 disables them.
+        ef_search (int): Candidates explored per query, higher is slower and more accurate.
+        m (int): Graph links per node.
+        ef_construction (int): Candidates explored while inserting.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, refresh_interval: float = 60, ef_search: int = 100, m: int = 16, ef_construction: int = 200):
+        if not HNSW_AVAILABLE:
+            raise RuntimeError("hnswlib is not installed, use the local vector search backend instead")
+        super().__init__(refresh_interval)
+        self.ef_search = ef_search
+        self.m = m
+        self.ef_construction = ef_construction
+        self.graph = None
+
+    def _ensure_graph(self, dimensions: int):
+        if self.graph is None:
+            self.graph = hnswlib.Index(space="ip", dim=dimensions)
+            self.graph.init_index(max_elements=1024, M=self.m, ef_construction=self.ef_construction)
+        if self.graph.get_max_elements() < self.size:
+            self.graph.resize_index(max(self.size, self.graph.get_max_elements() * 2))
+
+    def upsert(self, product_id: str, embedding: Optional[Sequence[float]]):
+        super().upsert(product_id, embedding)
+        row = self.rows.get(product_id)
+        if row is None:
+            return
+        self._ensure_graph(self.matrix.shape[1])
+        # Graph labels are matrix rows, adding a reused row updates and undeletes its node
+        self.graph.add_items(self.matrix[row:row + 1], np.array([row]))
+
+    def remove(self, product_id: str):
+        row = self.rows.get(product_id)
+        super().remove(product_id)
+        if row is not None and self.graph is not None:
+            self.graph.mark_deleted(row)
+
+    def top_k(self, embedding: Sequence[float], limit: int, exclude_ids: Iterable[str] = (),
+              filters: Optional[ProductFilters] = None) -> List[Tuple[str, float]]:
+        query = self._normalize(embedding)
+        if query is None or self.graph is None or not self.rows or query.shape[0] != self.matrix.shape[1]:
+            return []
+        allowed = self._allowed_rows(exclude_ids, filters)
+        count = int(allowed.sum())
+        # A selective filter leaves few rows, scanning them exactly is cheaper than walking the graph around the
+        # ones it rejects
+        if count <= self.ef_search * 10:
+            return super().top_k(embedding, limit, exclude_ids, filters)
+        limit = min(limit, count)
+        self.graph.set_ef(max(self.ef_search, limit))
+        labels, _ = self.graph.knn_query(query, k=limit, filter=lambda row: allowed[row])
+        rows = labels[0]
+        similarities = self.matrix[rows] @ query
+        order = np.argsort(-similarities, kind="stable")
+        scores = cosine_to_score(similarities[order])
+        return [(self.ids[rows[i]], float(score)) for i, score in zip(order, scores)]
+
+
+def build_vector_search(backend: str) -> VectorSearchBackend:
+    if backend == "local":
+        return LocalVectorIndex(refresh_interval=settings.VECTOR_INDEX_REFRESH_INTERVAL)
+    if backend == "hnsw":
+        if HNSW_AVAILABLE:
+            return HNSWVectorIndex(refresh_interval=settings.VECTOR_INDEX_REFRESH_INTERVAL,
+                                   ef_search=settings.VECTOR_SEARCH_CANDIDATES)
+        logger.warning("hnswlib is not installed, falling back to the exact local vector index")
+        return LocalVectorIndex(refresh_interval=settings.VECTOR_INDEX_REFRESH_INTERVAL)
+    if settings.EMBEDDING_STORAGE != ARRAY:
+        logger.warning(f"Atlas $vectorSearch does not index {settings.EMBEDDING_STORAGE} embeddings, "
+                       "set VECTOR_SEARCH_BACKEND to local or hnsw")
+    return AtlasVectorSearch(index=settings.VECTOR_SEARCH_INDEX, num_candidates=settings.VECTOR_SEARCH_CANDIDATES)
+
+
+vector_search = build_vector_search(settings.VECTOR_SEARCH_BACKEND)
@@ -0,0 +1,136 @@
+import struct
+from typing import Any, Iterator, List, Optional, Union
+
+import numpy as np
+from bson.binary import USER_DEFINED_SUBTYPE, Binary
+
+# Storage formats of Product.embedding. Atlas $vectorSearch only indexes arrays, the packed formats need an
+# in-process vector search backend
+ARRAY = "array"
+FLOAT32 = "float32"
+INT8 = "int8"
+STORAGE_FORMATS = (ARRAY, FLOAT32, INT8)
+
+# The first byte of a packed embedding names its format, int8 embeddings follow it with their float32 scale
+_FLOAT32_CODE = b"f"
+_INT8_CODE = b"q"
+_SCALE = struct.Struct("<f")
+
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Returns the embedding as a float32 array, whatever form it was stored or passed in.
+
+    Packed float32 embeddings are decoded without copying, the array is a read-only view of the bytes.
+    """
+    if value is None:
+        return np.zeros(0, dtype=np.float32)
+    if isinstance(value, Embedding):
+        return value.array
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = memoryview(value)
+        code = bytes(data[:1])
+        if code == _FLOAT32_CODE:
+            return np.frombuffer(data, dtype="<f4", offset=1)
+        if code == _INT8_CODE:
+            (scale,) = _SCALE.unpack_from(data, 1)
+            return np.frombuffer(data, dtype=np.int8, offset=1 + _SCALE.size).astype(np.float32) * scale
+        raise ValueError("Unknown packed embedding format")
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_embedding(value, storage: str = ARRAY) -> Union[List[float], Binary]:
+    """
+    Returns the embedding in the form it is stored in MongoDB.
+
+    Parameters:
+        value: The embedding, a list, a NumPy array, an Embedding or packed bytes.
+        storage (str): array keeps a BSON array of doubles, float32 packs 4 bytes per dimension into binData and
+            int8 quantizes to 1 byte per dimension plus a scale.
+    """
+    raw = value.raw if isinstance(value, Embedding) else value
+    if raw is None:
+        return []
+    if storage == ARRAY:
+        if isinstance(raw, list):
+            return raw
+        return decode_embedding(raw).astype(np.float64).tolist()
+    # Already packed in the requested format, re-encoding int8 would quantize twice
+    if isinstance(raw, bytes) and raw[:1] == (_FLOAT32_CODE if storage == FLOAT32 else _INT8_CODE):
+        return Binary(raw, USER_DEFINED_SUBTYPE)
+    vector = decode_embedding(raw)
+    if vector.size == 0:
+        return []
+    if storage == FLOAT32:
+        return Binary(_FLOAT32_CODE + vector.astype("<f4").tobytes(), USER_DEFINED_SUBTYPE)
+    if storage == INT8:
+        peak = float(np.abs(vector).max())
+        scale = peak / 127 if peak else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return Binary(_INT8_CODE + _SCALE.pack(scale) + quantized.tobytes(), USER_DEFINED_SUBTYPE)
+    raise ValueError(f"Unknown embedding storage {storage}, expected one of {', '.join(STORAGE_FORMATS)}")
+
+
+class Embedding:
+    """
+    Field type of an embedding that is only decoded when it is used.
+
+    A document read from MongoDB keeps the embedding as stored, a list or packed bytes, and the float32 array is
+    built on first access. Loading a product to show or update it therefore never pays for its vector.
+    """
+
+    __slots__ = ("raw", "_array")
+
+    def __init__(self, raw: Any):
+        self.raw = bytes(raw) if isinstance(raw, (bytearray, memoryview)) else raw
+        self._array: Optional[np.ndarray] = None
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = decode_embedding(self.raw)
+        return self._array
+
+    def tolist(self) -> List[float]:
+        if isinstance(self.raw, list):
+            return self.raw
+        return self.array.astype(np.float64).tolist()
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __len__(self) -> int:
+        if isinstance(self.raw, bytes):
+            header = 1 if self.raw[:1] == _FLOAT32_CODE else 1 + _SCALE.size
+            itemsize = 4 if self.raw[:1] == _FLOAT32_CODE else 1
+            return (len(self.raw) - header) // itemsize
+        return len(self.raw)
+
+    def __iter__(self) -> Iterator[float]:
+        return iter(self.tolist())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Embedding):
+            other = other.raw
+        return self.raw == other
+
+    def __repr__(self) -> str:
+        return f"Embedding({len(self)} dimensions)"
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value) -> "Embedding":
+        if isinstance(value, Embedding):
+            return value
+        if isinstance(value, np.ndarray):
+            return cls(value.astype(np.float64).tolist())
+        if isinstance(value, (list, tuple, bytes, bytearray, memoryview)):
+            return cls(list(value) if isinstance(value, tuple) else value)
+        raise TypeError("embedding must be a list of numbers or a packed embedding")
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type="array", items={"type": "number"})
@@ -0,0 +1,82 @@
+from typing import AsyncIterator, List, Optional, Tuple, Type, TypeVar
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# Response header holding the `after` value of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Documents fetched per round trip while streaming
+STREAM_BATCH_SIZE = 500
+
+Item = TypeVar("Item", bound=BaseModel)
+
+
+def parse_cursor(after: Optional[str]) -> Optional[ObjectId]:
+    if not after:
+        return None
+    try:
+        return ObjectId(after)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def after_cursor(query: dict, after: Optional[str]) -> dict:
+    cursor = parse_cursor(after)
+    if cursor is None:
+        return query
+    return {**query, "_id": {"$gt": cursor}}
+
+
+def projection_for(view: Type[BaseModel]) -> dict:
+    fields = {field.alias: 1 for field in view.__fields__.values()}
+    fields["_id"] = 1
+    return fields
+
+
+async def find_page(collection, query: dict, view: Type[Item], limit: int = DEFAULT_PAGE_SIZE,
+                    after: Optional[str] = None) -> Tuple[List[Item], Optional[str]]:
+    """
+    Returns up to limit documents after the given cursor, in _id order, and the cursor of the next page.
+
+    Keyset pagination walks the _id index, so every page costs the same however deep into the collection it is.
+
+    Parameters:
+        collection: The motor collection to read.
+        query (dict): The filter of the listing.
+        view (Type[BaseModel]): The model each document is parsed into, only its fields are fetched.
+        limit (int): The page size.
+        after (str): The cursor returned with the previous page.
+    """
+    cursor = collection.find(after_cursor(query, after), projection_for(view)).sort("_id", 1).limit(limit)
+    documents = await cursor.to_list(length=limit)
+    next_cursor = str(documents[-1]["_id"]) if len(documents) == limit else None
+    return [view.parse_obj(document) for document in documents], next_cursor
+
+
+async def stream_documents(collection, query: dict, view: Type[Item], after: Optional[str] = None,
+                           batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[Item]:
+    cursor = collection.find(after_cursor(query, after), projection_for(view), batch_size=batch_size).sort("_id", 1)
+    async for document in cursor:
+        yield view.parse_obj(document)
+
+
+async def _ndjson_lines(items: AsyncIterator[BaseModel]) -> AsyncIterator[str]:
+    async for item in items:
+        yield item.json() + "\n"
+
+
+def ndjson_response(items: AsyncIterator[BaseModel]) -> StreamingResponse:
+    """
+    Streams the items as newline delimited JSON, one document per line, holding one cursor batch in memory.
+    """
+    return StreamingResponse(_ndjson_lines(items), media_type="application/x-ndjson")
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from app.core.logger import logger
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    Parameters:
+        name (str): Used in logs and stats.
+        fn (Callable): Processes one item, or a list of up to batch_size items, and returns what is passed on.
+            Returning None drops the item.
+        workers (int): How many items the stage works on at once.
+        provider (Callable): Maps an item to the provider it calls, the pipeline's limit for that provider applies.
+        batch_size (int): When above 1, fn receives lists of the items that are waiting, up to this many.
+        max_wait (float): How long a batch waits for more items after its first one, in seconds. Items produced
+            one at a time by an earlier stage only fill a batch if it lingers.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Awaitable[Any]], workers: int = 1,
+                 provider: Optional[Callable[[Any], str]] = None, batch_size: int = 1, max_wait: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.provider = provider
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "failed": self.failed, "busy_seconds": round(self.busy_seconds, 3)}
+
+
+class Pipeline:
+    """
+    Streams items through a chain of stages, each with its own pool of workers connected by bounded queues.
+
+    An item moves on as soon as its stage is done with it, so a slow item only holds up its own worker instead of
+    a whole batch. Calls to the same provider share a concurrency limit across stages.
+
+    Parameters:
+        stages (List[Stage]): The stages, in order.
+        limits (Dict[str, int]): The maximum concurrent calls per provider.
+        queue_size (int): How many items may wait in front of each stage.
+        on_error (Callable): Called with the item and the exception when a stage fails on an item.
+    """
+
+    def __init__(self, stages: List[Stage], limits: Optional[Dict[str, int]] = None, queue_size: int = 100,
+                 on_error: Optional[Callable[[Any, Exception], Awaitable[None]]] = None):
+        self.stages = stages
+        self.limits = limits or {}
+        self.queue_size = queue_size
+        self.on_error = on_error
+
+    async def run(self, items: Iterable) -> List[Any]:
+        """
+        Returns the outputs of the last stage, in completion order.
+        """
+        semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in self.limits.items()}
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        workers = []
+        for index, stage in enumerate(self.stages):
+            output = queues[index + 1] if index + 1 < len(self.stages) else None
+            stage_workers = [
+                asyncio.ensure_future(self._work(stage, queues[index], output, results, semaphores))
+                for _ in range(stage.workers)
+            ]
+            workers.append(stage_workers)
+        started = time.perf_counter()
+        try:
+            for item in items:
+                await queues[0].put(item)
+            for index, stage_workers in enumerate(workers):
+                for _ in stage_workers:
+                    await queues[index].put(_DONE)
+                await asyncio.gather(*stage_workers)
+        except BaseException:
+            for stage_workers in workers:
+                for worker in stage_workers:
+                    worker.cancel()
+            raise
+        logger.info(f"Pipeline finished {len(results)} items in {time.perf_counter() - started:.2f}s "
+                    f"{self.stats()}")
+        return results
+
+    async def _work(self, stage: Stage, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], results: list,
+                    semaphores: Dict[str, asyncio.Semaphore]):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            if stage.batch_size > 1:
+                await self._fill(stage, inbox, batch)
+            payload = batch if stage.batch_size > 1 else batch[0]
+            output = await self._call(stage, payload, semaphores)
+            if output is None:
+                continue
+            if outbox is None:
+                results.extend(output if stage.batch_size > 1 else [output])
+            elif stage.batch_size > 1:
+                for item in output:
+                    await outbox.put(item)
+            else:
+                await outbox.put(output)
+
+    @staticmethod
+    async def _fill(stage: Stage, inbox: asyncio.Queue, batch: list):
+        # Takes the waiting items, then keeps waiting for more until the batch is full or max_wait has passed
+        deadline = time.monotonic() + stage.max_wait
+        while len(batch) < stage.batch_size:
+            if not inbox.empty():
+                item = inbox.get_nowait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    item = await asyncio.wait_for(inbox.get(), remaining)
+                except asyncio.TimeoutError:
+                    return
+            if item is _DONE:
+                # Leave the end marker for the next worker of this stage, then finish this batch
+                inbox.put_nowait(item)
+                return
+            batch.append(item)
+
+    async def _call(self, stage: Stage, payload, semaphores: Dict[str, asyncio.Semaphore]):
+        provider = stage.provider(payload) if stage.provider else None
+        semaphore = semaphores.get(provider)
+        started = time.perf_counter()
+        try:
+            if semaphore is None:
+                output = await stage.fn(payload)
+            else:
+                async with semaphore:
+                    output = await stage.fn(payload)
+            stage.processed += 1
+            return output
+        except Exception as e:
+            stage.failed += 1
+            logger.error(f"Pipeline stage {stage.name} failed: {e}")
+            if self.on_error is not None:
+                await self.on_error(payload, e)
+            return None
+        finally:
+            stage.busy_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
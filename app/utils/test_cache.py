@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.utils.cache import TTLCache, SingleFlight
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=-1)
+    cache.set("b", 2, ttl=0.01)
+    assert "a" not in cache
+    asyncio.run(asyncio.sleep(0.02))
+    assert cache.get("b") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "user"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", load) for _ in range(10)))
+
+    assert asyncio.run(run()) == ["user"] * 10
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        asyncio.run(flight.do("key", fail))
@@ -0,0 +1,48 @@
+from typing import Optional
+
+import bson
+import numpy as np
+from pydantic import BaseModel
+
+from app.utils.embedding import ARRAY, FLOAT32, INT8, Embedding, decode_embedding, encode_embedding
+
+
+class Item(BaseModel):
+    embedding: Optional[Embedding] = []
+
+    class Config:
+        json_encoders = {Embedding: Embedding.tolist}
+
+
+def make_embedding(dimensions=1536, seed=0):
+    return np.random.default_rng(seed).normal(scale=0.03, size=dimensions).tolist()
+
+
+def test_packed_embeddings_round_trip_and_shrink():
+    values = make_embedding()
+    array = bson.encode({"embedding": encode_embedding(values, ARRAY)})
+    float32 = encode_embedding(values, FLOAT32)
+    int8 = encode_embedding(values, INT8)
+
+    assert np.array_equal(decode_embedding(float32), np.asarray(values, dtype=np.float32))
+    assert np.allclose(decode_embedding(int8), values, atol=np.abs(values).max() / 127)
+    assert len(bson.encode({"embedding": float32})) * 3 < len(array)
+    assert len(bson.encode({"embedding": int8})) * 12 < len(array)
+
+    # Packing an embedding that already is in the target format keeps its bytes
+    assert encode_embedding(Embedding(int8), INT8) == int8
+    assert encode_embedding(float32, ARRAY) == np.asarray(values, dtype=np.float32).astype(float).tolist()
+    assert encode_embedding([], FLOAT32) == []
+
+
+def test_embedding_field_decodes_lazily():
+    values = make_embedding(8)
+    stored = bson.decode(bson.encode({"embedding": encode_embedding(values, FLOAT32)}))
+    item = Item.parse_obj(stored)
+
+    assert item.embedding._array is None
+    assert len(item.embedding) == 8
+    assert item.embedding._array is None
+    assert np.allclose(np.asarray(item.embedding), values)
+    assert np.allclose(Item.parse_raw(item.json()).embedding.tolist(), values)
+    assert Item(embedding=values).embedding.raw == values
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.schemas.user_schema import UserOut
+from app.utils.pagination import after_cursor, ndjson_response, parse_cursor, projection_for
+
+
+def test_cursor_filters_on_id():
+    cursor = ObjectId()
+    assert after_cursor({"status": "done"}, None) == {"status": "done"}
+    assert after_cursor({"status": "done"}, str(cursor)) == {"status": "done", "_id": {"$gt": cursor}}
+    with pytest.raises(HTTPException) as error:
+        parse_cursor("not-a-cursor")
+    assert error.value.status_code == 400
+    assert projection_for(UserOut)["_id"] == 1 and "email" in projection_for(UserOut)
+
+
+def test_ndjson_response_writes_one_document_per_line():
+    async def users():
+        for i in range(3):
+            yield UserOut(user_id=f"auth0|{i}", email=f"{i}@example.com", username=f"user{i}")
+
+    async def body():
+        response = ndjson_response(users())
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    lines = asyncio.run(body()).splitlines()
+    assert len(lines) == 3
+    assert UserOut.parse_raw(lines[2]).user_id == "auth0|2"
@@ -0,0 +1,65 @@
+import asyncio
+
+from app.utils.pipeline import Pipeline, Stage
+
+
+def test_pipeline_respects_provider_limits_and_batches_the_last_stage():
+    running = {"slow": 0}
+    peak = {"slow": 0}
+    failed = []
+    batches = []
+
+    async def call_provider(item):
+        running["slow"] += 1
+        peak["slow"] = max(peak["slow"], running["slow"])
+        await asyncio.sleep(0.001)
+        running["slow"] -= 1
+        if item == 3:
+            raise ValueError("bad input")
+        return item * 10
+
+    async def persist(items):
+        batches.append(len(items))
+        return items
+
+    async def on_error(item, error):
+        failed.append(item)
+
+    pipeline = Pipeline(
+        [
+            Stage("call", call_provider, workers=8, provider=lambda item: "slow"),
+            Stage("persist", persist, batch_size=4),
+        ],
+        limits={"slow": 2},
+        on_error=on_error,
+    )
+    results = asyncio.run(pipeline.run(range(10)))
+
+    assert sorted(results) == [i * 10 for i in range(10) if i != 3]
+    assert failed == [3]
+    assert peak["slow"] == 2
+    assert sum(batches) == 9 and max(batches) <= 4
+    assert pipeline.stats()["call"]["processed"] == 9 and pipeline.stats()["call"]["failed"] == 1
+
+
+def test_batch_stage_waits_for_staggered_items():
+    writes = []
+
+    async def call_provider(item):
+        # Jittered latencies, items reach the next stage one at a time
+        await asyncio.sleep(0.001 + (item * 7 % 10) / 1000)
+        return item
+
+    async def persist(items):
+        writes.append(len(items))
+        return items
+
+    pipeline = Pipeline([
+        Stage("call", call_provider, workers=8),
+        Stage("persist", persist, batch_size=50, max_wait=0.2),
+    ])
+    results = asyncio.run(pipeline.run(range(100)))
+
+    assert sorted(results) == list(range(100))
+    assert len(writes) <= 3
+    assert sum(writes) == 100
@@ -0,0 +1,115 @@
+"""
+Requests/sec through the auth middleware on the /api/v1/products routes.
+
+Token verification and the user lookup are stubbed out, so the numbers only measure the middleware itself.
+Compares the old BaseHTTPMiddleware implementation against the pure ASGI one.
+
+    python -m benchmarks.bench_auth_middleware
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from app.core import middlewares
+from app.core.middlewares import AuthMiddleware
+
+ALLOW_ROUTES = ["/users", "/api/v1/docs", "/api/v1/openapi.json", "/robots.txt", "/api/v1/scrapy/update", "/test"]
+PRODUCTS = [{"product_id": f"B0{i:08d}", "title": f"Product {i}", "price": 9.99, "rating": 4.5} for i in range(50)]
+
+
+class StubUser:
+    user_id = "auth0|bench"
+
+
+async def verify_token(token):
+    return {"email": "bench@example.com"}
+
+
+async def get_current_user(auth_result, token):
+    return StubUser()
+
+
+class BaseHTTPAuthMiddleware(BaseHTTPMiddleware):
+    """The AuthMiddleware as it was before the pure ASGI rewrite"""
+
+    def __init__(self, app, allow_routes=None):
+        super().__init__(app)
+        self.allow_routes = allow_routes or []
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path not in self.allow_routes:
+            if request.method == "OPTIONS":
+                return await call_next(request)
+            authorization: str = request.headers.get("Authorization")
+            if not authorization:
+                if 'ws' in request.url.path or 'wss' in request.url.path:
+                    token = request.query_params.get('token')
+                    if not token:
+                        return JSONResponse(content={"detail": "Authorization token is missing"}, status_code=401)
+                    authorization = f'Bearer {token}'
+                else:
+                    return JSONResponse(content={"detail": "Authorization header is missing"}, status_code=401)
+            token_parts = authorization.split("Bearer ")
+            if len(token_parts) != 2:
+                return JSONResponse(
+                    content={"detail": "Authorization header must be in the 'Bearer <token>' format"},
+                    status_code=401)
+            auth_result = await verify_token(token_parts[1])
+            request.state.user = await get_current_user(auth_result, token_parts[1])
+        return await call_next(request)
+
+
+def build_app(middleware, **options):
+    app = FastAPI()
+
+    @app.get("/api/v1/products/")
+    async def get_products(request: Request):
+        assert request.state.user.user_id
+        return PRODUCTS
+
+    @app.get("/api/v1/products/{product_id}")
+    async def get_product(request: Request, product_id: str):
+        assert request.state.user.user_id
+        return PRODUCTS[0]
+
+    app.add_middleware(middleware, **options)
+    return app
+
+
+async def run(app, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": "Bearer bench-token"}
+    paths = ["/api/v1/products/", "/api/v1/products/B000000001"]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(count):
+            for i in range(count):
+                response = await client.get(paths[i % len(paths)], headers=headers)
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+async def main(requests: int = 5000, concurrency: int = 20):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    middlewares.auth.verify_token = verify_token
+    middlewares.get_current_user = get_current_user
+    apps = {
+        "BaseHTTPMiddleware": build_app(BaseHTTPAuthMiddleware, allow_routes=ALLOW_ROUTES),
+        "pure ASGI": build_app(AuthMiddleware, allow_routes=ALLOW_ROUTES),
+    }
+    for name, app in apps.items():
+        # Warm up once so route compilation is not part of the measurement
+        await run(app, 200, concurrency)
+        rps = await run(app, requests, concurrency)
+        print(f"{name:>20}: {rps:8.0f} req/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
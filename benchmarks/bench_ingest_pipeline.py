@@ -0,0 +1,100 @@
+"""
+End-to-end time to ingest one scraper job, batches of two versus the staged pipeline.
+
+The LLM, embedding and database calls are replaced by fakes that sleep for a randomized latency, so the numbers
+only show how the work is scheduled. Latencies are multiplied by --scale to keep the run short.
+
+    python -m benchmarks.bench_ingest_pipeline [--products 20] [--scale 0.1]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from app.utils.pipeline import Pipeline, Stage
+
+# Seconds per call before scaling, (median, spread) of a lognormal
+LATENCIES = {
+    "gemini": (1.0, 0.5),
+    "gpt": (1.5, 0.6),
+    "embedding": (0.15, 0.3),
+    "database": (0.01, 0.2),
+}
+
+
+class FakeProviders:
+    def __init__(self, scale: float, seed: int = 0):
+        self.scale = scale
+        self.rng = random.Random(seed)
+
+    async def call(self, provider: str):
+        median, spread = LATENCIES[provider]
+        await asyncio.sleep(self.rng.lognormvariate(0, spread) * median * self.scale)
+
+
+def make_items(count: int) -> list:
+    return [{"product_id": f"B0{i:08d}", "llm_model": "gemini" if i % 2 == 0 else "gpt"} for i in range(count)]
+
+
+async def batched(items: list, providers: FakeProviders):
+    # The ingestion before the pipeline: one product per task, two tasks at a time, then one bulk write
+    async def process(item):
+        await providers.call(item["llm_model"])
+        await providers.call("embedding")
+
+    await providers.call("database")
+    for i in range(0, len(items), 2):
+        await asyncio.gather(*(process(item) for item in items[i:i + 2]))
+    await providers.call("database")
+
+
+async def pipelined(items: list, providers: FakeProviders, llm_limit: int, embedding_limit: int):
+    async def store(batch):
+        await providers.call("database")
+        return batch
+
+    async def generate_embedding_text(item):
+        await providers.call(item["llm_model"])
+        return item
+
+    async def embed(item):
+        await providers.call("embedding")
+        return item
+
+    pipeline = Pipeline(
+        [
+            Stage("store", store, batch_size=50),
+            Stage("embedding_text", generate_embedding_text, workers=2 * llm_limit,
+                  provider=lambda item: item["llm_model"]),
+            Stage("embed", embed, workers=embedding_limit, provider=lambda item: "embedding"),
+            Stage("persist", store, batch_size=50),
+        ],
+        limits={"gemini": llm_limit, "gpt": llm_limit, "embedding": embedding_limit},
+    )
+    await pipeline.run(items)
+
+
+async def main(count: int, scale: float, llm_limit: int, embedding_limit: int):
+    items = make_items(count)
+    started = time.perf_counter()
+    await batched(items, FakeProviders(scale))
+    batched_seconds = (time.perf_counter() - started) / scale
+    started = time.perf_counter()
+    await pipelined(make_items(count), FakeProviders(scale), llm_limit, embedding_limit)
+    pipelined_seconds = (time.perf_counter() - started) / scale
+    print(f"{count} products, latencies scaled back to real time")
+    print(f"batches of 2       {batched_seconds:>7.2f} s")
+    print(f"pipeline (llm={llm_limit}, embedding={embedding_limit}) {pipelined_seconds:>7.2f} s "
+          f"({batched_seconds / pipelined_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    logging.getLogger("app.core.logger").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--scale", type=float, default=0.1)
+    parser.add_argument("--llm-limit", type=int, default=4)
+    parser.add_argument("--embedding-limit", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.products, args.scale, args.llm_limit, args.embedding_limit))
@@ -0,0 +1,79 @@
+"""
+Latency and peak memory of listing products as full documents versus the projection views.
+
+Seeds a throwaway database with 50k products carrying 1536-float embeddings, reviews and Q&A, then lists them
+through ProductService.get_products with each view. Needs a MongoDB server, BENCH_MONGODB_URL defaults to a local one.
+
+    python -m benchmarks.bench_product_projection [--products 50000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import tracemalloc
+
+from beanie import init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.models.product_model import Product
+from app.schemas.product_schema import ProductCard, ProductForUser, ProductOut
+from app.services.product_service import ProductService
+
+DATABASE = "bench_product_projection"
+
+
+def make_product(i: int) -> dict:
+    rng = random.Random(i)
+    return Product(
+        product_id=f"B0{i:08d}",
+        job_id="bench",
+        domain="amazon.com",
+        title=f"Product {i} wireless noise cancelling headphones",
+        description="Over-ear headphones with 30 hours of battery life. " * 5,
+        price=round(rng.uniform(10, 500), 2),
+        image_url=f"https://example.com/{i}.jpg",
+        specs={"Brand": "Bench", "Color": "Black", "Weight": "250 g"},
+        features=["Active noise cancelling", "Bluetooth 5.3", "USB-C charging"],
+        reviews=[{"rating": 5, "text": "Great sound and comfortable for long flights. " * 4}] * 8,
+        rating=round(rng.uniform(1, 5), 1),
+        embedding=[rng.random() for _ in range(1536)],
+        embedding_text="wireless noise cancelling headphones " * 10,
+        qa=[{"question": "Does it fold?", "answer": "Yes, it folds flat."}] * 5,
+    ).dict(exclude={"id", "revision_id"})
+
+
+async def seed(collection, count: int):
+    if await collection.estimated_document_count() >= count:
+        return
+    await collection.delete_many({})
+    batch = 1000
+    for start in range(0, count, batch):
+        await collection.insert_many([make_product(i) for i in range(start, min(start + batch, count))])
+
+
+async def measure(label: str, view):
+    tracemalloc.start()
+    started = time.perf_counter()
+    products = await ProductService.get_products(view)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<16} {len(products):>7} products {elapsed:>8.2f} s {peak / 2 ** 20:>10.1f} MiB peak")
+
+
+async def main(count: int):
+    client = AsyncIOMotorClient(os.environ.get("BENCH_MONGODB_URL", "mongodb://localhost:27017"))
+    await init_beanie(database=client[DATABASE], document_models=[Product])
+    await seed(Product.get_motor_collection(), count)
+    await measure("full documents", None)
+    await measure("ProductOut", ProductOut)
+    await measure("ProductForUser", ProductForUser)
+    await measure("ProductCard", ProductCard)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(main(args.products))
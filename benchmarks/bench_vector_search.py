@@ -0,0 +1,74 @@
+"""
+Build time, query latency and recall of the in-process vector search backends.
+
+Random normalized vectors are loaded into LocalVectorIndex (exact) and, when hnswlib is installed, HNSWVectorIndex.
+Recall is measured against LocalVectorIndex, which is itself parity-tested against a brute-force reference. At the
+embedding size of 1536 the matrix takes 6 KiB per product, 6 GiB for 1M products, use --dimensions to fit the machine.
+
+    python -m benchmarks.bench_vector_search [--sizes 10000,100000,1000000] [--dimensions 1536] [--queries 200]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from app.services.vector_search import HNSW_AVAILABLE, HNSWVectorIndex, LocalVectorIndex
+
+LIMIT = 7
+
+
+def build(index: LocalVectorIndex, vectors: np.ndarray) -> float:
+    started = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.upsert(f"B0{i:08d}", vector)
+    return time.perf_counter() - started
+
+
+def query(index: LocalVectorIndex, queries: np.ndarray, exclude_ids: list) -> tuple:
+    latencies = []
+    results = []
+    for vector in queries:
+        started = time.perf_counter()
+        results.append([product_id for product_id, _ in index.top_k(vector, LIMIT, exclude_ids)])
+        latencies.append(time.perf_counter() - started)
+    return np.array(latencies) * 1000, results
+
+
+def report(label: str, size: int, build_seconds: float, latencies: np.ndarray, recall: float):
+    print(f"{label:<6} {size:>9} vectors  build {build_seconds:>8.2f} s  "
+          f"p50 {np.percentile(latencies, 50):>8.2f} ms  p95 {np.percentile(latencies, 95):>8.2f} ms  "
+          f"recall@{LIMIT} {recall:.3f}")
+
+
+def main(sizes: list, dimensions: int, queries: int):
+    rng = np.random.default_rng(0)
+    query_vectors = rng.standard_normal((queries, dimensions), dtype=np.float32)
+    exclude_ids = ["B000000000", "B000000001"]
+    for size in sizes:
+        vectors = rng.standard_normal((size, dimensions), dtype=np.float32)
+        exact = LocalVectorIndex(refresh_interval=0)
+        build_seconds = build(exact, vectors)
+        latencies, expected = query(exact, query_vectors, exclude_ids)
+        report("exact", size, build_seconds, latencies, 1.0)
+        del exact
+        if HNSW_AVAILABLE:
+            approximate = HNSWVectorIndex(refresh_interval=0)
+            build_seconds = build(approximate, vectors)
+            latencies, results = query(approximate, query_vectors, exclude_ids)
+            found = sum(len(set(a) & set(b)) for a, b in zip(expected, results))
+            report("hnsw", size, build_seconds, latencies, found / (LIMIT * queries))
+            del approximate
+        del vectors
+    if not HNSW_AVAILABLE:
+        print("hnswlib is not installed, only the exact index was measured")
+
+
+if __name__ == "__main__":
+    logging.getLogger("app.core.logger").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(",")], args.dimensions, args.queries)
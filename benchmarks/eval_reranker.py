@@ -0,0 +1,99 @@
+"""
+Offline evaluation of the local relevance scorer against recorded LLM validations.
+
+Each record holds a query, its search candidates and the ids the LLM kept. Records are written by the app while
+RERANK_RECORD_PATH is set, benchmarks/data/reranker_queries.jsonl holds a small hand-labelled sample. Every
+combination of thresholds is scored as if the LLM answered exactly as recorded for the products left uncertain, and
+the combinations that call the LLM least while staying accurate are listed.
+
+    python -m benchmarks.eval_reranker [--records benchmarks/data/reranker_queries.jsonl] [--min-precision 0.95]
+"""
+import argparse
+import itertools
+import json
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.reranker import IRRELEVANT, RELEVANT, UNCERTAIN, RelevanceScorer, extract_constraints
+
+
+def load_records(path: str) -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def evaluate(scorer: RelevanceScorer, records: list) -> dict:
+    """
+    Counts the local decisions against the labels. Uncertain products go to the LLM, whose recorded answer is
+    taken as right.
+    """
+    accepted = wrongly_accepted = rejected = wrongly_rejected = uncertain = llm_calls = candidates = 0
+    for record in records:
+        constraints = extract_constraints(record["query"])
+        relevant = set(record["relevant"])
+        verdicts = [scorer.judge_one(constraints, candidate) for candidate in record["candidates"]]
+        for candidate, judgement in zip(record["candidates"], verdicts):
+            candidates += 1
+            is_relevant = candidate["product_id"] in relevant
+            if judgement.verdict == RELEVANT:
+                accepted += 1
+                wrongly_accepted += not is_relevant
+            elif judgement.verdict == IRRELEVANT:
+                rejected += 1
+                wrongly_rejected += is_relevant
+            else:
+                uncertain += 1
+        llm_calls += any(judgement.verdict == UNCERTAIN for judgement in verdicts)
+    errors = wrongly_accepted + wrongly_rejected
+    return {
+        "llm_call_rate": llm_calls / len(records),
+        "uncertain_rate": uncertain / candidates,
+        "precision": (accepted - wrongly_accepted) / accepted if accepted else 1.0,
+        "missed": wrongly_rejected,
+        "accuracy": (candidates - errors) / candidates,
+    }
+
+
+def report(label: str, scorer: RelevanceScorer, metrics: dict):
+    print(f"{label:<10} accept {scorer.accept:.2f} reject {scorer.reject:.2f} "
+          f"floor {scorer.vector_floor:.3f} ceiling {scorer.vector_ceiling:.3f}  "
+          f"llm calls {metrics['llm_call_rate']:>6.1%}  uncertain {metrics['uncertain_rate']:>6.1%}  "
+          f"precision {metrics['precision']:>6.1%}  missed {metrics['missed']:>3}  accuracy {metrics['accuracy']:>6.1%}")
+
+
+def main(path: str, min_precision: float, max_missed: int, top: int):
+    records = load_records(path)
+    print(f"{len(records)} recorded queries, {sum(len(record['candidates']) for record in records)} candidates")
+    current = RelevanceScorer(settings.RERANK_ACCEPT, settings.RERANK_REJECT, settings.RERANK_VECTOR_FLOOR,
+                              settings.RERANK_VECTOR_CEILING)
+    report("current", current, evaluate(current, records))
+
+    results = []
+    for floor, width, accept, reject in itertools.product(
+        np.arange(0.84, 0.91, 0.01), (0.04, 0.06, 0.08), np.arange(0.4, 0.95, 0.05), np.arange(0.05, 0.6, 0.05)
+    ):
+        if reject >= accept:
+            continue
+        scorer = RelevanceScorer(accept, reject, floor, floor + width)
+        metrics = evaluate(scorer, records)
+        if metrics["precision"] >= min_precision and metrics["missed"] <= max_missed:
+            results.append((metrics["llm_call_rate"], -metrics["accuracy"], scorer, metrics))
+    results.sort(key=lambda result: result[:2])
+    if not results:
+        print("No thresholds reach the required precision, lower --min-precision or record more queries")
+    for rank, (_, _, scorer, metrics) in enumerate(results[:top], start=1):
+        report(f"#{rank}", scorer, metrics)
+
+
+if __name__ == "__main__":
+    logging.getLogger("app.core.logger").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", default="benchmarks/data/reranker_queries.jsonl")
+    parser.add_argument("--min-precision", type=float, default=0.95,
+                        help="Share of the locally accepted products that must be relevant")
+    parser.add_argument("--max-missed", type=int, default=0, help="Relevant products the scorer may drop")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+    main(args.records, args.min_precision, args.max_missed, args.top)